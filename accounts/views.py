@@ -1,14 +1,16 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Sum, F
 from .models import NguoiDung
 from .forms import NguoiDungForm
 from django.contrib.auth.decorators import login_required
 from products.models import SanPham
-from inventory.models import NhapKho, XuatKho, TonKho, ChiTietNhapKho, ChiTietXuatKho
+from inventory.models import NhapKho, XuatKho, TonKho, DailyStockFlow
+from inventory.cache import BoNhoDem
 from partners.models import NhaCungCap
-from django.db.models.functions import ExtractMonth
-from datetime import datetime
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from datetime import date, datetime
 import calendar
 
 
@@ -125,177 +127,144 @@ def xoa_nhan_vien(request, nhan_vien_id):
     return redirect('danh_sach_nhan_vien')
 
 
+def _khoang_thoi_gian(nam, thang=None):
+    """Mốc [bắt đầu, kết thúc) theo giờ địa phương của một năm hoặc một tháng"""
+    if thang:
+        bat_dau = datetime(nam, thang, 1)
+        ket_thuc = datetime(nam + 1, 1, 1) if thang == 12 else datetime(nam, thang + 1, 1)
+    else:
+        bat_dau = datetime(nam, 1, 1)
+        ket_thuc = datetime(nam + 1, 1, 1)
+    return timezone.make_aware(bat_dau), timezone.make_aware(ket_thuc)
+
+
 @login_required
 def dashboard(request):
-    current_year = datetime.now().year
-    current_month = datetime.now().month
+    hom_nay = timezone.localdate()
 
     # --- Xử lý bộ lọc tháng ---
     selected_month = request.GET.get('month')
-    if selected_month:
-        selected_month = int(selected_month)
+    try:
+        selected_month = int(selected_month) if selected_month else None
+    except ValueError:
+        selected_month = None
+    if selected_month and not 1 <= selected_month <= 12:
+        selected_month = None
+
+    # Số liệu chỉ đổi khi có chứng từ/tồn kho/danh mục thay đổi -> đệm theo phiên bản dữ liệu
+    context = BoNhoDem.lay_hoac_tinh(
+        'dashboard',
+        ['nhap_kho', 'xuat_kho', 'ton_kho', 'luu_chuyen', 'san_pham', 'doi_tac'],
+        lambda: _so_lieu_dashboard(hom_nay, selected_month),
+        tham_so=(hom_nay, selected_month),
+    )
+
+    return render(request, 'dashboard.html', context)
+
+
+def _so_lieu_dashboard(hom_nay, selected_month):
+    current_year = hom_nay.year
+    current_month = hom_nay.month
 
     # --- 1. Tổng quan ---
     total_products = SanPham.objects.count()
     total_suppliers = NhaCungCap.objects.count()
 
-    # --- 2. Tổng số phiếu nhập/xuất trong tháng (theo lọc) ---
-    if selected_month:
-        # Nếu có lọc theo tháng
-        imports_this_month = NhapKho.objects.filter(
-            ngay_nhap__month=selected_month,
-            ngay_nhap__year=current_year
-        ).count()
-
-        exports_this_month = XuatKho.objects.filter(
-            ngay_xuat__month=selected_month,
-            ngay_xuat__year=current_year
-        ).count()
-
-        # Tổng số lượng nhập/xuất trong tháng
-        total_import_quantity = ChiTietNhapKho.objects.filter(
-            phieu_nhap__ngay_nhap__month=selected_month,
-            phieu_nhap__ngay_nhap__year=current_year
-        ).aggregate(total=Sum('so_luong'))['total'] or 0
-
-        total_export_quantity = ChiTietXuatKho.objects.filter(
-            phieu_xuat__ngay_xuat__month=selected_month,
-            phieu_xuat__ngay_xuat__year=current_year
-        ).aggregate(total=Sum('so_luong'))['total'] or 0
-    else:
-        # Nếu không lọc, lấy tháng hiện tại
-        imports_this_month = NhapKho.objects.filter(
-            ngay_nhap__month=current_month,
-            ngay_nhap__year=current_year
-        ).count()
-
-        exports_this_month = XuatKho.objects.filter(
-            ngay_xuat__month=current_month,
-            ngay_xuat__year=current_year
-        ).count()
-
-        total_import_quantity = ChiTietNhapKho.objects.filter(
-            phieu_nhap__ngay_nhap__month=current_month,
-            phieu_nhap__ngay_nhap__year=current_year
-        ).aggregate(total=Sum('so_luong'))['total'] or 0
-
-        total_export_quantity = ChiTietXuatKho.objects.filter(
-            phieu_xuat__ngay_xuat__month=current_month,
-            phieu_xuat__ngay_xuat__year=current_year
-        ).aggregate(total=Sum('so_luong'))['total'] or 0
+    # --- 2. Tổng số phiếu nhập/xuất trong tháng (theo lọc, mặc định tháng hiện tại) ---
+    # Lọc theo khoảng thời gian để dùng được index trên cột ngày
+    bat_dau_thang, ket_thuc_thang = _khoang_thoi_gian(current_year, selected_month or current_month)
+
+    ngay_dau_thang = timezone.localtime(bat_dau_thang).date()
+    ngay_dau_thang_sau = timezone.localtime(ket_thuc_thang).date()
+
+    imports_this_month = NhapKho.objects.filter(
+        ngay_nhap__gte=bat_dau_thang, ngay_nhap__lt=ket_thuc_thang
+    ).count()
+    exports_this_month = XuatKho.objects.filter(
+        ngay_xuat__gte=bat_dau_thang, ngay_xuat__lt=ket_thuc_thang
+    ).count()
+
+    # Số lượng nhập/xuất đọc từ bảng lưu chuyển theo ngày thay vì quét dòng chi tiết
+    luu_chuyen_thang = DailyStockFlow.objects.filter(
+        ngay__gte=ngay_dau_thang, ngay__lt=ngay_dau_thang_sau
+    ).aggregate(nhap=Sum('so_luong_nhap'), xuat=Sum('so_luong_xuat'))
+    total_import_quantity = luu_chuyen_thang['nhap'] or 0
+    total_export_quantity = luu_chuyen_thang['xuat'] or 0
 
     # --- 3. Top sản phẩm tồn nhiều nhất ---
     top_stock_products = (
-        TonKho.objects.select_related('san_pham')
+        TonKho.objects
         .values('san_pham__id', 'san_pham__ten_san_pham', 'san_pham__ma_san_pham')
         .annotate(tong_ton=Sum('so_luong_ton'))
         .order_by('-tong_ton')[:5]
     )
 
-    # --- 4. Sản phẩm sắp hết hàng - ĐÃ SỬA LỖI ---
+    # --- 4. Sản phẩm sắp hết hàng: đọc index riêng phần trên cờ TonKho.sap_het ---
     low_stock = []
-    all_tonkho = TonKho.objects.select_related('san_pham').all()
-
-    for tonkho in all_tonkho:
-        if tonkho.san_pham:
-            # Kiểm tra xem sản phẩm có trường so_luong_toi_thieu không
-            so_luong_toi_thieu = getattr(tonkho.san_pham, 'so_luong_toi_thieu', 10)  # Mặc định là 10 nếu không có
-
-            # Sản phẩm sắp hết nếu tồn kho <= 10
-            if tonkho.so_luong_ton <= 10:
-                # Tính phần trăm tồn kho so với mức tối thiểu
-                try:
-                    phan_tram = (tonkho.so_luong_ton / so_luong_toi_thieu) * 100
-                except ZeroDivisionError:
-                    phan_tram = 0
-
-                low_stock.append({
-                    'san_pham': tonkho.san_pham,
-                    'so_luong_ton': tonkho.so_luong_ton,
-                    'so_luong_toi_thieu': so_luong_toi_thieu,
-                    'phan_tram_ton': round(phan_tram, 1)
-                })
-
-    # Chỉ lấy top 5 sản phẩm có tồn kho thấp nhất
-    low_stock = sorted(low_stock, key=lambda x: x['so_luong_ton'])[:5]
-
-    # --- 5. Xuất nội bộ gần đây - ĐÃ SỬA LỖI ---
-    # Sửa 'nguoi_xuat' thành 'nguoi_lap'
-    try:
-        recent_exports = XuatKho.objects.select_related('nguoi_lap').order_by('-ngay_xuat')[:5]
-    except Exception as e:
-        print(f"Lỗi khi lấy recent_exports: {e}")
-        recent_exports = XuatKho.objects.all().order_by('-ngay_xuat')[:5]
-
-    # --- 6. Biểu đồ nhập kho ---
+    for tonkho in (
+        TonKho.objects.select_related('san_pham')
+        .filter(sap_het=True)
+        .order_by('so_luong_ton', 'san_pham__ten_san_pham')[:5]
+    ):
+        so_luong_toi_thieu = tonkho.muc_toi_thieu
+        phan_tram = (tonkho.so_luong_ton / so_luong_toi_thieu) * 100 if so_luong_toi_thieu else 0
+        low_stock.append({
+            'san_pham': tonkho.san_pham,
+            'so_luong_ton': tonkho.so_luong_ton,
+            'so_luong_toi_thieu': so_luong_toi_thieu,
+            'phan_tram_ton': round(phan_tram, 1)
+        })
+
+    # --- 5. Xuất nội bộ gần đây ---
+    recent_exports = list(XuatKho.objects.select_related('nguoi_lap').order_by('-ngay_xuat')[:5])
+
+    # --- 6. Biểu đồ nhập kho: một truy vấn GROUP BY trên bảng lưu chuyển theo ngày ---
     if selected_month:
         # Nếu có lọc tháng: hiển thị theo ngày trong tháng
         days_in_month = calendar.monthrange(current_year, selected_month)[1]
         labels = [f'{i}' for i in range(1, days_in_month + 1)]
-
-        # Lấy dữ liệu nhập theo ngày
-        import_data = []
-        for day in range(1, days_in_month + 1):
-            total = ChiTietNhapKho.objects.filter(
-                phieu_nhap__ngay_nhap__day=day,
-                phieu_nhap__ngay_nhap__month=selected_month,
-                phieu_nhap__ngay_nhap__year=current_year
-            ).aggregate(total=Sum('so_luong'))['total'] or 0
-            import_data.append(total)
-
-        # Tính tổng nhập và trung bình ngày
-        total_import_month = sum(import_data)
-        avg_import_day = total_import_month / days_in_month if days_in_month > 0 else 0
-
+        tu_ngay, den_ngay = ngay_dau_thang, ngay_dau_thang_sau
+        cat_theo = F('ngay')
+        so_ky = days_in_month
         chart_title = f'Biểu đồ nhập kho tháng {selected_month}'
-
     else:
         # Nếu không lọc: hiển thị theo tháng trong năm
         labels = [f'Tháng {i}' for i in range(1, 13)]
+        tu_ngay, den_ngay = date(current_year, 1, 1), date(current_year + 1, 1, 1)
+        cat_theo = TruncMonth('ngay')
+        so_ky = 12
+        chart_title = f'Biểu đồ nhập kho năm {current_year}'
 
-        # Lấy dữ liệu nhập theo tháng
-        import_data = []
-        for month in range(1, 13):
-            total = ChiTietNhapKho.objects.filter(
-                phieu_nhap__ngay_nhap__month=month,
-                phieu_nhap__ngay_nhap__year=current_year
-            ).aggregate(total=Sum('so_luong'))['total'] or 0
-            import_data.append(total)
+    theo_ky = (
+        DailyStockFlow.objects
+        .filter(ngay__gte=tu_ngay, ngay__lt=den_ngay)
+        .annotate(ky=cat_theo)
+        .values('ky')
+        .annotate(tong=Sum('so_luong_nhap'))
+        .order_by()
+    )
+    import_data = [0] * so_ky
+    for dong in theo_ky:
+        import_data[(dong['ky'].day if selected_month else dong['ky'].month) - 1] = dong['tong'] or 0
 
-        # Tính tổng và trung bình
+    if selected_month:
+        total_import_month = sum(import_data)
+        avg_import_day = total_import_month / days_in_month
+    else:
         total_import_year = sum(import_data)
-        avg_import_month = total_import_year / 12 if len(import_data) > 0 else 0
+        avg_import_month = total_import_year / 12
 
-        chart_title = f'Biểu đồ nhập kho năm {current_year}'
-
-    # --- 7. Top nhà cung cấp (để sẵn nếu cần sau này) - ĐÃ SỬA LỖI ---
-    try:
-        top_suppliers = (
-            ChiTietNhapKho.objects.select_related('phieu_nhap__nha_cung_cap')
-            .filter(phieu_nhap__nha_cung_cap__isnull=False)
-            .values('phieu_nhap__nha_cung_cap__id', 'phieu_nhap__nha_cung_cap__ten_nha_cung_cap')
-            .annotate(
-                so_lan_nhap=Count('phieu_nhap__nha_cung_cap'),
-                tong_san_pham=Sum('so_luong')
-            )
-            .order_by('-tong_san_pham')[:5]
-        )
-    except Exception as e:
-        # Nếu vẫn lỗi, tạo danh sách rỗng
-        print(f"Lỗi query top_suppliers: {e}")
-        top_suppliers = []
-
-    # --- 8. Danh sách tháng cho dropdown ---
+    # --- 7. Danh sách tháng cho dropdown ---
     months = [
         {'value': i, 'label': f'Tháng {i}'}
         for i in range(1, 13)
     ]
 
-    # --- 9. Tính cân đối nhập/xuất ---
+    # --- 8. Tính cân đối nhập/xuất ---
     net_import = total_import_quantity - total_export_quantity
 
-    # --- 10. Context gửi đến template ---
-    context = {
+    # --- 9. Context gửi đến template ---
+    return {
         # Tổng quan
         'total_products': total_products,
         'total_suppliers': total_suppliers,
@@ -328,9 +297,4 @@ def dashboard(request):
         'avg_import_month': avg_import_month if not selected_month else 0,
         'total_import_month': total_import_month if selected_month else 0,
         'avg_import_day': avg_import_day if selected_month else 0,
-
-        # Top nhà cung cấp (để dành)
-        'top_suppliers': list(top_suppliers),
     }
-
-    return render(request, 'dashboard.html', context)
\ No newline at end of file
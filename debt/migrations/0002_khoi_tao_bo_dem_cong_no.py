@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:38
+
+from django.db import migrations
+import re
+
+
+def khoi_tao_bo_dem_cong_no(apps, schema_editor):
+    """Đặt bộ đếm CN bằng số lớn nhất trong các mã công nợ đã có"""
+    CongNo = apps.get_model('debt', 'CongNo')
+    BoDemChungTu = apps.get_model('inventory', 'BoDemChungTu')
+
+    lon_nhat = 0
+    for ma in CongNo.objects.values_list('ma_cong_no', flat=True).iterator():
+        match = re.match(r'^CN-?(\d+)$', ma or '')
+        if match:
+            lon_nhat = max(lon_nhat, int(match.group(1)))
+
+    BoDemChungTu.objects.update_or_create(tien_to='CN', defaults={'gia_tri': lon_nhat})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debt', '0001_initial'),
+        ('inventory', '0011_bodemchungtu'),
+    ]
+
+    operations = [
+        migrations.RunPython(khoi_tao_bo_dem_cong_no, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:55
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+logger = logging.getLogger(__name__)
+
+
+def chuan_hoa_cong_no_phieu_nhap(apps, schema_editor):
+    """Đổi công nợ loại cũ 'nhap_hang' sang 'phai_tra' trước khi thêm ràng buộc duy nhất
+
+    Chỉ đổi dòng cũ nhất của phiếu nhập chưa có công nợ phải trả, để ghi sổ lại không tạo
+    công nợ thứ hai. Công nợ trùng còn lại không bị xóa, chỉ được báo trong log để đối soát.
+    """
+    CongNo = apps.get_model('debt', 'CongNo')
+    da_co = CongNo.objects.filter(loai_cong_no='phai_tra').values('phieu_nhap_id')
+    dong_cu = (
+        CongNo.objects.filter(loai_cong_no='nhap_hang').exclude(phieu_nhap_id__in=da_co)
+        .values('phieu_nhap_id').annotate(id_dau=Min('id')).values_list('id_dau', flat=True)
+    )
+    CongNo.objects.filter(id__in=list(dong_cu)).update(loai_cong_no='phai_tra')
+
+    trung = list(
+        CongNo.objects.values('phieu_nhap_id').annotate(so_dong=Count('id')).filter(so_dong__gt=1)
+        .values_list('phieu_nhap_id', 'so_dong')[:50]
+    )
+    if trung:
+        logger.warning(
+            "Có phiếu nhập mang nhiều công nợ (phieu_nhap_id, số công nợ; tối đa 50 phiếu), cần đối soát: %s",
+            trung
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debt', '0002_khoi_tao_bo_dem_cong_no'),
+    ]
+
+    operations = [
+        migrations.RunPython(chuan_hoa_cong_no_phieu_nhap, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='congno',
+            constraint=models.UniqueConstraint(condition=models.Q(('loai_cong_no', 'phai_tra')), fields=('phieu_nhap',), name='cong_no_phai_tra_moi_phieu_nhap'),
+        ),
+    ]
@@ -2,8 +2,6 @@ from django.db import models
 from django.conf import settings
 from partners.models import NhaCungCap
 from inventory.models import NhapKho
-from django.utils import timezone
-import random
 
 class CongNo(models.Model):
     LOAI_CHOICES = [
@@ -22,23 +20,27 @@ class CongNo(models.Model):
     ngay_tao = models.DateTimeField(auto_now_add=True)
     han_thanh_toan = models.DateField(null=True, blank=True)  # Thêm trường này
     ghi_chu = models.TextField(blank=True, null=True)  # Thêm trường này
+
+    class Meta:
+        constraints = [
+            # Mỗi phiếu nhập chỉ có một công nợ phải trả (chặn cả hai lượt ghi sổ chạy đồng thời)
+            models.UniqueConstraint(
+                fields=['phieu_nhap'],
+                condition=models.Q(loai_cong_no='phai_tra'),
+                name='cong_no_phai_tra_moi_phieu_nhap',
+            ),
+        ]
+
     def __init__(self, *args, **kwargs):
         # Xử lý các trường không tồn tại
         kwargs.pop('some_unexpected_field', None)
         super().__init__(*args, **kwargs)
 
     def save(self, *args, **kwargs):
-        # TẠO MÃ CÔNG NỢ DUY NHẤT NẾU CHƯA CÓ
+        # TẠO MÃ CÔNG NỢ DUY NHẤT NẾU CHƯA CÓ (cấp từ bộ đếm chứng từ dùng chung)
         if not self.ma_cong_no:
-            # Cách 1: Dùng timestamp để đảm bảo duy nhất
-            timestamp = int(timezone.now().timestamp())
-            random_suffix = random.randint(100, 999)
-            self.ma_cong_no = f"CN-{timestamp}{random_suffix}"
-
-            # Kiểm tra lại để đảm bảo không trùng (rất hiếm)
-            while CongNo.objects.filter(ma_cong_no=self.ma_cong_no).exists():
-                random_suffix = random.randint(100, 999)
-                self.ma_cong_no = f"CN-{timestamp}{random_suffix}"
+            from inventory.services import CapSoChungTu
+            self.ma_cong_no = CapSoChungTu.cap_ma('CN')
 
         # TÍNH TOÁN SỐ TIỀN
         if not self.so_tien or self.so_tien == 0:
@@ -0,0 +1,119 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from inventory.models import ChiTietNhapKho, NhapKho
+from inventory.services import CapSoChungTu
+from .models import CongNo
+
+logger = logging.getLogger(__name__)
+
+# Số phiếu nhập tối đa trong một lượt đọc/ghi khi ghi sổ hàng loạt
+KICH_THUOC_LO = 500
+
+
+class QuanLyCongNo:
+    """Ghi sổ công nợ phải trả từ phiếu nhập kho
+
+    Mỗi phiếu nhập có đúng một công nợ phải trả (ràng buộc cong_no_phai_tra_moi_phieu_nhap);
+    ghi sổ lại một phiếu đã có công nợ không tạo thêm dòng mới nên gọi nhiều lần vẫn an toàn.
+    """
+
+    HAN_THANH_TOAN_NGAY = 30
+
+    @staticmethod
+    def ghi_so_sau_commit(phieu_nhap_id):
+        """Hẹn ghi sổ công nợ cho phiếu nhập sau khi giao dịch tạo phiếu commit
+
+        Phiếu nhập (chi tiết, tồn kho, tổng tiền) commit xong mới ghi công nợ, nên
+        request tạo phiếu không phải giữ khóa ghi cho phần sổ công nợ. Lỗi ghi sổ
+        chỉ được ghi log, không làm hỏng phiếu nhập đã commit.
+        """
+        transaction.on_commit(partial(QuanLyCongNo.ghi_so_hang_loat, [phieu_nhap_id]), robust=True)
+
+    @staticmethod
+    def tom_tat(phieu_nhap_ids):
+        """Tóm tắt phiếu nhập chưa có công nợ bằng một truy vấn tổng hợp (không tải từng dòng chi tiết)
+
+        Trả về danh sách dict: id, ma_phieu, nha_cung_cap_id, tong_tien, so_dong, so_luong, ten_dau
+        (tên sản phẩm của dòng chi tiết đầu tiên). Bỏ qua phiếu có tổng tiền bằng 0.
+        """
+        ten_dau = ChiTietNhapKho.objects.filter(phieu_nhap=OuterRef('pk')).order_by('id').values(
+            'san_pham__ten_san_pham'
+        )[:1]
+        return list(
+            NhapKho.objects.filter(pk__in=phieu_nhap_ids, tong_tien__gt=0)
+            .exclude(pk__in=CongNo.objects.filter(loai_cong_no='phai_tra').values('phieu_nhap_id'))
+            .values('id', 'ma_phieu', 'nha_cung_cap_id', 'tong_tien')
+            .annotate(
+                so_dong=Count('chi_tiet_nhap'),
+                so_luong=Sum('chi_tiet_nhap__so_luong'),
+                ten_dau=Subquery(ten_dau),
+            )
+            .order_by('id')
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def ghi_so_hang_loat(phieu_nhap_ids):
+        """Ghi sổ công nợ phải trả cho nhiều phiếu nhập, trả về số công nợ đã tạo
+
+        Mỗi lô: một truy vấn tóm tắt, một lệnh cấp khối mã CN, một bulk_create.
+        """
+        phieu_nhap_ids = list(phieu_nhap_ids)
+        han_thanh_toan = timezone.localdate() + timedelta(days=QuanLyCongNo.HAN_THANH_TOAN_NGAY)
+        da_tao = 0
+        for dau in range(0, len(phieu_nhap_ids), KICH_THUOC_LO):
+            tom_tat = QuanLyCongNo.tom_tat(phieu_nhap_ids[dau:dau + KICH_THUOC_LO])
+            if not tom_tat:
+                continue
+
+            cong_no = []
+            for phieu, ma_cong_no in zip(tom_tat, CapSoChungTu.cap_ma_hang_loat('CN', len(tom_tat))):
+                ten_hang_hoa = phieu['ten_dau'] or 'Hàng nhập kho'
+                if phieu['so_dong'] > 1:
+                    ten_hang_hoa += f" và {phieu['so_dong'] - 1} sản phẩm khác"
+                so_luong = phieu['so_luong'] or 1
+                cong_no.append(CongNo(
+                    ma_cong_no=ma_cong_no,
+                    nha_cung_cap_id=phieu['nha_cung_cap_id'],
+                    phieu_nhap_id=phieu['id'],
+                    loai_cong_no='phai_tra',
+                    ten_hang_hoa=ten_hang_hoa[:255],
+                    so_luong=so_luong,
+                    don_gia=(phieu['tong_tien'] / so_luong).quantize(Decimal('0.01')),
+                    so_tien=phieu['tong_tien'],
+                    so_tien_con_lai=phieu['tong_tien'],
+                    han_thanh_toan=han_thanh_toan,
+                    ghi_chu=f"Công nợ từ phiếu nhập {phieu['ma_phieu']}",
+                ))
+            # bulk_create bỏ qua CongNo.save(): mã và số tiền đã được gán đủ ở trên
+            try:
+                with transaction.atomic():
+                    CongNo.objects.bulk_create(cong_no)
+                da_tao += len(cong_no)
+            except IntegrityError:
+                # Lượt ghi sổ khác vừa tạo công nợ cho một phần lô -> ghi từng phiếu, bỏ qua phiếu đã có
+                da_tao += QuanLyCongNo._ghi_tung_phieu(cong_no)
+
+        if da_tao:
+            logger.info("Đã ghi sổ %s công nợ phải trả từ phiếu nhập", da_tao)
+        return da_tao
+
+    @staticmethod
+    def _ghi_tung_phieu(cong_no):
+        """Ghi từng công nợ trong savepoint riêng; trả về số công nợ ghi được"""
+        da_tao = 0
+        for mot in cong_no:
+            try:
+                with transaction.atomic():
+                    CongNo.objects.bulk_create([mot])
+                da_tao += 1
+            except IntegrityError:
+                logger.info("Phiếu nhập %s đã có công nợ phải trả, bỏ qua", mot.phieu_nhap_id)
+        return da_tao
@@ -1,3 +1,99 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 
-# Create your tests here.
+from debt.models import CongNo
+from debt.services import QuanLyCongNo
+from inventory.models import Kho
+from inventory.services import QuanLyNhapKho
+from inventory.tests import NganSachTruyVanMixin, TruongHop, tao_nguoi_dung
+from partners.models import NhaCungCap
+from products.models import DanhMucSanPham, DonViTinh, SanPham
+
+
+class NganSachTruyVanCongNoTest(NganSachTruyVanMixin, TestCase):
+    URLCONF = 'debt.urls'
+
+    def cac_truong_hop(self):
+        cong_no = CongNo.objects.filter(so_tien_con_lai__gt=0).first()
+        return [
+            TruongHop('debt:congno_list', so_truy_van=4),
+            TruongHop('debt:congno_create', so_truy_van=4),
+            TruongHop('debt:congno_detail', {'pk': cong_no.pk}, so_truy_van=5),
+            TruongHop('debt:thanh_toan', {'pk': cong_no.pk}, method='post', so_truy_van=5),
+        ]
+
+
+class GhiSoCongNoTest(TestCase):
+    """Công nợ phải trả được ghi sổ một lần cho mỗi phiếu nhập, sau khi phiếu commit"""
+
+    @classmethod
+    def setUpTestData(cls):
+        danh_muc = DanhMucSanPham.objects.create(ten_danh_muc='Danh mục')
+        don_vi = DonViTinh.objects.create(ten_don_vi='Cái')
+        cls.san_pham = [
+            SanPham.objects.create(
+                danh_muc=danh_muc, don_vi_tinh=don_vi, ma_san_pham=f'SP-{i:04d}',
+                ten_san_pham=f'Sản phẩm {i}', gia_nhap=1000, gia_ban=2000
+            )
+            for i in range(1, 4)
+        ]
+        cls.kho = Kho.objects.create(ma_kho='K1', ten_kho='Kho 1', dia_chi='HN')
+        cls.nha_cung_cap = NhaCungCap.objects.create(
+            ma_nha_cung_cap='NCC-0001', ten_nha_cung_cap='Nhà cung cấp', dia_chi='HN', dien_thoai='0900'
+        )
+        cls.nguoi_dung = tao_nguoi_dung('nv')
+
+    def tao_phieu(self):
+        return QuanLyNhapKho.tao_phieu_nhap(
+            self.kho, self.nha_cung_cap, self.nguoi_dung,
+            [(sp.id, 2, Decimal('1500')) for sp in self.san_pham]
+        )
+
+    def test_ghi_so_sau_commit_mot_lan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            phieu = self.tao_phieu()
+            # Chưa commit thì chưa có công nợ
+            self.assertFalse(CongNo.objects.filter(phieu_nhap=phieu).exists())
+
+        cong_no = CongNo.objects.get(phieu_nhap=phieu)
+        self.assertEqual(cong_no.loai_cong_no, 'phai_tra')
+        self.assertEqual(cong_no.so_tien, Decimal('9000'))
+        self.assertEqual(cong_no.so_tien_con_lai, Decimal('9000'))
+        self.assertEqual(cong_no.so_luong, 6)
+        self.assertEqual(cong_no.ten_hang_hoa, 'Sản phẩm 1 và 2 sản phẩm khác')
+        self.assertTrue(cong_no.ma_cong_no.startswith('CN-'))
+
+        # Ghi sổ lại không tạo thêm công nợ
+        self.assertEqual(QuanLyCongNo.ghi_so_hang_loat([phieu.id]), 0)
+        self.assertEqual(CongNo.objects.filter(phieu_nhap=phieu).count(), 1)
+
+    def test_ghi_so_hang_loat(self):
+        phieu_ids = [self.tao_phieu().id for _ in range(5)]
+        with self.assertNumQueries(1):
+            self.assertEqual(len(QuanLyCongNo.tom_tat(phieu_ids)), 5)
+
+        self.assertEqual(QuanLyCongNo.ghi_so_hang_loat(phieu_ids), 5)
+        ma = list(CongNo.objects.filter(phieu_nhap_id__in=phieu_ids).order_by('phieu_nhap_id').values_list(
+            'ma_cong_no', flat=True
+        ))
+        self.assertEqual(len(set(ma)), 5)
+        self.assertEqual(QuanLyCongNo.ghi_so_hang_loat(phieu_ids), 0)
+
+    def test_hai_luot_ghi_so_dong_thoi_chi_tao_mot_cong_no(self):
+        phieu_ids = [self.tao_phieu().id for _ in range(3)]
+        # Lượt thứ nhất đọc tóm tắt trước khi lượt thứ hai ghi sổ phiếu đầu tiên
+        tom_tat_cu = QuanLyCongNo.tom_tat(phieu_ids)
+        self.assertEqual(QuanLyCongNo.ghi_so_hang_loat(phieu_ids[:1]), 1)
+
+        with mock.patch.object(QuanLyCongNo, 'tom_tat', return_value=tom_tat_cu):
+            self.assertEqual(QuanLyCongNo.ghi_so_hang_loat(phieu_ids), 2)
+        for phieu_id in phieu_ids:
+            self.assertEqual(CongNo.objects.filter(phieu_nhap_id=phieu_id, loai_cong_no='phai_tra').count(), 1)
+
+        cong_no = CongNo.objects.get(phieu_nhap_id=phieu_ids[0])
+        cong_no.pk, cong_no.ma_cong_no = None, 'CN-TRUNG'
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            cong_no.save()
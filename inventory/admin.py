@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import NhapKho, ChiTietNhapKho, XuatKho, ChiTietXuatKho
 from .models import KiemKe, ChiTietKiemKe
-from .models import Kho, TonKho
+from .models import Kho, TonKho, StockMovement
 
 class ChiTietNhapKhoInline(admin.TabularInline):
     model = ChiTietNhapKho
@@ -67,4 +67,22 @@ class KhoAdmin(admin.ModelAdmin):
 class TonKhoAdmin(admin.ModelAdmin):
     list_display = ['kho', 'san_pham', 'so_luong_ton', 'so_luong_kha_dung', 'ngay_cap_nhat']
     list_filter = ['kho', 'san_pham']
-    search_fields = ['kho__ten_kho', 'san_pham__ten_san_pham']
\ No newline at end of file
+    search_fields = ['kho__ten_kho', 'san_pham__ten_san_pham']
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['thoi_gian', 'kho', 'san_pham', 'loai', 'so_luong', 'gia_tri', 'chung_tu']
+    list_filter = ['loai', 'kho']
+    search_fields = ['chung_tu', 'san_pham__ma_san_pham']
+    date_hierarchy = 'thoi_gian'
+
+    # Nhật ký chỉ ghi thêm từ nghiệp vụ, không sửa/xóa tay
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
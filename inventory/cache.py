@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class BoNhoDem:
+    """Bộ nhớ đệm theo phiên bản dữ liệu
+
+    Mỗi nhóm dữ liệu (nhap_kho, xuat_kho, ton_kho, kiem_ke, ...) có một số phiên bản
+    lưu trong cache. Khối dữ liệu đã tính được lưu dưới khóa chứa phiên bản của các
+    nhóm mà nó phụ thuộc, nên khi dữ liệu đổi chỉ cần tăng phiên bản - khóa cũ không
+    còn được đọc và tự hết hạn.
+    """
+
+    TIEN_TO = 'bnd'
+    NHOM = ['nhap_kho', 'xuat_kho', 'ton_kho', 'kiem_ke', 'luu_chuyen', 'san_pham', 'kho', 'doi_tac']
+
+    _khoa_dem = threading.Lock()
+    _dem = defaultdict(lambda: {'hit': 0, 'miss': 0})
+
+    @staticmethod
+    def _khoa_phien_ban(nhom):
+        return f'{BoNhoDem.TIEN_TO}:pb:{nhom}'
+
+    @staticmethod
+    def phien_ban(*nhom):
+        """Phiên bản hiện tại của các nhóm, đọc bằng một lệnh get_many"""
+        khoa = [BoNhoDem._khoa_phien_ban(n) for n in nhom]
+        gia_tri = cache.get_many(khoa)
+        ket_qua = []
+        for k in khoa:
+            if k not in gia_tri:
+                # Phiên bản bị mất (cache khởi động lại/bị dọn) -> khởi tạo theo thời gian
+                # để không trùng với phiên bản cũ còn sót khối dữ liệu
+                cache.add(k, time.time_ns(), timeout=None)
+                gia_tri[k] = cache.get(k)
+            ket_qua.append(gia_tri[k])
+        return tuple(ket_qua)
+
+    @staticmethod
+    def _tang_ngay(*nhom):
+        for n in nhom:
+            khoa = BoNhoDem._khoa_phien_ban(n)
+            try:
+                cache.incr(khoa)
+            except ValueError:
+                cache.set(khoa, time.time_ns(), timeout=None)
+
+    @staticmethod
+    def tang_phien_ban(*nhom):
+        """Tăng phiên bản sau khi giao dịch hiện tại commit (ngay lập tức nếu không trong giao dịch)"""
+        transaction.on_commit(lambda: BoNhoDem._tang_ngay(*nhom))
+
+    @staticmethod
+    def lay_hoac_tinh(ten, phu_thuoc, ham_tinh, tham_so=(), timeout=None):
+        """Trả về khối dữ liệu đã đệm, hoặc gọi ham_tinh() và lưu lại
+
+        ten: tên khối (dùng cho bộ đếm hit/miss), phu_thuoc: các nhóm dữ liệu khối này
+        đọc từ, tham_so: các giá trị làm khối khác nhau (bộ lọc, tháng, trang...).
+        """
+        chu_ky = hashlib.md5(repr((BoNhoDem.phien_ban(*phu_thuoc), tuple(tham_so))).encode()).hexdigest()
+        khoa = f'{BoNhoDem.TIEN_TO}:{ten}:{chu_ky}'
+
+        gia_tri = cache.get(khoa)
+        if gia_tri is not None:
+            BoNhoDem._ghi_dem(ten, 'hit')
+            return gia_tri
+
+        BoNhoDem._ghi_dem(ten, 'miss')
+        gia_tri = ham_tinh()
+        if timeout is None:
+            cache.set(khoa, gia_tri)
+        else:
+            cache.set(khoa, gia_tri, timeout)
+        return gia_tri
+
+    @staticmethod
+    def _ghi_dem(ten, loai):
+        with BoNhoDem._khoa_dem:
+            BoNhoDem._dem[ten][loai] += 1
+
+    @staticmethod
+    def thong_ke():
+        """Số lần hit/miss theo từng khối trong tiến trình hiện tại"""
+        with BoNhoDem._khoa_dem:
+            ket_qua = {}
+            for ten, dem in BoNhoDem._dem.items():
+                tong = dem['hit'] + dem['miss']
+                ket_qua[ten] = {
+                    'hit': dem['hit'],
+                    'miss': dem['miss'],
+                    'ti_le_hit': round(dem['hit'] / tong, 4) if tong else 0,
+                }
+            return ket_qua
+
+    @staticmethod
+    def dat_lai_thong_ke():
+        with BoNhoDem._khoa_dem:
+            BoNhoDem._dem.clear()
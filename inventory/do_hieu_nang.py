@@ -0,0 +1,242 @@
+import math
+import time
+import tracemalloc
+from contextlib import ExitStack
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from partners.models import NhaCungCap
+from products.models import SanPham
+from .middleware import BanGhiTruyVan
+from .models import KiemKe, Kho, TonKho
+from .services import QuanLyKiemKe, QuanLyNhapKho, QuanLyXuatKho
+
+# Tham số SinhDuLieuMau cho từng quy mô dữ liệu (số dòng nhập ~ phieu_nhap x 10)
+QUY_MO = {
+    'nho': {
+        'so_kho': 5, 'so_san_pham': 1000, 'so_nha_cung_cap': 30, 'so_nhan_vien': 20,
+        'so_phieu_nhap': 1000, 'so_phieu_chuyen': 300, 'so_kiem_ke': 10, 'dong_moi_kiem_ke': 100, 'so_ngay': 90,
+    },
+    'vua': {
+        'so_kho': 10, 'so_san_pham': 5000, 'so_nha_cung_cap': 200, 'so_nhan_vien': 30,
+        'so_phieu_nhap': 10000, 'so_phieu_chuyen': 3000, 'so_kiem_ke': 50, 'dong_moi_kiem_ke': 200, 'so_ngay': 365,
+    },
+    'lon': {
+        'so_kho': 20, 'so_san_pham': 20000, 'so_nha_cung_cap': 500, 'so_nhan_vien': 60,
+        'so_phieu_nhap': 100000, 'so_phieu_chuyen': 20000, 'so_kiem_ke': 200, 'dong_moi_kiem_ke': 500,
+        'so_ngay': 365,
+    },
+}
+
+# Ngưỡng tuyệt đối dưới đó chênh lệch được coi là nhiễu đo
+SAN_THOI_GIAN_MS = 1.0
+SAN_BO_NHO_KB = 64
+SO_DONG_MOI_PHIEU = 20
+
+
+def phan_vi(gia_tri, p):
+    """Phân vị p (0-100) theo hạng gần nhất của danh sách đã sắp xếp"""
+    if not gia_tri:
+        return None
+    return gia_tri[max(0, math.ceil(p / 100 * len(gia_tri)) - 1)]
+
+
+def so_sanh_moc(ket_qua, moc, nguong=0.2):
+    """So kết quả đo với mốc; trả về (hoi_quy, cai_thien) là danh sách chỉ số thay đổi
+
+    Thời gian (p50/p95) và bộ nhớ đỉnh bị coi là hồi quy khi tăng quá nguong (tỉ lệ) và
+    vượt ngưỡng nhiễu tuyệt đối; số truy vấn là tất định nên chỉ cần tăng là hồi quy.
+    """
+    hoi_quy, cai_thien = [], []
+    for ten, hien_tai in ket_qua.items():
+        cu = moc.get(ten)
+        if not cu:
+            continue
+        for chi_so, san in (('p50_ms', SAN_THOI_GIAN_MS), ('p95_ms', SAN_THOI_GIAN_MS),
+                            ('bo_nho_dinh_kb', SAN_BO_NHO_KB), ('so_truy_van', 0)):
+            if chi_so not in cu or chi_so not in hien_tai:
+                continue
+            truoc, sau = cu[chi_so], hien_tai[chi_so]
+            ti_le = 0 if chi_so == 'so_truy_van' else nguong
+            thay_doi = {
+                'kich_ban': ten, 'chi_so': chi_so, 'moc': truoc, 'hien_tai': sau,
+                'thay_doi_phan_tram': round((sau - truoc) / truoc * 100, 1) if truoc else None,
+            }
+            if sau > truoc * (1 + ti_le) and sau - truoc > san:
+                hoi_quy.append(thay_doi)
+            elif sau < truoc * (1 - ti_le) and truoc - sau > san:
+                cai_thien.append(thay_doi)
+    return hoi_quy, cai_thien
+
+
+class BoDoHieuNang:
+    """Chạy các kịch bản đo qua test client (đủ middleware, view, template) và tầng dịch vụ
+
+    Mỗi kịch bản chạy khoi_dong lần làm nóng rồi so_lan lần đo thời gian và số truy vấn
+    (đếm bằng BanGhiTruyVan như middleware giám sát). Bộ nhớ đỉnh đo ở một lần chạy riêng
+    dưới tracemalloc để việc theo dõi cấp phát không làm sai lệch thời gian.
+    Kịch bản ghi dữ liệu (tạo phiếu) được commit thật như khi người dùng thao tác.
+    """
+
+    def __init__(self, so_lan=20, khoi_dong=2, xoa_bo_nho_dem=True):
+        self.so_lan = so_lan
+        self.khoi_dong = khoi_dong
+        self.xoa_bo_nho_dem = xoa_bo_nho_dem
+        self.client = Client(HTTP_HOST='localhost')
+        self._chuan_bi()
+
+    def _chuan_bi(self):
+        NguoiDung = get_user_model()
+        self.nguoi_dung = NguoiDung.objects.filter(is_superuser=True).order_by('id').first()
+        if self.nguoi_dung is None:
+            raise ValueError('CSDL đo không có tài khoản quản trị')
+        self.client.force_login(self.nguoi_dung)
+
+        # Kho nhiều hàng nhất làm kho xuất để đủ tồn cho mọi lần tạo phiếu chuyển
+        kho = list(Kho.objects.order_by('id'))
+        so_dong_ton = {k.id: 0 for k in kho}
+        for kho_id in TonKho.objects.filter(so_luong_kha_dung__gt=0).values_list('kho_id', flat=True):
+            so_dong_ton[kho_id] += 1
+        kho.sort(key=lambda k: -so_dong_ton[k.id])
+        self.kho_xuat, self.kho_nhan = kho[0], kho[1]
+        self.nha_cung_cap = NhaCungCap.objects.order_by('id').first()
+
+        self.san_pham_nhap = list(
+            SanPham.objects.order_by('id').values_list('id', 'gia_nhap')[:SO_DONG_MOI_PHIEU]
+        )
+        # Mỗi lần chạy (HTTP + dịch vụ, kể cả làm nóng và đo bộ nhớ) chuyển 1 đơn vị mỗi dòng
+        can_ton = 2 * (self.so_lan + self.khoi_dong + 1)
+        self.san_pham_chuyen = list(
+            TonKho.objects.filter(kho=self.kho_xuat, so_luong_kha_dung__gte=can_ton)
+            .order_by('san_pham_id').values_list('san_pham_id', flat=True)[:SO_DONG_MOI_PHIEU]
+        )
+        self.kiem_ke = KiemKe.objects.select_related('kho').order_by('-id').first()
+
+    # --- Kịch bản ---
+
+    def _get(self, ten, **kwargs):
+        response = self.client.get(reverse(ten, kwargs=kwargs or None))
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code
+
+    def _post(self, ten, du_lieu):
+        return self.client.post(reverse(ten), du_lieu).status_code
+
+    def _nhap_kho_http(self):
+        return self._post('inventory:nhap_kho_create', {
+            'kho_id': self.kho_xuat.id, 'nha_cung_cap_id': self.nha_cung_cap.id,
+            'san_pham_id': [sp_id for sp_id, _ in self.san_pham_nhap],
+            'so_luong': ['5'] * len(self.san_pham_nhap),
+            'don_gia': [str(gia) for _, gia in self.san_pham_nhap],
+        })
+
+    def _nhap_kho_dich_vu(self):
+        QuanLyNhapKho.tao_phieu_nhap(
+            self.kho_xuat, self.nha_cung_cap, self.nguoi_dung,
+            [(sp_id, 5, Decimal(gia)) for sp_id, gia in self.san_pham_nhap]
+        )
+
+    def _chuyen_kho_http(self):
+        return self._post('inventory:xuatkho_form', {
+            'kho_xuat': self.kho_xuat.id, 'kho_nhan': self.kho_nhan.id,
+            'san_pham_id': self.san_pham_chuyen, 'so_luong': ['1'] * len(self.san_pham_chuyen),
+        })
+
+    def _chuyen_kho_dich_vu(self):
+        QuanLyXuatKho.tao_phieu_chuyen(
+            self.kho_xuat, self.kho_nhan, self.nguoi_dung, [(sp_id, 1) for sp_id in self.san_pham_chuyen]
+        )
+
+    def _phieu_kiem_ke_dich_vu(self):
+        san_phams = SanPham.objects.select_related('don_vi_tinh').order_by('ma_san_pham')[:50]
+        QuanLyKiemKe.lap_phieu_dem(self.kiem_ke, san_phams)
+
+    def _phieu_kiem_ke_http(self):
+        return self._get('inventory:chi_tiet_kiem_ke', id=self.kiem_ke.id)
+
+    # {tên: (mô tả, hàm)}; hàm nhận bộ đo, trả về mã HTTP (kịch bản qua client) hoặc None
+    KICH_BAN = {
+        'nhap_kho_http': ('POST tạo phiếu nhập 20 dòng', _nhap_kho_http),
+        'nhap_kho_dich_vu': ('QuanLyNhapKho.tao_phieu_nhap 20 dòng', _nhap_kho_dich_vu),
+        'chuyen_kho_http': ('POST tạo phiếu chuyển kho 20 dòng', _chuyen_kho_http),
+        'chuyen_kho_dich_vu': ('QuanLyXuatKho.tao_phieu_chuyen 20 dòng', _chuyen_kho_dich_vu),
+        'phieu_kiem_ke_http': ('Trang phiếu đếm kiểm kê', _phieu_kiem_ke_http),
+        'phieu_kiem_ke_dich_vu': ('QuanLyKiemKe.lap_phieu_dem 50 sản phẩm', _phieu_kiem_ke_dich_vu),
+        'dashboard': ('Trang tổng quan', lambda bo_do: bo_do._get('dashboard')),
+        'bao_cao': ('Dashboard báo cáo', lambda bo_do: bo_do._get('reports_dashboard')),
+        'ds_phieu_nhap': ('Danh sách phiếu nhập', lambda bo_do: bo_do._get('inventory:nhapkho_list')),
+        'ds_phieu_chuyen': ('Danh sách phiếu chuyển kho', lambda bo_do: bo_do._get('inventory:xuatkho_list')),
+        'ds_kiem_ke': ('Danh sách đợt kiểm kê', lambda bo_do: bo_do._get('inventory:danh_sach_kiem_ke')),
+        'ds_ton_kho': ('Trang tồn kho', lambda bo_do: bo_do._get('inventory:chi_tiet_ton_kho')),
+        'ma_tran_ton_kho': ('Ma trận tồn kho sản phẩm x kho', lambda bo_do: bo_do._get('inventory:ma_tran_ton_kho_json')),
+        'ds_cong_no': ('Danh sách công nợ', lambda bo_do: bo_do._get('debt:congno_list')),
+        'xuat_ton_kho_csv': ('Xuất tồn kho CSV', lambda bo_do: bo_do._get('inventory:xuat_ton_kho_csv')),
+        'bao_cao_nhap_xuat_json': (
+            'Báo cáo nhập - xuất (JSON)', lambda bo_do: bo_do._get('import_export_report_json')
+        ),
+    }
+
+    # --- Đo ---
+
+    def _chay_mot_lan(self, ten, ham):
+        if self.xoa_bo_nho_dem:
+            cache.clear()
+        ban_ghi = BanGhiTruyVan()
+        with ExitStack() as ngan_xep:
+            for ket_noi in connections.all():
+                ngan_xep.enter_context(ket_noi.execute_wrapper(ban_ghi))
+            bat_dau = time.perf_counter()
+            ma = ham(self)
+            thoi_gian = time.perf_counter() - bat_dau
+        if ma is not None and ma >= 400:
+            raise ValueError(f'Kịch bản {ten} trả về HTTP {ma}')
+        return thoi_gian * 1000, ban_ghi.so_truy_van
+
+    def _bo_nho_dinh(self, ten, ham):
+        dang_theo_doi = tracemalloc.is_tracing()
+        if not dang_theo_doi:
+            tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            truoc = tracemalloc.get_traced_memory()[0]
+            self._chay_mot_lan(ten, ham)
+            return (tracemalloc.get_traced_memory()[1] - truoc) / 1024
+        finally:
+            if not dang_theo_doi:
+                tracemalloc.stop()
+
+    def do(self, ten, ham):
+        for _ in range(self.khoi_dong):
+            self._chay_mot_lan(ten, ham)
+        thoi_gian, so_truy_van = [], []
+        for _ in range(self.so_lan):
+            ms, so = self._chay_mot_lan(ten, ham)
+            thoi_gian.append(ms)
+            so_truy_van.append(so)
+        thoi_gian.sort()
+        return {
+            'so_lan': self.so_lan,
+            'p50_ms': round(phan_vi(thoi_gian, 50), 2),
+            'p95_ms': round(phan_vi(thoi_gian, 95), 2),
+            'tb_ms': round(sum(thoi_gian) / len(thoi_gian), 2),
+            'min_ms': round(thoi_gian[0], 2),
+            'max_ms': round(thoi_gian[-1], 2),
+            'so_truy_van': max(so_truy_van),
+            'bo_nho_dinh_kb': round(self._bo_nho_dinh(ten, ham), 1),
+        }
+
+    def chay(self, cac_ten=None, bao_cao=None):
+        """Đo các kịch bản được chọn (mặc định tất cả); trả về {tên: kết quả}"""
+        ket_qua = {}
+        for ten in cac_ten or self.KICH_BAN:
+            mo_ta, ham = self.KICH_BAN[ten]
+            ket_qua[ten] = {'mo_ta': mo_ta, **self.do(ten, ham)}
+            if bao_cao:
+                bao_cao(ten, ket_qua[ten])
+        return ket_qua
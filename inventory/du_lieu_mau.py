@@ -0,0 +1,481 @@
+import math
+import random
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from debt.models import CongNo, LichSuThanhToan
+from debt.services import QuanLyCongNo
+from partners.models import NhaCungCap
+from products.models import DanhMucSanPham, DonViTinh, SanPham
+from settings_app.models import Profile
+from .cache import BoNhoDem
+from .models import (
+    BoDemChungTu, ChiTietKiemKe, ChiTietNhapKho, ChiTietXuatKho, DailyStockFlow, KiemKe, Kho, NhapKho,
+    StockMovement, TonKho, XuatKho,
+)
+from .search import TimKiemChungTu
+from .services import CapSoChungTu
+
+DANH_MUC = {
+    'Văn phòng phẩm': ['Bút bi', 'Bút chì', 'Giấy A4', 'Sổ tay', 'Bìa hồ sơ', 'Kẹp giấy', 'Băng keo', 'Ghim bấm'],
+    'Thực phẩm': ['Mì gói', 'Dầu ăn', 'Nước mắm', 'Đường', 'Gạo', 'Bánh quy', 'Hạt nêm'],
+    'Đồ uống': ['Nước suối', 'Trà xanh', 'Cà phê', 'Sữa tươi', 'Nước ngọt', 'Nước tăng lực'],
+    'Hóa mỹ phẩm': ['Xà phòng', 'Dầu gội', 'Kem đánh răng', 'Nước rửa chén', 'Bột giặt'],
+    'Điện gia dụng': ['Bóng đèn', 'Ổ cắm', 'Dây điện', 'Pin', 'Quạt điện', 'Công tắc'],
+    'Đồ gia dụng': ['Khăn giấy', 'Túi rác', 'Chổi', 'Móc treo', 'Hộp nhựa'],
+}
+THUONG_HIEU = [
+    'Thiên Long', 'Hồng Hà', 'Vinamilk', 'Trung Nguyên', 'Acecook', 'Điện Quang', 'Rạng Đông',
+    'Masan', 'Bình Minh', 'Sao Mai', 'Hòa Phát', 'Kinh Đô', 'Tân Hiệp Phát', 'Duy Tân',
+]
+QUY_CACH = ['loại 1', 'loại 2', '250g', '500g', '1kg', '500ml', '1 lít', 'hộp 10', 'thùng 24', 'cỡ lớn', 'cỡ nhỏ']
+DON_VI = ['Cái', 'Hộp', 'Thùng', 'Kg', 'Chai', 'Gói', 'Ram', 'Cuộn']
+TINH_THANH = [
+    'Hà Nội', 'Hồ Chí Minh', 'Đà Nẵng', 'Hải Phòng', 'Cần Thơ', 'Bình Dương', 'Đồng Nai',
+    'Nghệ An', 'Thừa Thiên Huế', 'Khánh Hòa', 'Quảng Ninh', 'Bắc Ninh', 'Lâm Đồng', 'Thanh Hóa',
+]
+TEN_CONG_TY = [
+    'Minh Phát', 'Hoàng Long', 'An Khang', 'Phú Thịnh', 'Tân Tiến', 'Đại Việt', 'Thành Công',
+    'Hưng Thịnh', 'Việt Tiến', 'Hải Âu', 'Nam Á', 'Đông Dương', 'Phương Nam', 'Kim Ngân',
+]
+HO = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ']
+TEN = ['An', 'Bình', 'Chi', 'Dũng', 'Giang', 'Hà', 'Hải', 'Hạnh', 'Hùng', 'Lan', 'Linh', 'Minh', 'Nam', 'Thảo', 'Tú']
+
+# Cột ghi trực tiếp cho các bảng chứng từ; mỗi dòng sinh ra là một tuple theo đúng thứ tự này
+COT_GHI = {
+    NhapKho: ('id', 'ma_phieu', 'kho', 'nha_cung_cap', 'nguoi_lap', 'ngay_nhap', 'ngay_tao', 'tong_tien',
+              'trang_thai', 'ghi_chu'),
+    ChiTietNhapKho: ('id', 'phieu_nhap', 'san_pham', 'so_luong', 'don_gia', 'thanh_tien'),
+    XuatKho: ('id', 'ma_phieu', 'kho', 'kho_nhan', 'nguoi_lap', 'ngay_xuat', 'ngay_tao', 'ghi_chu'),
+    ChiTietXuatKho: ('id', 'phieu_xuat', 'san_pham', 'so_luong'),
+    KiemKe: ('id', 'ma_kiem_ke', 'ten_dot_kiem_ke', 'ngay_kiem_ke', 'kho', 'nguoi_phu_trach', 'trang_thai', 'mo_ta',
+             'ma_dieu_chinh', 'ngay_ghi_so', 'ngay_tao', 'ngay_cap_nhat'),
+    ChiTietKiemKe: ('id', 'kiem_ke', 'san_pham', 'so_luong_he_thong', 'so_luong_thuc_te', 'chenh_lech', 'ghi_chu'),
+    CongNo: ('id', 'phieu_nhap', 'nha_cung_cap', 'ma_cong_no', 'loai_cong_no', 'ten_hang_hoa', 'so_luong', 'don_gia',
+             'so_tien', 'so_tien_con_lai', 'ngay_tao', 'han_thanh_toan', 'ghi_chu'),
+    LichSuThanhToan: ('id', 'cong_no', 'so_tien', 'ngay_thanh_toan', 'nguoi_thanh_toan'),
+    StockMovement: ('id', 'kho', 'san_pham', 'thoi_gian', 'loai', 'so_luong', 'gia_tri', 'chung_tu'),
+    DailyStockFlow: ('id', 'kho', 'san_pham', 'ngay', 'so_luong_nhap', 'gia_tri_nhap', 'so_luong_nhan',
+                     'so_luong_xuat'),
+}
+COT_TON_KHO = ('kho', 'san_pham', 'so_luong_ton', 'so_luong_kha_dung', 'muc_toi_thieu', 'sap_het', 'ngay_cap_nhat')
+
+
+class SinhDuLieuMau:
+    """Sinh dữ liệu kho giả lập có tính tất định: cùng tham số và seed -> cùng dữ liệu
+
+    Chứng từ được sinh theo thứ tự thời gian trong so_ngay ngày tính đến hôm nay (ít phiếu
+    vào cuối tuần, lượng phiếu tăng dần về cuối kỳ); sản phẩm, kho và nhà cung cấp được
+    chọn theo phân phối lệch (vài mặt hàng/kho chiếm phần lớn giao dịch). Phiếu chuyển và
+    kiểm kê chỉ dùng hàng đang có ở kho tại thời điểm đó nên tồn kho không bao giờ âm.
+
+    Danh mục (người dùng, sản phẩm, kho...) ghi bằng bulk_create. Chứng từ - phần chiếm gần
+    hết số dòng - được sinh thành tuple với id cấp trước và ghi bằng executemany theo lô
+    KICH_THUOC_LO phiếu, bỏ qua việc dựng model instance nên hàng triệu dòng chỉ mất vài phút.
+    DailyStockFlow được cộng trong lúc sinh (mỗi ngày một lần) và TonKho ghi từ chính số dư
+    đã cộng, nên khớp với rebuild_luu_chuyen/rebuild_ton_kho; chỉ mục tìm kiếm dựng lại ở cuối.
+    """
+
+    KICH_THUOC_LO = 2000
+    KICH_THUOC_BULK = 5000
+
+    def __init__(self, so_kho=10, so_san_pham=5000, so_nha_cung_cap=200, so_nhan_vien=30,
+                 so_phieu_nhap=10000, dong_moi_phieu_nhap=10, so_phieu_chuyen=3000, dong_moi_phieu_chuyen=6,
+                 so_kiem_ke=50, dong_moi_kiem_ke=200, so_ngay=365, seed=2024, bao_cao=None):
+        self.so_kho = so_kho
+        self.so_san_pham = so_san_pham
+        self.so_nha_cung_cap = so_nha_cung_cap
+        self.so_nhan_vien = so_nhan_vien
+        self.so_phieu_nhap = so_phieu_nhap
+        self.dong_moi_phieu_nhap = dong_moi_phieu_nhap
+        self.so_phieu_chuyen = so_phieu_chuyen if so_kho > 1 else 0
+        self.dong_moi_phieu_chuyen = dong_moi_phieu_chuyen
+        self.so_kiem_ke = so_kiem_ke
+        self.dong_moi_kiem_ke = dong_moi_kiem_ke
+        self.so_ngay = so_ngay
+        self.ngau_nhien = random.Random(seed)
+        self.bao_cao = bao_cao or (lambda thong_diep: None)
+
+        self.ket_thuc = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.bat_dau = self.ket_thuc - timedelta(days=so_ngay)
+        self.ton = {}  # (kho_id, san_pham_id) -> số lượng tồn hiện tại
+        self.luu_chuyen = {}  # (kho_id, san_pham_id) -> [nhập, giá trị nhập, nhận, xuất] của ngày đang sinh
+        self.hang_trong_kho = {}  # kho_id -> sản phẩm đã từng có trong kho (để chọn nhanh)
+        self.so_chung_tu = Counter()  # tiền tố -> số đã dùng
+        self.id_cuoi = {}  # model -> id đã cấp gần nhất
+        self.dem = Counter()
+        self.so_dot_gan_day = 0
+        self._lo_moi()
+
+    # --- Phân phối ngẫu nhiên ---
+
+    def _trong_so_lech(self, n, do_lech=1.0):
+        """Trọng số cộng dồn kiểu Zipf, xáo trộn để phần tử phổ biến không luôn là id nhỏ"""
+        trong_so = [1 / (hang + 1) ** do_lech for hang in range(n)]
+        self.ngau_nhien.shuffle(trong_so)
+        return list(accumulate(trong_so))
+
+    def _chon(self, danh_sach, cong_don):
+        return self.ngau_nhien.choices(danh_sach, cum_weights=cong_don)[0]
+
+    def _so_dong(self, trung_binh, toi_da):
+        """Số dòng của một phiếu: log-chuẩn quanh trung_binh, ít nhất 1"""
+        sigma = 0.6
+        gia_tri = self.ngau_nhien.lognormvariate(math.log(trung_binh) - sigma ** 2 / 2, sigma)
+        return max(1, min(toi_da, round(gia_tri)))
+
+    def _lich_theo_ngay(self, tong):
+        """Chia tong chứng từ cho từng ngày theo trọng số (cuối tuần ít, tăng dần về cuối kỳ)"""
+        trong_so = []
+        for i in range(self.so_ngay):
+            thu = (self.bat_dau + timedelta(days=i)).weekday()
+            he_so_thu = 0.15 if thu == 6 else 0.5 if thu == 5 else 1.0
+            trong_so.append(he_so_thu * (0.7 + 0.6 * i / max(1, self.so_ngay - 1)))
+        cong_don = list(accumulate(trong_so))
+        moc = [round(tong * c / cong_don[-1]) for c in cong_don]
+        return [b - a for a, b in zip([0] + moc[:-1], moc)]
+
+    def _thoi_diem(self, ngay):
+        """Một thời điểm trong giờ làm việc (7h-18h) của ngày"""
+        return ngay + timedelta(seconds=self.ngau_nhien.randrange(7 * 3600, 18 * 3600))
+
+    def _ma(self, tien_to):
+        self.so_chung_tu[tien_to] += 1
+        return CapSoChungTu.dinh_dang(tien_to, self.so_chung_tu[tien_to])
+
+    def _id(self, model):
+        self.id_cuoi[model] += 1
+        return self.id_cuoi[model]
+
+    @staticmethod
+    def _ngay_gio(gia_tri):
+        return connection.ops.adapt_datetimefield_value(gia_tri)
+
+    # --- Danh mục ---
+
+    def _tao_danh_muc(self):
+        NguoiDung = get_user_model()
+        nguoi_dung = NguoiDung.objects.bulk_create([
+            NguoiDung(
+                username='quan_tri' if i == 0 else f'nv{i:04d}', password='!',
+                ho_ten=f'{self.ngau_nhien.choice(HO)} {self.ngau_nhien.choice(TEN)}',
+                email=f'nv{i:04d}@example.com',
+                vai_tro='admin' if i == 0 else 'manager' if i % 10 == 0 else 'staff',
+                is_staff=i == 0, is_superuser=i == 0, trang_thai=i % 9 != 8,
+            )
+            for i in range(self.so_nhan_vien)
+        ])
+        Profile.objects.bulk_create([Profile(user=u) for u in nguoi_dung])
+        self.nguoi_dung = [u.id for u in nguoi_dung if u.trang_thai]
+
+        danh_muc = DanhMucSanPham.objects.bulk_create([DanhMucSanPham(ten_danh_muc=ten) for ten in DANH_MUC])
+        don_vi = DonViTinh.objects.bulk_create([DonViTinh(ten_don_vi=ten) for ten in DON_VI])
+        nhom = [(dm, loai) for dm in danh_muc for loai in DANH_MUC[dm.ten_danh_muc]]
+        san_pham = []
+        for i in range(self.so_san_pham):
+            dm, loai = self.ngau_nhien.choice(nhom)
+            gia_nhap = Decimal(max(1000, round(self.ngau_nhien.lognormvariate(10.5, 1.0), -2)))
+            san_pham.append(SanPham(
+                danh_muc=dm, don_vi_tinh=self.ngau_nhien.choice(don_vi),
+                ma_san_pham=f'SP{i + 1:06d}',
+                ten_san_pham=f'{loai} {self.ngau_nhien.choice(THUONG_HIEU)} {self.ngau_nhien.choice(QUY_CACH)}',
+                gia_nhap=gia_nhap,
+                gia_ban=(gia_nhap * Decimal(self.ngau_nhien.uniform(1.1, 1.6))).quantize(Decimal('100')),
+                so_luong_toi_thieu=self.ngau_nhien.choice((5, 10, 10, 20, 50)),
+                trang_thai=self.ngau_nhien.random() > 0.03,
+            ))
+        self.san_pham = SanPham.objects.bulk_create(san_pham, batch_size=self.KICH_THUOC_BULK)
+        self.san_pham_cong_don = self._trong_so_lech(len(self.san_pham), 0.9)
+
+        nha_cung_cap = NhaCungCap.objects.bulk_create([
+            NhaCungCap(
+                ma_nha_cung_cap=f'NCC{i + 1:04d}',
+                ten_nha_cung_cap=f'Công ty TNHH {TEN_CONG_TY[i % len(TEN_CONG_TY)]} {i // len(TEN_CONG_TY) + 1}',
+                dia_chi=self.ngau_nhien.choice(TINH_THANH), dien_thoai=f'09{self.ngau_nhien.randrange(10 ** 8):08d}',
+            )
+            for i in range(self.so_nha_cung_cap)
+        ])
+        self.nha_cung_cap = [ncc.id for ncc in nha_cung_cap]
+        self.nha_cung_cap_cong_don = self._trong_so_lech(len(self.nha_cung_cap), 1.1)
+
+        self.kho = Kho.objects.bulk_create([
+            Kho(
+                ma_kho=f'K{i + 1:03d}',
+                ten_kho=f'Kho {TINH_THANH[i % len(TINH_THANH)]}'
+                        + (f' {i // len(TINH_THANH) + 1}' if i >= len(TINH_THANH) else ''),
+                dia_chi=TINH_THANH[i % len(TINH_THANH)],
+                nguoi_quan_ly_id=self.ngau_nhien.choice(self.nguoi_dung),
+            )
+            for i in range(self.so_kho)
+        ])
+        self.kho_cong_don = self._trong_so_lech(len(self.kho), 0.7)
+        for k in self.kho:
+            self.hang_trong_kho[k.id] = []
+
+        self.dem.update(
+            nguoi_dung=len(nguoi_dung), san_pham=len(self.san_pham),
+            nha_cung_cap=len(self.nha_cung_cap), kho=len(self.kho)
+        )
+
+    # --- Chứng từ ---
+
+    def _lo_moi(self):
+        self.lo = {model: [] for model in COT_GHI}
+
+    def _bien_dong(self, kho_id, san_pham_id, so_luong, loai, chung_tu, thoi_gian, gia_tri=0):
+        khoa = (kho_id, san_pham_id)
+        if khoa not in self.ton:
+            self.ton[khoa] = 0
+            self.hang_trong_kho[kho_id].append(san_pham_id)
+        self.ton[khoa] += so_luong
+        self.lo[StockMovement].append(
+            (self._id(StockMovement), kho_id, san_pham_id, thoi_gian, loai, so_luong, gia_tri, chung_tu)
+        )
+
+    def _luu_chuyen(self, kho_id, san_pham_id):
+        khoa = (kho_id, san_pham_id)
+        if khoa not in self.luu_chuyen:
+            self.luu_chuyen[khoa] = [0, Decimal(0), 0, 0]
+        return self.luu_chuyen[khoa]
+
+    def _chot_ngay(self, ngay):
+        """Đưa lưu chuyển của ngày vừa sinh vào lô ghi DailyStockFlow"""
+        ngay = connection.ops.adapt_datefield_value(ngay.date())
+        for (kho_id, san_pham_id), (nhap, gia_tri_nhap, nhan, xuat) in self.luu_chuyen.items():
+            self.lo[DailyStockFlow].append(
+                (self._id(DailyStockFlow), kho_id, san_pham_id, ngay, nhap, gia_tri_nhap, nhan, xuat)
+            )
+        self.luu_chuyen = {}
+
+    def _phieu_nhap(self, thoi_gian):
+        ngau_nhien = self.ngau_nhien
+        phieu_id = self._id(NhapKho)
+        ma_phieu = self._ma('NK')
+        kho_id = self._chon(self.kho, self.kho_cong_don).id
+        nha_cung_cap_id = self._chon(self.nha_cung_cap, self.nha_cung_cap_cong_don)
+        ngay = self._ngay_gio(thoi_gian)
+
+        so_dong = self._so_dong(self.dong_moi_phieu_nhap, len(self.san_pham))
+        cac_san_pham = list({
+            sp.id: sp for sp in ngau_nhien.choices(self.san_pham, cum_weights=self.san_pham_cong_don, k=so_dong)
+        }.values())
+        tong_tien = Decimal(0)
+        tong_so_luong = 0
+        for sp in cac_san_pham:
+            so_luong = max(1, round(ngau_nhien.lognormvariate(3.2, 0.9)))
+            don_gia = (sp.gia_nhap * Decimal(ngau_nhien.uniform(0.95, 1.05))).quantize(Decimal('100'))
+            thanh_tien = so_luong * don_gia
+            tong_tien += thanh_tien
+            tong_so_luong += so_luong
+            self.lo[ChiTietNhapKho].append(
+                (self._id(ChiTietNhapKho), phieu_id, sp.id, so_luong, don_gia, thanh_tien)
+            )
+            self._bien_dong(kho_id, sp.id, so_luong, 'nhap', ma_phieu, ngay, thanh_tien)
+            luu_chuyen = self._luu_chuyen(kho_id, sp.id)
+            luu_chuyen[0] += so_luong
+            luu_chuyen[1] += thanh_tien
+        self.lo[NhapKho].append((
+            phieu_id, ma_phieu, kho_id, nha_cung_cap_id, ngau_nhien.choice(self.nguoi_dung), ngay, ngay, tong_tien,
+            'chưa duyệt', ngau_nhien.choice(('', '', 'Nhập bổ sung', 'Hàng khuyến mãi', 'Nhập định kỳ')),
+        ))
+
+        ten_hang_hoa = cac_san_pham[0].ten_san_pham
+        if len(cac_san_pham) > 1:
+            ten_hang_hoa += f' và {len(cac_san_pham) - 1} sản phẩm khác'
+        self._cong_no(phieu_id, ma_phieu, nha_cung_cap_id, ten_hang_hoa, tong_so_luong, tong_tien, thoi_gian)
+
+    def _cong_no(self, phieu_id, ma_phieu, nha_cung_cap_id, ten_hang_hoa, tong_so_luong, tong_tien, thoi_gian):
+        """Công nợ phải trả của phiếu nhập; phiếu càng cũ càng nhiều khả năng đã thanh toán"""
+        tuoi = (self.ket_thuc - thoi_gian).days
+        xac_suat_tra = 0.85 if tuoi > 45 else 0.4 if tuoi > 15 else 0.1
+        da_tra = Decimal(0)
+        if self.ngau_nhien.random() < xac_suat_tra:
+            da_tra = tong_tien
+        elif self.ngau_nhien.random() < 0.15:
+            da_tra = (tong_tien / 2).quantize(Decimal('1'))
+
+        cong_no_id = self._id(CongNo)
+        self.lo[CongNo].append((
+            cong_no_id, phieu_id, nha_cung_cap_id, self._ma('CN'), 'phai_tra', ten_hang_hoa[:255], tong_so_luong,
+            (tong_tien / tong_so_luong).quantize(Decimal('0.01')), tong_tien, tong_tien - da_tra,
+            self._ngay_gio(thoi_gian), (thoi_gian + timedelta(days=QuanLyCongNo.HAN_THANH_TOAN_NGAY)).date(),
+            f'Công nợ từ phiếu nhập {ma_phieu}',
+        ))
+        if da_tra:
+            ngay_tra = min(thoi_gian + timedelta(days=self.ngau_nhien.randint(3, 40)), self.ket_thuc)
+            self.lo[LichSuThanhToan].append((
+                self._id(LichSuThanhToan), cong_no_id, da_tra, self._ngay_gio(ngay_tra),
+                self.ngau_nhien.choice(self.nguoi_dung),
+            ))
+
+    def _phieu_chuyen(self, thoi_gian):
+        kho_id = self._chon(self.kho, self.kho_cong_don).id
+        hang = self.hang_trong_kho[kho_id]
+        if not hang:
+            return
+        kho_nhan_id = kho_id
+        while kho_nhan_id == kho_id:
+            kho_nhan_id = self._chon(self.kho, self.kho_cong_don).id
+
+        phieu_id = self.id_cuoi[XuatKho] + 1
+        ma_phieu = CapSoChungTu.dinh_dang('XKNB', self.so_chung_tu['XKNB'] + 1)
+        ngay = self._ngay_gio(thoi_gian)
+        co_dong = False
+        so_dong = self._so_dong(self.dong_moi_phieu_chuyen, len(hang))
+        for san_pham_id in dict.fromkeys(self.ngau_nhien.choices(hang, k=so_dong)):
+            co_san = self.ton[(kho_id, san_pham_id)]
+            if co_san < 2:
+                continue
+            so_luong = self.ngau_nhien.randint(1, co_san // 2)
+            self.lo[ChiTietXuatKho].append((self._id(ChiTietXuatKho), phieu_id, san_pham_id, so_luong))
+            self._bien_dong(kho_id, san_pham_id, -so_luong, 'xuat', ma_phieu, ngay)
+            self._bien_dong(kho_nhan_id, san_pham_id, so_luong, 'nhan', ma_phieu, ngay)
+            self._luu_chuyen(kho_id, san_pham_id)[3] += so_luong
+            self._luu_chuyen(kho_nhan_id, san_pham_id)[2] += so_luong
+            co_dong = True
+        # Kho xuất không còn mặt hàng nào đủ để chuyển thì bỏ phiếu, không cấp id/số
+        if co_dong:
+            self._id(XuatKho)
+            self._ma('XKNB')
+            self.lo[XuatKho].append((
+                phieu_id, ma_phieu, kho_id, kho_nhan_id, self.ngau_nhien.choice(self.nguoi_dung), ngay, ngay,
+                self.ngau_nhien.choice(('', '', 'Điều chuyển cân đối tồn', 'Bổ sung hàng cho chi nhánh')),
+            ))
+
+    def _kiem_ke(self, thoi_gian, stt):
+        kho = self.kho[stt % len(self.kho)]
+        hang = self.hang_trong_kho[kho.id]
+        if not hang:
+            return
+        # Đợt cũ đã hoàn thành và ghi sổ; hai tuần gần đây xen kẽ đợt chưa ghi sổ và đang đếm
+        if (self.ket_thuc - thoi_gian).days > 14:
+            trang_thai, ghi_so = 'hoan_thanh', True
+        else:
+            trang_thai, ghi_so = 'dang_kiem_ke' if self.so_dot_gan_day % 2 else 'hoan_thanh', False
+            self.so_dot_gan_day += 1
+        dot_id = self._id(KiemKe)
+        ma_dieu_chinh, ngay_ghi_so = '', None
+        if ghi_so:
+            ma_dieu_chinh = self._ma('DC')
+            ngay_ghi_so = self._ngay_gio(thoi_gian + timedelta(hours=2))
+        ngay = self._ngay_gio(thoi_gian)
+        self.lo[KiemKe].append((
+            dot_id, self._ma('KK'), f'Kiểm kê {kho.ten_kho} tháng {thoi_gian:%m/%Y}', ngay, kho.id,
+            self.ngau_nhien.choice(self.nguoi_dung), trang_thai, 'Kiểm kê định kỳ', ma_dieu_chinh, ngay_ghi_so,
+            ngay, ngay_ghi_so or ngay,
+        ))
+        for san_pham_id in self.ngau_nhien.sample(hang, min(self.dong_moi_kiem_ke, len(hang))):
+            he_thong = self.ton[(kho.id, san_pham_id)]
+            lech = 0 if self.ngau_nhien.random() < 0.9 else self.ngau_nhien.randint(-3, 3)
+            thuc_te = max(0, he_thong + lech)
+            self.lo[ChiTietKiemKe].append(
+                (self._id(ChiTietKiemKe), dot_id, san_pham_id, he_thong, thuc_te, thuc_te - he_thong, '')
+            )
+            if ghi_so and thuc_te != he_thong:
+                self._bien_dong(kho.id, san_pham_id, thuc_te - he_thong, 'kiem_ke', ma_dieu_chinh, ngay_ghi_so)
+
+    def _ghi_bang(self, model, cac_cot, dong):
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            qn(model._meta.db_table),
+            ', '.join(qn(model._meta.get_field(cot).column) for cot in cac_cot),
+            ', '.join(['%s'] * len(cac_cot)),
+        )
+        with connection.cursor() as cursor:
+            for dau in range(0, len(dong), self.KICH_THUOC_BULK):
+                cursor.executemany(sql, dong[dau:dau + self.KICH_THUOC_BULK])
+        self.dem[model._meta.model_name] += len(dong)
+
+    def _ghi_lo(self):
+        """Ghi lô hiện tại bằng executemany: phiếu trước, rồi các bảng tham chiếu tới phiếu"""
+        for model, cac_cot in COT_GHI.items():
+            if self.lo[model]:
+                self._ghi_bang(model, cac_cot, self.lo[model])
+        self._lo_moi()
+
+    def _tao_chung_tu(self):
+        for model in COT_GHI:
+            self.id_cuoi[model] = model.objects.aggregate(m=Max('id'))['m'] or 0
+        lich = zip(
+            self._lich_theo_ngay(self.so_phieu_nhap),
+            self._lich_theo_ngay(self.so_phieu_chuyen),
+            self._lich_theo_ngay(self.so_kiem_ke),
+        )
+        stt_kiem_ke = 0
+        for i, (so_nhap, so_chuyen, so_kiem_ke) in enumerate(lich):
+            ngay = self.bat_dau + timedelta(days=i)
+            su_kien = sorted(
+                [(self._thoi_diem(ngay), 0) for _ in range(so_nhap)]
+                + [(self._thoi_diem(ngay), 1) for _ in range(so_chuyen)]
+                + [(self._thoi_diem(ngay), 2) for _ in range(so_kiem_ke)],
+                key=lambda sk: sk[0]
+            )
+            for thoi_gian, loai in su_kien:
+                if loai == 0:
+                    self._phieu_nhap(thoi_gian)
+                elif loai == 1:
+                    self._phieu_chuyen(thoi_gian)
+                else:
+                    self._kiem_ke(thoi_gian, stt_kiem_ke)
+                    stt_kiem_ke += 1
+            self._chot_ngay(ngay)
+            if len(self.lo[NhapKho]) + len(self.lo[XuatKho]) >= self.KICH_THUOC_LO:
+                self._ghi_lo()
+                self.bao_cao(f'{ngay:%d/%m/%Y}: {self.dem["chitietnhapkho"]} dòng nhập, '
+                             f'{self.dem["chitietxuatkho"]} dòng chuyển')
+        self._ghi_lo()
+
+        # Id được cấp sẵn nên đồng bộ lại sequence (PostgreSQL/Oracle; SQLite tự cập nhật)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(COT_GHI)):
+                cursor.execute(sql)
+
+    def _ghi_ton_kho(self):
+        """TonKho lấy từ số dư đã cộng khi sinh chứng từ (bằng tổng nhật ký StockMovement)"""
+        muc_toi_thieu = {sp.id: sp.so_luong_toi_thieu for sp in self.san_pham}
+        bay_gio = self._ngay_gio(timezone.now())
+        self._ghi_bang(TonKho, COT_TON_KHO, [
+            (kho_id, san_pham_id, so_luong, so_luong, muc_toi_thieu[san_pham_id],
+             so_luong <= muc_toi_thieu[san_pham_id], bay_gio)
+            for (kho_id, san_pham_id), so_luong in self.ton.items()
+        ])
+
+    def chay(self):
+        """Sinh toàn bộ dữ liệu trong một giao dịch; trả về số bản ghi theo bảng"""
+        bo_dem_sqlite = None
+        if connection.vendor == 'sqlite':
+            # Bộ đệm trang mặc định (~2MB) làm việc cập nhật chỉ mục khi ghi hàng triệu dòng rơi xuống đĩa
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA cache_size')
+                bo_dem_sqlite = cursor.fetchone()[0]
+                cursor.execute('PRAGMA cache_size = -262144')
+        try:
+            self._chay()
+        finally:
+            if bo_dem_sqlite is not None:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'PRAGMA cache_size = {int(bo_dem_sqlite)}')
+        return self.dem
+
+    def _chay(self):
+        with transaction.atomic():
+            self._tao_danh_muc()
+            self._tao_chung_tu()
+            self._ghi_ton_kho()
+            # Cùng tiền tố với luồng chạy thật (chuyển kho nội bộ cấp số XKNB)
+            for tien_to in ('NK', 'XKNB', 'CN', 'DC', 'KK'):
+                BoDemChungTu.objects.update_or_create(
+                    tien_to=tien_to, defaults={'gia_tri': self.so_chung_tu[tien_to]}
+                )
+
+            self.bao_cao('Dựng lại chỉ mục tìm kiếm...')
+            TimKiemChungTu.dung_lai()
+            BoNhoDem.tang_phien_ban(*BoNhoDem.NHOM)
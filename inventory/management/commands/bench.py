@@ -0,0 +1,137 @@
+import json
+import logging
+import platform
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from inventory.do_hieu_nang import QUY_MO, BoDoHieuNang, so_sanh_moc
+from inventory.du_lieu_mau import SinhDuLieuMau
+
+
+class Command(BaseCommand):
+    help = (
+        'Đo hiệu năng các kịch bản chính (tạo phiếu, phiếu kiểm kê, dashboard, danh sách, xuất file) '
+        'trên CSDL test tạm sinh bằng seed_warehouse; in p50/p95, số truy vấn, bộ nhớ đỉnh dạng JSON '
+        'và so với mốc (baseline) để phát hiện hồi quy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quy-mo', choices=sorted(QUY_MO), default='nho', help='Quy mô dữ liệu mẫu')
+        parser.add_argument('--seed', type=int, default=2024, help='Hạt giống dữ liệu mẫu')
+        parser.add_argument('--kich-ban', nargs='+', help='Chỉ chạy các kịch bản này (mặc định tất cả)')
+        parser.add_argument('--so-lan', type=int, default=20, help='Số lần đo mỗi kịch bản')
+        parser.add_argument('--khoi-dong', type=int, default=2, help='Số lần chạy làm nóng trước khi đo')
+        parser.add_argument('--giu-bo-nho-dem', action='store_true',
+                            help='Không xóa cache trước mỗi lần đo (đo trạng thái đã có cache)')
+        parser.add_argument('--ket-qua', help='Ghi kết quả JSON vào file thay vì in ra')
+        parser.add_argument('--baseline', help='File kết quả mốc để so sánh')
+        parser.add_argument('--ghi-baseline', action='store_true', help='Ghi kết quả lần này làm mốc vào --baseline')
+        parser.add_argument('--nguong', type=float, default=0.2,
+                            help='Tỉ lệ tăng thời gian/bộ nhớ so với mốc bị coi là hồi quy (mặc định 0.2)')
+
+    def handle(self, *args, **options):
+        if options['so_lan'] < 1:
+            raise CommandError('--so-lan phải lớn hơn 0')
+        khong_co = sorted(set(options['kich_ban'] or ()) - set(BoDoHieuNang.KICH_BAN))
+        if khong_co:
+            raise CommandError(
+                f'Không có kịch bản {", ".join(khong_co)}; có: {", ".join(BoDoHieuNang.KICH_BAN)}'
+            )
+        if options['ghi_baseline'] and not options['baseline']:
+            raise CommandError('--ghi-baseline cần --baseline để biết ghi vào đâu')
+
+        moc = None
+        if options['baseline'] and not options['ghi_baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as f:
+                    moc = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Không đọc được baseline {options["baseline"]}: {e}')
+            if moc.get('quy_mo') != options['quy_mo']:
+                raise CommandError(
+                    f'Baseline đo ở quy mô {moc.get("quy_mo")!r}, lần này là {options["quy_mo"]!r}'
+                )
+
+        ket_qua = self._do(options)
+
+        if moc is not None:
+            hoi_quy, cai_thien = so_sanh_moc(ket_qua['kich_ban'], moc.get('kich_ban', {}), options['nguong'])
+            ket_qua['so_sanh'] = {
+                'baseline': options['baseline'], 'nguong': options['nguong'],
+                'hoi_quy': hoi_quy, 'cai_thien': cai_thien,
+            }
+
+        noi_dung = json.dumps(ket_qua, ensure_ascii=False, indent=2)
+        duong_dan = options['baseline'] if options['ghi_baseline'] else options['ket_qua']
+        if duong_dan:
+            with open(duong_dan, 'w', encoding='utf-8') as f:
+                f.write(noi_dung + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Đã ghi kết quả vào {duong_dan}'))
+        else:
+            self.stdout.write(noi_dung)
+
+        if moc is not None:
+            for muc in ket_qua['so_sanh']['cai_thien']:
+                self.stderr.write(self.style.SUCCESS(self._mo_ta_thay_doi('Cải thiện', muc)))
+            for muc in ket_qua['so_sanh']['hoi_quy']:
+                self.stderr.write(self.style.ERROR(self._mo_ta_thay_doi('Hồi quy', muc)))
+            if ket_qua['so_sanh']['hoi_quy']:
+                raise CommandError(f'Phát hiện {len(ket_qua["so_sanh"]["hoi_quy"])} hồi quy so với baseline')
+
+    @staticmethod
+    def _mo_ta_thay_doi(nhan, muc):
+        phan_tram = f' ({muc["thay_doi_phan_tram"]:+}%)' if muc['thay_doi_phan_tram'] is not None else ''
+        return f'{nhan}: {muc["kich_ban"]} {muc["chi_so"]} {muc["moc"]} -> {muc["hien_tai"]}{phan_tram}'
+
+    def _do(self, options):
+        """Tạo CSDL test, sinh dữ liệu, đo rồi hủy CSDL; trả về dict kết quả"""
+        ten_cu = connection.settings_dict['NAME']
+        logger = logging.getLogger('inventory.hieu_nang')
+        muc_log = logger.level
+        # Chỉ giữ cảnh báo vượt ngân sách, bỏ dòng log INFO của từng request đo
+        logger.setLevel(logging.WARNING)
+        try:
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    bat_dau = time.perf_counter()
+                    dem = SinhDuLieuMau(seed=options['seed'], **QUY_MO[options['quy_mo']]).chay()
+                    self.stderr.write(f'Sinh dữ liệu quy mô {options["quy_mo"]}: '
+                                      f'{time.perf_counter() - bat_dau:.1f}s')
+
+                    bo_do = BoDoHieuNang(
+                        so_lan=options['so_lan'], khoi_dong=options['khoi_dong'],
+                        xoa_bo_nho_dem=not options['giu_bo_nho_dem'],
+                    )
+                    try:
+                        kich_ban = bo_do.chay(options['kich_ban'], bao_cao=lambda ten, kq: self.stderr.write(
+                            f'{ten:<24} p50={kq["p50_ms"]}ms p95={kq["p95_ms"]}ms '
+                            f'truy_van={kq["so_truy_van"]} bo_nho={kq["bo_nho_dinh_kb"]}KB'
+                        ))
+                    except ValueError as e:
+                        raise CommandError(str(e))
+                finally:
+                    connection.creation.destroy_test_db(ten_cu, verbosity=0)
+        finally:
+            logger.setLevel(muc_log)
+
+        return {
+            'thoi_diem': timezone.now().isoformat(timespec='seconds'),
+            'quy_mo': options['quy_mo'],
+            'seed': options['seed'],
+            'so_lan': options['so_lan'],
+            'giu_bo_nho_dem': options['giu_bo_nho_dem'],
+            'moi_truong': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'csdl': f'{connection.vendor} {connection.Database.sqlite_version}'
+                        if connection.vendor == 'sqlite' else connection.vendor,
+            },
+            'du_lieu': dict(dem),
+            'kich_ban': kich_ban,
+        }
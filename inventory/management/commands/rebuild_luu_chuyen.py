@@ -0,0 +1,23 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.services import QuanLyLuuChuyen
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bảng lưu chuyển hàng theo ngày (DailyStockFlow) từ phiếu nhập và phiếu chuyển kho'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tu-ngay', help='Chỉ dựng lại từ ngày (YYYY-MM-DD)')
+        parser.add_argument('--den-ngay', help='Chỉ dựng lại đến ngày (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            tu_ngay = date.fromisoformat(options['tu_ngay']) if options['tu_ngay'] else None
+            den_ngay = date.fromisoformat(options['den_ngay']) if options['den_ngay'] else None
+        except ValueError:
+            raise CommandError('Ngày phải có dạng YYYY-MM-DD')
+
+        so_dong = QuanLyLuuChuyen.dung_lai(tu_ngay, den_ngay)
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng lại {so_dong} dòng lưu chuyển theo ngày.'))
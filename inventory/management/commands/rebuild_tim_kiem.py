@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from inventory.search import TimKiemChungTu
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại chỉ mục tìm kiếm toàn văn (FTS5) của phiếu nhập, phiếu chuyển kho và kiểm kê'
+
+    def handle(self, *args, **options):
+        if not TimKiemChungTu.ho_tro() and not TimKiemChungTu.tao_bang(connection):
+            raise CommandError('CSDL hiện tại không hỗ trợ FTS5; tìm kiếm sẽ dùng bộ lọc icontains.')
+
+        so_tai_lieu = TimKiemChungTu.dung_lai()
+        chi_tiet = ', '.join(f'{loai}: {so}' for loai, so in so_tai_lieu.items())
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng lại chỉ mục tìm kiếm ({chi_tiet}).'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.services import QuanLyTonKho
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bảng TonKho từ nhật ký biến động tồn kho (StockMovement)'
+
+    def handle(self, *args, **options):
+        so_dong = QuanLyTonKho.dung_lai_tu_nhat_ky()
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng lại {so_dong} dòng tồn kho từ nhật ký.'))
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.du_lieu_mau import SinhDuLieuMau
+from inventory.models import Kho, NhapKho
+from products.models import SanPham
+
+
+class Command(BaseCommand):
+    help = (
+        'Sinh dữ liệu kho giả lập có tính tất định (kho, sản phẩm, nhà cung cấp, phiếu nhập, '
+        'phiếu chuyển, kiểm kê, công nợ) để đo hiệu năng. Chỉ chạy trên CSDL trống.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kho', type=int, default=10, help='Số kho')
+        parser.add_argument('--san-pham', type=int, default=5000, help='Số sản phẩm')
+        parser.add_argument('--nha-cung-cap', type=int, default=200, help='Số nhà cung cấp')
+        parser.add_argument('--nhan-vien', type=int, default=30, help='Số người dùng (người đầu tiên là quan_tri)')
+        parser.add_argument('--phieu-nhap', type=int, default=10000, help='Số phiếu nhập')
+        parser.add_argument('--dong-moi-phieu', type=int, default=10, help='Số dòng trung bình mỗi phiếu nhập')
+        parser.add_argument('--phieu-chuyen', type=int, default=3000, help='Số phiếu chuyển kho')
+        parser.add_argument('--dong-moi-phieu-chuyen', type=int, default=6, help='Số dòng trung bình mỗi phiếu chuyển')
+        parser.add_argument('--kiem-ke', type=int, default=50, help='Số đợt kiểm kê')
+        parser.add_argument('--dong-moi-kiem-ke', type=int, default=200, help='Số dòng mỗi đợt kiểm kê')
+        parser.add_argument('--so-ngay', type=int, default=365, help='Khoảng thời gian phát sinh chứng từ (ngày)')
+        parser.add_argument('--seed', type=int, default=2024, help='Hạt giống ngẫu nhiên')
+
+    def handle(self, *args, **options):
+        for ten in ('kho', 'san_pham', 'nhan_vien', 'nha_cung_cap', 'so_ngay'):
+            if options[ten] < 1:
+                raise CommandError(f'--{ten.replace("_", "-")} phải lớn hơn 0')
+        if Kho.objects.exists() or SanPham.objects.exists() or NhapKho.objects.exists():
+            raise CommandError('CSDL đã có dữ liệu kho/sản phẩm; chỉ sinh dữ liệu mẫu trên CSDL trống.')
+
+        sinh = SinhDuLieuMau(
+            so_kho=options['kho'],
+            so_san_pham=options['san_pham'],
+            so_nha_cung_cap=options['nha_cung_cap'],
+            so_nhan_vien=options['nhan_vien'],
+            so_phieu_nhap=options['phieu_nhap'],
+            dong_moi_phieu_nhap=options['dong_moi_phieu'],
+            so_phieu_chuyen=options['phieu_chuyen'],
+            dong_moi_phieu_chuyen=options['dong_moi_phieu_chuyen'],
+            so_kiem_ke=options['kiem_ke'],
+            dong_moi_kiem_ke=options['dong_moi_kiem_ke'],
+            so_ngay=options['so_ngay'],
+            seed=options['seed'],
+            bao_cao=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        bat_dau = time.perf_counter()
+        dem = sinh.chay()
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã sinh dữ liệu mẫu trong {time.perf_counter() - bat_dau:.1f}s: '
+            + ', '.join(f'{ten}={so}' for ten, so in dem.items())
+        ))
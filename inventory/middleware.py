@@ -0,0 +1,131 @@
+import heapq
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('inventory.hieu_nang')
+
+SO_CAU_CHAM_MAC_DINH = 5
+DO_DAI_SQL_TOI_DA = 300
+
+
+class BanGhiTruyVan:
+    """Bộ đếm truy vấn của một request, gắn vào mọi kết nối CSDL bằng execute_wrapper
+
+    Không phụ thuộc DEBUG (không đọc connection.queries) nên chạy được trên production.
+    """
+
+    def __init__(self, so_cau_cham=SO_CAU_CHAM_MAC_DINH):
+        self.so_cau_cham = so_cau_cham
+        self.so_truy_van = 0
+        self.thoi_gian_sql = 0.0
+        self.cau_cham = []  # heap (thời gian, thứ tự, sql) giữ so_cau_cham câu chậm nhất
+        self.lap_lai = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        bat_dau = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            thoi_gian = time.perf_counter() - bat_dau
+            self.so_truy_van += 1
+            self.thoi_gian_sql += thoi_gian
+            self.lap_lai[sql] += 1
+            muc = (thoi_gian, self.so_truy_van, sql)
+            if len(self.cau_cham) < self.so_cau_cham:
+                heapq.heappush(self.cau_cham, muc)
+            else:
+                heapq.heappushpop(self.cau_cham, muc)
+
+    def cham_nhat(self):
+        return [
+            {'ms': round(thoi_gian * 1000, 2), 'sql': sql[:DO_DAI_SQL_TOI_DA]}
+            for thoi_gian, _, sql in sorted(self.cau_cham, reverse=True)
+        ]
+
+    def lap_nhieu_nhat(self, toi_thieu=2, so_cau=3):
+        """Câu SQL (dạng mẫu, chưa thay tham số) chạy lặp lại - dấu hiệu N+1"""
+        return [
+            {'lan': lan, 'sql': sql[:DO_DAI_SQL_TOI_DA]}
+            for sql, lan in self.lap_lai.most_common(so_cau) if lan >= toi_thieu
+        ]
+
+
+def _ngan_sach(ten_view):
+    """Ngân sách của view trong settings.QUERY_BUDGETS: {'truy_van': n, 'ms': t} hoặc None
+
+    Giá trị trong settings có thể là số nguyên (chỉ giới hạn số truy vấn) hoặc dict;
+    khóa '*' là ngân sách mặc định cho các view không khai báo riêng.
+    """
+    ngan_sach = getattr(settings, 'QUERY_BUDGETS', {})
+    gia_tri = ngan_sach.get(ten_view, ngan_sach.get('*'))
+    if gia_tri is None:
+        return None
+    if isinstance(gia_tri, int):
+        return {'truy_van': gia_tri}
+    return gia_tri
+
+
+class GiamSatHieuNangMiddleware:
+    """Đo mỗi request: số truy vấn, tổng thời gian SQL, các câu chậm nhất và thời gian xử lý
+
+    Ghi một dòng JSON vào logger 'inventory.hieu_nang' (INFO, hoặc WARNING khi vượt
+    ngân sách QUERY_BUDGETS của view) và thêm header Server-Timing để xem trong DevTools.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.so_cau_cham = getattr(settings, 'HIEU_NANG_SO_CAU_CHAM', SO_CAU_CHAM_MAC_DINH)
+
+    def __call__(self, request):
+        ban_ghi = BanGhiTruyVan(self.so_cau_cham)
+        bat_dau = time.perf_counter()
+        with ExitStack() as ngan_xep:
+            for ket_noi in connections.all():
+                ngan_xep.enter_context(ket_noi.execute_wrapper(ban_ghi))
+            response = self.get_response(request)
+        tong_thoi_gian = time.perf_counter() - bat_dau
+
+        khop = getattr(request, 'resolver_match', None)
+        ten_view = (khop.view_name or khop._func_path) if khop else None
+        sql_ms = round(ban_ghi.thoi_gian_sql * 1000, 2)
+        tong_ms = round(tong_thoi_gian * 1000, 2)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={sql_ms};desc="{ban_ghi.so_truy_van} truy van"',
+            f'app;dur={round(tong_ms - sql_ms, 2)}',
+            f'total;dur={tong_ms}',
+        ])
+
+        vuot = []
+        ngan_sach = _ngan_sach(ten_view)
+        if ngan_sach:
+            if 'truy_van' in ngan_sach and ban_ghi.so_truy_van > ngan_sach['truy_van']:
+                vuot.append('truy_van')
+            if 'ms' in ngan_sach and tong_ms > ngan_sach['ms']:
+                vuot.append('ms')
+
+        if logger.isEnabledFor(logging.WARNING if vuot else logging.INFO):
+            du_lieu = {
+                'view': ten_view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'so_truy_van': ban_ghi.so_truy_van,
+                'sql_ms': sql_ms,
+                'tong_ms': tong_ms,
+                'cham_nhat': ban_ghi.cham_nhat(),
+                'lap_lai': ban_ghi.lap_nhieu_nhat(),
+            }
+            if vuot:
+                du_lieu['ngan_sach'] = ngan_sach
+                du_lieu['vuot_ngan_sach'] = vuot
+                logger.warning(json.dumps(du_lieu, ensure_ascii=False))
+            else:
+                logger.info(json.dumps(du_lieu, ensure_ascii=False))
+        return response
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:35
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def sua_so_luong_am(apps, schema_editor):
+    """Đưa các dòng tồn kho âm về 0 (và ghi log) để thêm được ràng buộc CHECK"""
+    TonKho = apps.get_model('inventory', 'TonKho')
+    for truong in ('so_luong_ton', 'so_luong_kha_dung'):
+        dong_am = TonKho.objects.filter(**{f'{truong}__lt': 0})
+        danh_sach = list(dong_am.values_list('kho_id', 'san_pham_id', truong)[:50])
+        if not danh_sach:
+            continue
+        so_dong = dong_am.update(**{truong: 0})
+        logger.warning(
+            "Đã đưa %s dòng TonKho có %s âm về 0 (kho_id, san_pham_id, giá trị cũ; tối đa 50 dòng): %s",
+            so_dong, truong, danh_sach
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_nhapkho_tong_tien'),
+    ]
+
+    operations = [
+        migrations.RunPython(sua_so_luong_am, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tonkho',
+            constraint=models.CheckConstraint(check=models.Q(('so_luong_ton__gte', 0)), name='tonkho_so_luong_ton_khong_am'),
+        ),
+        migrations.AddConstraint(
+            model_name='tonkho',
+            constraint=models.CheckConstraint(check=models.Q(('so_luong_kha_dung__gte', 0)), name='tonkho_so_luong_kha_dung_khong_am'),
+        ),
+    ]
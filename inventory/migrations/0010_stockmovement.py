@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def tao_so_du_dau_ky(apps, schema_editor):
+    """Ghi số dư hiện tại của TonKho làm biến động đầu kỳ để nhật ký khớp với tồn kho"""
+    TonKho = apps.get_model('inventory', 'TonKho')
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    thoi_gian = django.utils.timezone.now()
+    lo = []
+    for ton in TonKho.objects.exclude(so_luong_ton=0).iterator(chunk_size=2000):
+        lo.append(StockMovement(
+            kho_id=ton.kho_id,
+            san_pham_id=ton.san_pham_id,
+            thoi_gian=thoi_gian,
+            loai='dau_ky',
+            so_luong=ton.so_luong_ton,
+        ))
+        if len(lo) >= 2000:
+            StockMovement.objects.bulk_create(lo)
+            lo = []
+    StockMovement.objects.bulk_create(lo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_sanpham_so_luong_toi_thieu'),
+        ('inventory', '0009_tonkho_check_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thoi_gian', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Thời gian')),
+                ('loai', models.CharField(choices=[('dau_ky', 'Số dư đầu kỳ'), ('nhap', 'Nhập kho'), ('huy_nhap', 'Hủy nhập kho'), ('xuat', 'Xuất chuyển kho'), ('nhan', 'Nhận chuyển kho'), ('kiem_ke', 'Điều chỉnh kiểm kê')], max_length=20, verbose_name='Loại biến động')),
+                ('so_luong', models.IntegerField(verbose_name='Số lượng')),
+                ('gia_tri', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='Giá trị')),
+                ('chung_tu', models.CharField(blank=True, max_length=50, verbose_name='Chứng từ')),
+                ('kho', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.kho', verbose_name='Kho')),
+                ('san_pham', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.sanpham', verbose_name='Sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Biến động tồn kho',
+                'verbose_name_plural': 'Biến động tồn kho',
+                'indexes': [models.Index(fields=['kho', 'san_pham', 'thoi_gian'], name='bien_dong_kho_sp_tg_idx'), models.Index(fields=['chung_tu'], name='bien_dong_chung_tu_idx')],
+            },
+        ),
+        migrations.RunPython(tao_so_du_dau_ky, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:38
+
+from django.db import migrations, models
+import re
+
+
+def khoi_tao_bo_dem(apps, schema_editor):
+    """Khởi tạo bộ đếm từ số lớn nhất của các mã chứng từ đã có"""
+    NhapKho = apps.get_model('inventory', 'NhapKho')
+    XuatKho = apps.get_model('inventory', 'XuatKho')
+    BoDemChungTu = apps.get_model('inventory', 'BoDemChungTu')
+
+    lon_nhat = {'NK': 0, 'XK': 0, 'XKNB': 0}
+    ma_list = list(NhapKho.objects.values_list('ma_phieu', flat=True)) + \
+        list(XuatKho.objects.values_list('ma_phieu', flat=True))
+    for ma in ma_list:
+        match = re.match(r'^(NK|XK|XKNB)-(\d+)$', ma or '')
+        if match:
+            tien_to, so = match.group(1), int(match.group(2))
+            lon_nhat[tien_to] = max(lon_nhat[tien_to], so)
+
+    BoDemChungTu.objects.bulk_create([
+        BoDemChungTu(tien_to=tien_to, gia_tri=gia_tri) for tien_to, gia_tri in lon_nhat.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoDemChungTu',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tien_to', models.CharField(max_length=20, unique=True, verbose_name='Tiền tố')),
+                ('gia_tri', models.BigIntegerField(default=0, verbose_name='Số đã cấp gần nhất')),
+            ],
+            options={
+                'verbose_name': 'Bộ đếm chứng từ',
+                'verbose_name_plural': 'Bộ đếm chứng từ',
+            },
+        ),
+        migrations.RunPython(khoi_tao_bo_dem, migrations.RunPython.noop),
+    ]
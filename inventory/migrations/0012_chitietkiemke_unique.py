@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_sanpham_so_luong_toi_thieu'),
+        ('inventory', '0011_bodemchungtu'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='chitietkiemke',
+            unique_together={('kiem_ke', 'san_pham')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_chitietkiemke_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kiemke',
+            name='ma_dieu_chinh',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Mã phiếu điều chỉnh'),
+        ),
+        migrations.AddField(
+            model_name='kiemke',
+            name='ngay_ghi_so',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Ngày ghi sổ chênh lệch'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def dung_luu_chuyen_tu_chung_tu(apps, schema_editor):
+    """Tổng hợp lưu chuyển theo ngày từ các phiếu nhập/chuyển kho đã có"""
+    DailyStockFlow = apps.get_model('inventory', 'DailyStockFlow')
+    ChiTietNhapKho = apps.get_model('inventory', 'ChiTietNhapKho')
+    ChiTietXuatKho = apps.get_model('inventory', 'ChiTietXuatKho')
+
+    tong = {}
+    for dong in ChiTietNhapKho.objects.annotate(ngay=TruncDate('phieu_nhap__ngay_nhap')).values(
+        'phieu_nhap__kho_id', 'san_pham_id', 'ngay'
+    ).annotate(sl=Sum('so_luong'), gt=Sum('thanh_tien')).order_by():
+        dong_tong = tong.setdefault((dong['phieu_nhap__kho_id'], dong['san_pham_id'], dong['ngay']), [0, 0, 0, 0])
+        dong_tong[0] += dong['sl']
+        dong_tong[1] += dong['gt']
+
+    chuyen = ChiTietXuatKho.objects.annotate(ngay=TruncDate('phieu_xuat__ngay_xuat'))
+    for truong_kho, vi_tri in (('phieu_xuat__kho_nhan_id', 2), ('phieu_xuat__kho_id', 3)):
+        for dong in chuyen.values(truong_kho, 'san_pham_id', 'ngay').annotate(sl=Sum('so_luong')).order_by():
+            tong.setdefault((dong[truong_kho], dong['san_pham_id'], dong['ngay']), [0, 0, 0, 0])[vi_tri] += dong['sl']
+
+    DailyStockFlow.objects.bulk_create([
+        DailyStockFlow(
+            kho_id=kho_id, san_pham_id=san_pham_id, ngay=ngay,
+            so_luong_nhap=nhap, gia_tri_nhap=gia_tri, so_luong_nhan=nhan, so_luong_xuat=xuat
+        )
+        for (kho_id, san_pham_id, ngay), (nhap, gia_tri, nhan, xuat) in tong.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_sanpham_so_luong_toi_thieu'),
+        ('inventory', '0013_kiemke_ghi_so'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStockFlow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ngay', models.DateField(verbose_name='Ngày')),
+                ('so_luong_nhap', models.IntegerField(default=0, verbose_name='Số lượng nhập từ nhà cung cấp')),
+                ('gia_tri_nhap', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Giá trị nhập')),
+                ('so_luong_nhan', models.IntegerField(default=0, verbose_name='Số lượng nhận chuyển kho')),
+                ('so_luong_xuat', models.IntegerField(default=0, verbose_name='Số lượng xuất chuyển kho')),
+                ('kho', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.kho', verbose_name='Kho')),
+                ('san_pham', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.sanpham', verbose_name='Sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Lưu chuyển hàng theo ngày',
+                'verbose_name_plural': 'Lưu chuyển hàng theo ngày',
+                'indexes': [models.Index(fields=['ngay', 'kho'], name='luu_chuyen_ngay_kho_idx')],
+                'unique_together': {('kho', 'san_pham', 'ngay')},
+            },
+        ),
+        migrations.RunPython(dung_luu_chuyen_tu_chung_tu, migrations.RunPython.noop),
+    ]
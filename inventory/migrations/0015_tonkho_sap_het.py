@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:52
+
+from django.db import migrations, models
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+
+
+def dien_muc_toi_thieu(apps, schema_editor):
+    """Chép mức tối thiểu từ sản phẩm và tính cờ sắp hết cho các dòng tồn kho đã có"""
+    TonKho = apps.get_model('inventory', 'TonKho')
+    SanPham = apps.get_model('products', 'SanPham')
+    TonKho.objects.update(muc_toi_thieu=Subquery(
+        SanPham.objects.filter(pk=OuterRef('san_pham_id')).values('so_luong_toi_thieu')[:1]
+    ))
+    TonKho.objects.update(sap_het=Case(
+        When(so_luong_ton__lte=F('muc_toi_thieu'), then=Value(True)),
+        default=Value(False),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_sanpham_so_luong_toi_thieu'),
+        ('inventory', '0014_dailystockflow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tonkho',
+            name='muc_toi_thieu',
+            field=models.PositiveIntegerField(default=10, verbose_name='Mức tồn tối thiểu'),
+        ),
+        migrations.AddField(
+            model_name='tonkho',
+            name='sap_het',
+            field=models.BooleanField(default=True, verbose_name='Sắp hết hàng'),
+        ),
+        migrations.RunPython(dien_muc_toi_thieu, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='tonkho',
+            index=models.Index(condition=models.Q(('sap_het', True)), fields=['kho', 'so_luong_ton'], name='tonkho_sap_het_kho_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tonkho',
+            index=models.Index(condition=models.Q(('sap_het', True)), fields=['san_pham', 'so_luong_ton'], name='tonkho_sap_het_sp_idx'),
+        ),
+    ]
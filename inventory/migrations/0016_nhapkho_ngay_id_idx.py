@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_tonkho_sap_het'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='nhapkho',
+            index=models.Index(fields=['-ngay_nhap', '-id'], name='nhap_kho_ngay_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_nhapkho_ngay_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='xuatkho',
+            index=models.Index(fields=['-ngay_xuat', '-id'], name='xuat_kho_ngay_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xuatkho',
+            index=models.Index(fields=['kho', '-ngay_xuat', '-id'], name='xuat_kho_kho_ngay_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xuatkho',
+            index=models.Index(fields=['kho_nhan', '-ngay_xuat', '-id'], name='xuat_kho_kho_nhan_ngay_idx'),
+        ),
+    ]
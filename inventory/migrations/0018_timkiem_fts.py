@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import migrations
+
+# Bản chụp SQL của inventory/search.py tại thời điểm tạo migration; migration không import
+# code ứng dụng nên sửa search.py về sau không đổi hành vi của bước này.
+BANG = 'inventory_timkiem'
+
+TAI_LIEU = [
+    """
+    SELECT n.id * 4 + 1, n.ma_phieu, REPLACE(REPLACE(
+           COALESCE(ncc.ten_nha_cung_cap, '') || ' ' || COALESCE(ncc.ma_nha_cung_cap, '') || ' ' ||
+           COALESCE(k.ten_kho, '') || ' ' || COALESCE(u.username, '') || ' ' || COALESCE(n.ghi_chu, ''),
+           'đ', 'd'), 'Đ', 'D')
+    FROM inventory_nhapkho n
+    LEFT JOIN partners_nhacungcap ncc ON ncc.id = n.nha_cung_cap_id
+    LEFT JOIN inventory_kho k ON k.id = n.kho_id
+    LEFT JOIN {bang_nguoi_dung} u ON u.id = n.nguoi_lap_id
+    """,
+    """
+    SELECT x.id * 4 + 2, x.ma_phieu, REPLACE(REPLACE(
+           COALESCE(k.ten_kho, '') || ' ' || COALESCE(kn.ten_kho, '') || ' ' ||
+           COALESCE(u.username, '') || ' ' || COALESCE(x.ghi_chu, ''),
+           'đ', 'd'), 'Đ', 'D')
+    FROM inventory_xuatkho x
+    LEFT JOIN inventory_kho k ON k.id = x.kho_id
+    LEFT JOIN inventory_kho kn ON kn.id = x.kho_nhan_id
+    LEFT JOIN {bang_nguoi_dung} u ON u.id = x.nguoi_lap_id
+    """,
+    """
+    SELECT kk.id * 4 + 3, kk.ma_kiem_ke, REPLACE(REPLACE(
+           COALESCE(kk.ten_dot_kiem_ke, '') || ' ' || COALESCE(k.ten_kho, '') || ' ' ||
+           COALESCE(u.username, '') || ' ' || COALESCE(kk.mo_ta, ''),
+           'đ', 'd'), 'Đ', 'D')
+    FROM inventory_kiemke kk
+    LEFT JOIN inventory_kho k ON k.id = kk.kho_id
+    LEFT JOIN {bang_nguoi_dung} u ON u.id = kk.nguoi_phu_trach_id
+    """,
+]
+
+
+def tao_chi_muc(apps, schema_editor):
+    """Tạo bảng FTS5 (nếu backend hỗ trợ) và nạp các chứng từ đã có"""
+    ket_noi = schema_editor.connection
+    if ket_noi.vendor != 'sqlite':
+        return
+    bang_nguoi_dung = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    with ket_noi.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {BANG} USING fts5("
+            "ma, noi_dung, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f'DELETE FROM {BANG}')
+        for tai_lieu in TAI_LIEU:
+            cursor.execute(
+                f'INSERT INTO {BANG} (rowid, ma, noi_dung) ' + tai_lieu.format(bang_nguoi_dung=bang_nguoi_dung)
+            )
+
+
+def xoa_chi_muc(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {BANG}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partners', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventory', '0017_xuatkho_ngay_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(tao_chi_muc, xoa_chi_muc),
+    ]
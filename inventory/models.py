@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from products.models import SanPham
@@ -6,7 +6,7 @@ from partners.models import NhaCungCap
 from django.db.models import Sum
 from decimal import Decimal
 from django.core.exceptions import ValidationError
-import re
+from django.utils import timezone
 
 
 class Kho(models.Model):
@@ -44,21 +44,122 @@ class Kho(models.Model):
         return f"{self.ma_kho} - {self.ten_kho}"
 
 
+class BoDemChungTu(models.Model):
+    """Bộ đếm số chứng từ theo tiền tố (NK, XK, XKNB, CN...)"""
+    tien_to = models.CharField(max_length=20, unique=True, verbose_name="Tiền tố")
+    gia_tri = models.BigIntegerField(default=0, verbose_name="Số đã cấp gần nhất")
+
+    class Meta:
+        verbose_name = "Bộ đếm chứng từ"
+        verbose_name_plural = "Bộ đếm chứng từ"
+
+    def __str__(self):
+        return f"{self.tien_to}: {self.gia_tri}"
+
+
 class TonKho(models.Model):
     kho = models.ForeignKey(Kho, on_delete=models.CASCADE, verbose_name="Kho")
     san_pham = models.ForeignKey('products.SanPham', on_delete=models.CASCADE, verbose_name="Sản phẩm")
     so_luong_ton = models.IntegerField(default=0, verbose_name="Số lượng tồn")
     so_luong_kha_dung = models.IntegerField(default=0, verbose_name="Số lượng khả dụng")
+    # Bản sao SanPham.so_luong_toi_thieu và cờ sắp hết hàng, được cập nhật cùng câu lệnh
+    # thay đổi tồn kho để danh sách sắp hết chỉ cần đọc index riêng phần (sap_het = true)
+    muc_toi_thieu = models.PositiveIntegerField(default=10, verbose_name="Mức tồn tối thiểu")
+    sap_het = models.BooleanField(default=True, verbose_name="Sắp hết hàng")
     ngay_cap_nhat = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Tồn kho"
         verbose_name_plural = "Tồn kho"
         unique_together = ['kho', 'san_pham']
+        constraints = [
+            models.CheckConstraint(check=models.Q(so_luong_ton__gte=0), name='tonkho_so_luong_ton_khong_am'),
+            models.CheckConstraint(check=models.Q(so_luong_kha_dung__gte=0), name='tonkho_so_luong_kha_dung_khong_am'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['kho', 'so_luong_ton'], condition=models.Q(sap_het=True), name='tonkho_sap_het_kho_idx'
+            ),
+            models.Index(
+                fields=['san_pham', 'so_luong_ton'], condition=models.Q(sap_het=True), name='tonkho_sap_het_sp_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.kho.ten_kho} - {self.san_pham.ten_san_pham}: {self.so_luong_ton}"
 
+    def save(self, *args, **kwargs):
+        self.sap_het = self.so_luong_ton <= self.muc_toi_thieu
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'so_luong_ton', 'muc_toi_thieu'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'sap_het'}
+        super().save(*args, **kwargs)
+
+
+class StockMovement(models.Model):
+    """Nhật ký biến động tồn kho (chỉ ghi thêm). TonKho là bảng tổng hợp từ nhật ký này."""
+    LOAI_CHOICES = [
+        ('dau_ky', 'Số dư đầu kỳ'),
+        ('nhap', 'Nhập kho'),
+        ('huy_nhap', 'Hủy nhập kho'),
+        ('xuat', 'Xuất chuyển kho'),
+        ('nhan', 'Nhận chuyển kho'),
+        ('kiem_ke', 'Điều chỉnh kiểm kê'),
+    ]
+    kho = models.ForeignKey(Kho, on_delete=models.CASCADE, verbose_name="Kho")
+    san_pham = models.ForeignKey('products.SanPham', on_delete=models.CASCADE, verbose_name="Sản phẩm")
+    thoi_gian = models.DateTimeField(default=timezone.now, verbose_name="Thời gian")
+    loai = models.CharField(max_length=20, choices=LOAI_CHOICES, verbose_name="Loại biến động")
+    so_luong = models.IntegerField(verbose_name="Số lượng")  # dương: vào kho, âm: ra kho
+    gia_tri = models.DecimalField(max_digits=15, decimal_places=2, default=0, verbose_name="Giá trị")
+    chung_tu = models.CharField(max_length=50, blank=True, verbose_name="Chứng từ")
+
+    class Meta:
+        verbose_name = "Biến động tồn kho"
+        verbose_name_plural = "Biến động tồn kho"
+        indexes = [
+            models.Index(fields=['kho', 'san_pham', 'thoi_gian'], name='bien_dong_kho_sp_tg_idx'),
+            models.Index(fields=['chung_tu'], name='bien_dong_chung_tu_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_loai_display()} {self.chung_tu}: {self.so_luong:+d}"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Nhật ký biến động tồn kho chỉ được ghi thêm, không được sửa")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Nhật ký biến động tồn kho chỉ được ghi thêm, không được xóa")
+
+
+
+class DailyStockFlow(models.Model):
+    """Lưu chuyển hàng theo ngày chứng từ của từng cặp kho - sản phẩm
+
+    Được cộng dồn mỗi khi ghi/xóa phiếu nhập hoặc phiếu chuyển kho, để báo cáo theo kỳ
+    chỉ phải đọc số ngày x số sản phẩm thay vì toàn bộ dòng chi tiết chứng từ.
+    Có thể dựng lại từ bảng chứng từ bằng lệnh rebuild_luu_chuyen.
+    """
+    kho = models.ForeignKey(Kho, on_delete=models.CASCADE, verbose_name="Kho")
+    san_pham = models.ForeignKey('products.SanPham', on_delete=models.CASCADE, verbose_name="Sản phẩm")
+    ngay = models.DateField(verbose_name="Ngày")
+    so_luong_nhap = models.IntegerField(default=0, verbose_name="Số lượng nhập từ nhà cung cấp")
+    gia_tri_nhap = models.DecimalField(max_digits=18, decimal_places=2, default=0, verbose_name="Giá trị nhập")
+    so_luong_nhan = models.IntegerField(default=0, verbose_name="Số lượng nhận chuyển kho")
+    so_luong_xuat = models.IntegerField(default=0, verbose_name="Số lượng xuất chuyển kho")
+
+    class Meta:
+        verbose_name = "Lưu chuyển hàng theo ngày"
+        verbose_name_plural = "Lưu chuyển hàng theo ngày"
+        unique_together = ['kho', 'san_pham', 'ngay']
+        indexes = [
+            models.Index(fields=['ngay', 'kho'], name='luu_chuyen_ngay_kho_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ngay} {self.kho_id}/{self.san_pham_id}: +{self.so_luong_nhap} -{self.so_luong_xuat}"
 
 # === NHẬP KHO ===
 class NhapKho(models.Model):
@@ -76,24 +177,28 @@ class NhapKho(models.Model):
         verbose_name = "Phiếu nhập kho"
         verbose_name_plural = "Phiếu nhập kho"
         ordering = ['-ngay_nhap']
+        indexes = [
+            # Phân trang theo con trỏ (ngay_nhap, id) giảm dần
+            models.Index(fields=['-ngay_nhap', '-id'], name='nhap_kho_ngay_id_idx'),
+        ]
 
     def __str__(self):
         return self.ma_phieu
 
     def save(self, *args, **kwargs):
         if not self.ma_phieu:
-            last_phieu = NhapKho.objects.order_by('-id').first()
-            if last_phieu:
-                match = re.search(r'(\d+)$', last_phieu.ma_phieu)
-                if match:
-                    last_number = int(match.group(1))
-                else:
-                    last_number = 0
-                self.ma_phieu = f'NK-{last_number + 1:04d}'
-            else:
-                self.ma_phieu = 'NK-0001'
+            from .services import CapSoChungTu
+            self.ma_phieu = CapSoChungTu.cap_ma('NK')
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        from .services import QuanLyLuuChuyen
+
+        # Chi tiết bị xóa theo CASCADE (không qua ChiTietNhapKho.delete) nên trừ lưu chuyển theo cả phiếu
+        with transaction.atomic():
+            QuanLyLuuChuyen.ghi_phieu_nhap(self, dau=-1)
+            return super().delete(*args, **kwargs)
+
     def update_tong_tien(self):
         from django.db.models import Sum
         from decimal import Decimal
@@ -117,33 +222,49 @@ class ChiTietNhapKho(models.Model):
         return f"{self.san_pham.ten_san_pham} - {self.so_luong}"
 
     def save(self, *args, **kwargs):
+        from .services import QuanLyTonKho, QuanLyLuuChuyen
+
         is_new = self.pk is None
         self.thanh_tien = self.so_luong * self.don_gia
         super().save(*args, **kwargs)
 
-        # Cập nhật tồn kho (TonKho)
+        # Cập nhật tồn kho (TonKho) qua nhật ký biến động và bảng lưu chuyển theo ngày
         if is_new:
-            ton, created = TonKho.objects.get_or_create(kho=self.phieu_nhap.kho, san_pham=self.san_pham)
-            ton.so_luong_ton += self.so_luong
-            ton.so_luong_kha_dung += self.so_luong
-            ton.save()
+            QuanLyTonKho.nhap_hang(
+                self.phieu_nhap.kho, self.san_pham, self.so_luong,
+                chung_tu=self.phieu_nhap.ma_phieu, gia_tri=self.thanh_tien
+            )
+            QuanLyLuuChuyen.cong(
+                self.phieu_nhap.kho, QuanLyLuuChuyen.ngay_chung_tu(self.phieu_nhap.ngay_nhap),
+                so_luong_nhap={self.san_pham_id: self.so_luong},
+                gia_tri_nhap={self.san_pham_id: self.thanh_tien}
+            )
 
         # Cập nhật tổng tiền phiếu nhập
         self.phieu_nhap.update_tong_tien()
 
     def delete(self, *args, **kwargs):
-        phieu_nhap = self.phieu_nhap
-        ton = TonKho.objects.filter(kho=phieu_nhap.kho, san_pham=self.san_pham).first()
-        super().delete(*args, **kwargs)
+        from .services import QuanLyTonKho, QuanLyLuuChuyen
 
-        # Giảm tồn kho khi xóa chi tiết
-        if ton:
-            ton.so_luong_ton -= self.so_luong
-            ton.so_luong_kha_dung -= self.so_luong
-            ton.save()
+        phieu_nhap = self.phieu_nhap
+        co_ton_kho = TonKho.objects.filter(kho=phieu_nhap.kho, san_pham=self.san_pham).exists()
+        with transaction.atomic():
+            super().delete(*args, **kwargs)
+
+            # Giảm tồn kho khi xóa chi tiết
+            if co_ton_kho:
+                QuanLyTonKho.xuat_hang(
+                    phieu_nhap.kho, self.san_pham, self.so_luong,
+                    loai='huy_nhap', chung_tu=phieu_nhap.ma_phieu
+                )
+            QuanLyLuuChuyen.cong(
+                phieu_nhap.kho, QuanLyLuuChuyen.ngay_chung_tu(phieu_nhap.ngay_nhap),
+                so_luong_nhap={self.san_pham_id: -self.so_luong},
+                gia_tri_nhap={self.san_pham_id: -self.thanh_tien}
+            )
 
-        # Cập nhật lại tổng tiền phiếu nhập
-        phieu_nhap.update_tong_tien()
+            # Cập nhật lại tổng tiền phiếu nhập
+            phieu_nhap.update_tong_tien()
 
 
 # === XUẤT KHO ===
@@ -159,21 +280,29 @@ class XuatKho(models.Model):
     class Meta:
         verbose_name = "Phiếu xuất kho"
         verbose_name_plural = "Phiếu xuất kho"
+        indexes = [
+            # Phân trang theo con trỏ (ngay_xuat, id), riêng và kèm bộ lọc kho xuất/kho nhận
+            models.Index(fields=['-ngay_xuat', '-id'], name='xuat_kho_ngay_id_idx'),
+            models.Index(fields=['kho', '-ngay_xuat', '-id'], name='xuat_kho_kho_ngay_idx'),
+            models.Index(fields=['kho_nhan', '-ngay_xuat', '-id'], name='xuat_kho_kho_nhan_ngay_idx'),
+        ]
 
     def __str__(self):
         return self.ma_phieu
 
     def save(self, *args, **kwargs):
         if not self.ma_phieu:
-            last_phieu = XuatKho.objects.order_by('-id').first()
-            if last_phieu:
-                match = re.search(r'(\d+)$', last_phieu.ma_phieu)
-                last_number = int(match.group(1)) if match else 0
-                self.ma_phieu = f'XK-{last_number + 1:04d}'
-            else:
-                self.ma_phieu = 'XK-0001'
+            from .services import CapSoChungTu
+            self.ma_phieu = CapSoChungTu.cap_ma('XK')
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        from .services import QuanLyLuuChuyen
+
+        with transaction.atomic():
+            QuanLyLuuChuyen.ghi_phieu_xuat(self, dau=-1)
+            return super().delete(*args, **kwargs)
+
 
 class ChiTietXuatKho(models.Model):
     phieu_xuat = models.ForeignKey('XuatKho', on_delete=models.CASCADE, related_name='chi_tiet_xuat')
@@ -200,8 +329,13 @@ class ChiTietXuatKho(models.Model):
             )
 
         # Lưu chi tiết xuất
+        is_new = self.pk is None
         super().save(*args, **kwargs)
 
+        if is_new:
+            from .services import QuanLyLuuChuyen
+            QuanLyLuuChuyen.ghi_chuyen_kho(self.phieu_xuat, {self.san_pham_id: self.so_luong})
+
 
 # === KIỂM KÊ ===
 class KiemKe(models.Model):
@@ -223,6 +357,8 @@ class KiemKe(models.Model):
     )
     trang_thai = models.CharField(max_length=20, choices=TRANG_THAI_CHON, default='cho', verbose_name="Trạng thái")
     mo_ta = models.TextField(blank=True, verbose_name="Mô tả")
+    ma_dieu_chinh = models.CharField(max_length=50, blank=True, verbose_name="Mã phiếu điều chỉnh")
+    ngay_ghi_so = models.DateTimeField(null=True, blank=True, verbose_name="Ngày ghi sổ chênh lệch")
     ngay_tao = models.DateTimeField(auto_now_add=True)
     ngay_cap_nhat = models.DateTimeField(auto_now=True)
 
@@ -245,6 +381,7 @@ class ChiTietKiemKe(models.Model):
     class Meta:
         verbose_name = "Chi tiết kiểm kê"
         verbose_name_plural = "Chi tiết kiểm kê"
+        unique_together = ['kiem_ke', 'san_pham']
 
     def save(self, *args, **kwargs):
         self.chenh_lech = self.so_luong_thuc_te - self.so_luong_he_thong
@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class TrangKeyset:
+    """Một trang kết quả phân trang theo con trỏ (keyset)
+
+    Dùng thay Paginator ở các danh sách chứng từ lớn: trang sau được lọc bằng
+    điều kiện (truong, id) < con trỏ nên không cần OFFSET, trang sâu nhanh như trang đầu.
+    """
+
+    def __init__(self, object_list, con_tro_sau=None, con_tro_truoc=None):
+        self.object_list = object_list
+        self.con_tro_sau = con_tro_sau
+        self.con_tro_truoc = con_tro_truoc
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.con_tro_sau is not None
+
+    def has_previous(self):
+        return self.con_tro_truoc is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def _ma_hoa(gia_tri, id_):
+    if isinstance(gia_tri, datetime):
+        gia_tri = gia_tri.isoformat()
+    du_lieu = json.dumps([gia_tri, id_], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(du_lieu).decode().rstrip('=')
+
+
+def _giai_ma(con_tro):
+    """(giá trị, id) từ con trỏ; con trỏ hỏng thì trả về None (quay về trang đầu)"""
+    try:
+        du_lieu = base64.urlsafe_b64decode(con_tro + '=' * (-len(con_tro) % 4))
+        gia_tri, id_ = json.loads(du_lieu)
+        return datetime.fromisoformat(gia_tri), int(id_)
+    except (ValueError, TypeError):
+        return None
+
+
+def phan_trang_keyset(queryset, truong, sau=None, truoc=None, moi_trang=20):
+    """Phân trang giảm dần theo (truong, id), truong là cột thời gian của chứng từ
+
+    sau: con trỏ lấy trang tiếp theo (cũ hơn), truoc: con trỏ lấy trang trước (mới hơn).
+    Mỗi trang chỉ đọc moi_trang + 1 dòng để biết còn trang nữa hay không.
+    """
+    vi_tri_sau = _giai_ma(sau) if sau else None
+    vi_tri_truoc = _giai_ma(truoc) if truoc and not vi_tri_sau else None
+
+    if vi_tri_truoc:
+        gia_tri, id_ = vi_tri_truoc
+        dong = list(
+            queryset.filter(Q(**{f'{truong}__gt': gia_tri}) | Q(**{truong: gia_tri, 'id__gt': id_}))
+            .order_by(truong, 'id')[:moi_trang + 1]
+        )
+        con_trang_truoc = len(dong) > moi_trang
+        dong = dong[:moi_trang][::-1]
+        con_trang_sau = True
+    else:
+        if vi_tri_sau:
+            gia_tri, id_ = vi_tri_sau
+            queryset = queryset.filter(Q(**{f'{truong}__lt': gia_tri}) | Q(**{truong: gia_tri, 'id__lt': id_}))
+        dong = list(queryset.order_by(f'-{truong}', '-id')[:moi_trang + 1])
+        con_trang_sau = len(dong) > moi_trang
+        dong = dong[:moi_trang]
+        con_trang_truoc = vi_tri_sau is not None
+
+    if not dong:
+        return TrangKeyset([])
+    dau, cuoi = dong[0], dong[-1]
+    return TrangKeyset(
+        dong,
+        con_tro_sau=_ma_hoa(getattr(cuoi, truong), cuoi.id) if con_trang_sau else None,
+        con_tro_truoc=_ma_hoa(getattr(dau, truong), dau.id) if con_trang_truoc else None,
+    )
+
+
+def dem_uoc_luong(queryset, gioi_han=1000):
+    """Đếm tối đa gioi_han dòng: (số lượng, True nếu thực tế còn nhiều hơn)
+
+    COUNT(*) trên vài năm chứng từ phải quét hết tập đã lọc; chỉ cần biết "hơn 1000"
+    nên đếm trên truy vấn con có LIMIT.
+    """
+    so_luong = queryset.order_by()[:gioi_han + 1].count()
+    if so_luong > gioi_han:
+        return gioi_han, True
+    return so_luong, False
+
+
+def tham_so_loc(request, bo=('sau', 'truoc', 'page')):
+    """Query string của bộ lọc hiện tại, bỏ con trỏ/số trang (dùng cho liên kết chuyển trang)"""
+    tham_so = request.GET.copy()
+    for ten in bo:
+        tham_so.pop(ten, None)
+    return tham_so.urlencode()
@@ -0,0 +1,232 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection as ket_noi_mac_dinh
+from django.db.models.expressions import RawSQL
+
+# Bảng FTS5 chứa một "tài liệu tìm kiếm" phi chuẩn hóa cho mỗi chứng từ.
+# rowid = id chứng từ * SO_LOAI + mã loại, nên cập nhật/xóa theo rowid không cần cột phụ.
+BANG = 'inventory_timkiem'
+SO_LOAI = 4
+LOAI = {'nhap': 1, 'xuat': 2, 'kiem_ke': 3}
+
+# SELECT (rowid, ma, noi_dung) cho từng loại chứng từ; {dieu_kien} là mệnh đề WHERE theo id,
+# {bang_nguoi_dung} là bảng của AUTH_USER_MODEL. Dấu thanh được tokenizer bỏ (remove_diacritics),
+# riêng đ/Đ là chữ cái riêng nên đổi sang d/D trước khi ghi và khi tìm.
+TAI_LIEU = {
+    'nhap': """
+        SELECT n.id * 4 + 1, n.ma_phieu, REPLACE(REPLACE(
+               COALESCE(ncc.ten_nha_cung_cap, '') || ' ' || COALESCE(ncc.ma_nha_cung_cap, '') || ' ' ||
+               COALESCE(k.ten_kho, '') || ' ' || COALESCE(u.username, '') || ' ' || COALESCE(n.ghi_chu, ''),
+               'đ', 'd'), 'Đ', 'D')
+        FROM inventory_nhapkho n
+        LEFT JOIN partners_nhacungcap ncc ON ncc.id = n.nha_cung_cap_id
+        LEFT JOIN inventory_kho k ON k.id = n.kho_id
+        LEFT JOIN {bang_nguoi_dung} u ON u.id = n.nguoi_lap_id
+        {dieu_kien}
+    """,
+    'xuat': """
+        SELECT x.id * 4 + 2, x.ma_phieu, REPLACE(REPLACE(
+               COALESCE(k.ten_kho, '') || ' ' || COALESCE(kn.ten_kho, '') || ' ' ||
+               COALESCE(u.username, '') || ' ' || COALESCE(x.ghi_chu, ''),
+               'đ', 'd'), 'Đ', 'D')
+        FROM inventory_xuatkho x
+        LEFT JOIN inventory_kho k ON k.id = x.kho_id
+        LEFT JOIN inventory_kho kn ON kn.id = x.kho_nhan_id
+        LEFT JOIN {bang_nguoi_dung} u ON u.id = x.nguoi_lap_id
+        {dieu_kien}
+    """,
+    'kiem_ke': """
+        SELECT kk.id * 4 + 3, kk.ma_kiem_ke, REPLACE(REPLACE(
+               COALESCE(kk.ten_dot_kiem_ke, '') || ' ' || COALESCE(k.ten_kho, '') || ' ' ||
+               COALESCE(u.username, '') || ' ' || COALESCE(kk.mo_ta, ''),
+               'đ', 'd'), 'Đ', 'D')
+        FROM inventory_kiemke kk
+        LEFT JOIN inventory_kho k ON k.id = kk.kho_id
+        LEFT JOIN {bang_nguoi_dung} u ON u.id = kk.nguoi_phu_trach_id
+        {dieu_kien}
+    """,
+}
+
+# Cột tham chiếu dùng để tìm lại chứng từ khi bản ghi liên quan (kho, NCC, user) đổi tên
+COT_THAM_CHIEU = {
+    'nhap': {'kho': ['n.kho_id'], 'nha_cung_cap': ['n.nha_cung_cap_id'], 'nguoi_dung': ['n.nguoi_lap_id']},
+    'xuat': {'kho': ['x.kho_id', 'x.kho_nhan_id'], 'nguoi_dung': ['x.nguoi_lap_id']},
+    'kiem_ke': {'kho': ['kk.kho_id'], 'nguoi_dung': ['kk.nguoi_phu_trach_id']},
+}
+COT_ID = {'nhap': 'n.id', 'xuat': 'x.id', 'kiem_ke': 'kk.id'}
+BANG_GOC = {'nhap': 'inventory_nhapkho n', 'xuat': 'inventory_xuatkho x', 'kiem_ke': 'inventory_kiemke kk'}
+
+
+class TimKiemChungTu:
+    """Chỉ mục tìm kiếm toàn văn (SQLite FTS5) cho phiếu nhập, phiếu chuyển kho và kiểm kê
+
+    Trên CSDL không có FTS5 (hoặc không phải SQLite) mọi hàm ghi là no-op và
+    dieu_kien_tim() trả về None để view dùng lại bộ lọc icontains.
+    """
+
+    _ho_tro = {}
+
+    @staticmethod
+    def _khoa(ket_noi):
+        return (ket_noi.alias, ket_noi.settings_dict['NAME'])
+
+    @staticmethod
+    def ho_tro(ket_noi=ket_noi_mac_dinh):
+        khoa = TimKiemChungTu._khoa(ket_noi)
+        if khoa not in TimKiemChungTu._ho_tro:
+            co_bang = False
+            if ket_noi.vendor == 'sqlite':
+                with ket_noi.cursor() as cursor:
+                    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [BANG])
+                    co_bang = cursor.fetchone() is not None
+            TimKiemChungTu._ho_tro[khoa] = co_bang
+        return TimKiemChungTu._ho_tro[khoa]
+
+    @staticmethod
+    def dat_lai_ho_tro():
+        """Quên kết quả dò bảng FTS đã đệm (sau migrate/tạo/xóa bảng ở tiến trình khác)"""
+        TimKiemChungTu._ho_tro.clear()
+
+    @staticmethod
+    def tao_bang(ket_noi):
+        """Tạo bảng FTS5; trả về False nếu backend không hỗ trợ"""
+        TimKiemChungTu._ho_tro.pop(TimKiemChungTu._khoa(ket_noi), None)
+        if ket_noi.vendor != 'sqlite':
+            return False
+        with ket_noi.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return False
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {BANG} USING fts5("
+                "ma, noi_dung, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        return True
+
+    @staticmethod
+    def xoa_bang(ket_noi):
+        TimKiemChungTu._ho_tro.pop(TimKiemChungTu._khoa(ket_noi), None)
+        if ket_noi.vendor == 'sqlite':
+            with ket_noi.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {BANG}')
+
+    @staticmethod
+    def _ghi(cursor, loai, dieu_kien='', tham_so=()):
+        cursor.execute(
+            f'INSERT INTO {BANG} (rowid, ma, noi_dung) '
+            + TAI_LIEU[loai].format(
+                dieu_kien=dieu_kien, bang_nguoi_dung=get_user_model()._meta.db_table
+            ),
+            tham_so
+        )
+
+    @staticmethod
+    def cap_nhat(loai, ids, ket_noi=ket_noi_mac_dinh):
+        """Ghi lại tài liệu tìm kiếm của các chứng từ (xóa rowid cũ rồi chèn từ bảng gốc)"""
+        ids = [int(i) for i in ids]
+        if not ids or not TimKiemChungTu.ho_tro(ket_noi):
+            return
+        with ket_noi.cursor() as cursor:
+            for dau in range(0, len(ids), 500):
+                lo = ids[dau:dau + 500]
+                dau_hoi = ', '.join(['%s'] * len(lo))
+                cursor.execute(
+                    f'DELETE FROM {BANG} WHERE rowid IN ({dau_hoi})', [i * SO_LOAI + LOAI[loai] for i in lo]
+                )
+                TimKiemChungTu._ghi(cursor, loai, f'WHERE {COT_ID[loai]} IN ({dau_hoi})', lo)
+
+    @staticmethod
+    def xoa(loai, ids, ket_noi=ket_noi_mac_dinh):
+        ids = [int(i) for i in ids]
+        if not ids or not TimKiemChungTu.ho_tro(ket_noi):
+            return
+        with ket_noi.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {BANG} WHERE rowid IN ({", ".join(["%s"] * len(ids))})',
+                [i * SO_LOAI + LOAI[loai] for i in ids]
+            )
+
+    @staticmethod
+    def cap_nhat_theo_tham_chieu(tham_chieu, id_, ket_noi=ket_noi_mac_dinh):
+        """Ghi lại mọi chứng từ tham chiếu tới một kho/nhà cung cấp/người dùng vừa đổi"""
+        if not TimKiemChungTu.ho_tro(ket_noi):
+            return
+        for loai, cot_theo_loai in COT_THAM_CHIEU.items():
+            cac_cot = cot_theo_loai.get(tham_chieu)
+            if not cac_cot:
+                continue
+            with ket_noi.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT {COT_ID[loai]} FROM {BANG_GOC[loai]} WHERE '
+                    + ' OR '.join(f'{cot} = %s' for cot in cac_cot),
+                    [id_] * len(cac_cot)
+                )
+                ids = [dong[0] for dong in cursor.fetchall()]
+            TimKiemChungTu.cap_nhat(loai, ids, ket_noi)
+
+    @staticmethod
+    def dung_lai(ket_noi=ket_noi_mac_dinh):
+        """Dựng lại toàn bộ chỉ mục từ bảng gốc; trả về số tài liệu theo loại"""
+        if not TimKiemChungTu.ho_tro(ket_noi):
+            return None
+        ket_qua = {}
+        with ket_noi.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {BANG}')
+            for loai in TAI_LIEU:
+                TimKiemChungTu._ghi(cursor, loai)
+                ket_qua[loai] = cursor.rowcount
+            cursor.execute(f"INSERT INTO {BANG} ({BANG}) VALUES ('optimize')")
+        return ket_qua
+
+    @staticmethod
+    def bieu_thuc(chuoi):
+        """Chuỗi người dùng -> biểu thức MATCH: mỗi từ là một cụm tìm theo tiền tố, nối bằng AND"""
+        chuoi = chuoi.replace('đ', 'd').replace('Đ', 'D')
+        tu = [t for t in re.split(r'\s+', chuoi.strip()) if re.search(r'\w', t)]
+        return ' AND '.join('"{}"*'.format(t.replace('"', '""')) for t in tu)
+
+    @staticmethod
+    def dieu_kien_tim(loai, chuoi, ket_noi=ket_noi_mac_dinh):
+        """Biểu thức id IN (SELECT ... MATCH ...) để lọc queryset, hoặc None nếu cần dùng icontains"""
+        bieu_thuc = TimKiemChungTu.bieu_thuc(chuoi)
+        if not bieu_thuc or not TimKiemChungTu.ho_tro(ket_noi):
+            return None
+        return RawSQL(
+            f'SELECT rowid / {SO_LOAI} FROM {BANG} WHERE {BANG} MATCH %s AND rowid %% {SO_LOAI} = %s',
+            (bieu_thuc, LOAI[loai])
+        )
+
+    @staticmethod
+    def tim(chuoi, loai=None, gioi_han=50, ket_noi=ket_noi_mac_dinh):
+        """Kết quả xếp hạng bm25 (cột mã chứng từ có trọng số cao hơn)
+
+        Trả về [{loai, id, ma, trich_doan, diem}], hoặc None nếu không có chỉ mục FTS.
+        """
+        bieu_thuc = TimKiemChungTu.bieu_thuc(chuoi)
+        if not TimKiemChungTu.ho_tro(ket_noi):
+            return None
+        if not bieu_thuc:
+            return []
+        dieu_kien, tham_so = '', [bieu_thuc]
+        if loai:
+            dieu_kien = f' AND rowid %% {SO_LOAI} = %s'
+            tham_so.append(LOAI[loai])
+        tham_so.append(gioi_han)
+        ten_loai = {ma: ten for ten, ma in LOAI.items()}
+        with ket_noi.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, ma, snippet({BANG}, 1, '[', ']', '…', 10), bm25({BANG}, 10.0, 1.0) AS diem "
+                f'FROM {BANG} WHERE {BANG} MATCH %s{dieu_kien} ORDER BY diem LIMIT %s',
+                tham_so
+            )
+            return [
+                {
+                    'loai': ten_loai[rowid % SO_LOAI],
+                    'id': rowid // SO_LOAI,
+                    'ma': ma,
+                    'trich_doan': trich_doan,
+                    'diem': round(-diem, 4),
+                }
+                for rowid, ma, trich_doan, diem in cursor.fetchall()
+            ]
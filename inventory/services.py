@@ -1,49 +1,361 @@
-from django.db import transaction, models  # sửa: import models
-from .models import TonKho
+from django.db import IntegrityError, transaction, models  # sửa: import models
+from django.db.models import BooleanField, Case, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from decimal import Decimal
+from products.models import SanPham
+from .models import BoDemChungTu, TonKho, StockMovement, NhapKho, ChiTietNhapKho, XuatKho, ChiTietXuatKho
+from .models import DailyStockFlow
+from .models import KiemKe, ChiTietKiemKe
+from .cache import BoNhoDem
+
+# Số sản phẩm tối đa trong một câu lệnh UPDATE ... CASE (giữ dưới giới hạn tham số của SQLite)
+KICH_THUOC_LO = 200
+
+
+class CapSoChungTu:
+    """Cấp số chứng từ từ bảng đếm theo tiền tố
+
+    Mỗi lần cấp là một lệnh UPDATE gia_tri = gia_tri + n (khóa dòng bộ đếm tới khi
+    giao dịch kết thúc), không đọc mã cuối cùng rồi thử lại như trước.
+    """
+
+    @staticmethod
+    def dinh_dang(tien_to, so):
+        return f'{tien_to}-{so:04d}'
+
+    @staticmethod
+    @transaction.atomic
+    def cap_so(tien_to, so_luong=1):
+        """Giữ chỗ một khối so_luong số liên tiếp, trả về range các số đã cấp"""
+        if so_luong < 1:
+            raise ValueError("Số lượng cần cấp phải lớn hơn 0")
+
+        so_dong = BoDemChungTu.objects.filter(tien_to=tien_to).update(gia_tri=F('gia_tri') + so_luong)
+        if not so_dong:
+            try:
+                with transaction.atomic():
+                    BoDemChungTu.objects.create(tien_to=tien_to, gia_tri=so_luong)
+            except IntegrityError:
+                # Bộ đếm vừa được tạo bởi giao dịch khác
+                BoDemChungTu.objects.filter(tien_to=tien_to).update(gia_tri=F('gia_tri') + so_luong)
+
+        cuoi = BoDemChungTu.objects.filter(tien_to=tien_to).values_list('gia_tri', flat=True).get()
+        return range(cuoi - so_luong + 1, cuoi + 1)
+
+    @staticmethod
+    def cap_ma(tien_to):
+        """Cấp một mã chứng từ, ví dụ NK-0001"""
+        return CapSoChungTu.dinh_dang(tien_to, CapSoChungTu.cap_so(tien_to)[0])
+
+    @staticmethod
+    def cap_ma_hang_loat(tien_to, so_luong):
+        """Cấp so_luong mã chứng từ bằng một lệnh, dùng cho nhập dữ liệu hàng loạt"""
+        return [CapSoChungTu.dinh_dang(tien_to, so) for so in CapSoChungTu.cap_so(tien_to, so_luong)]
 
 
 class QuanLyTonKho:
+    """Mọi thay đổi tồn kho đều đi qua lớp này và được ghi vào nhật ký StockMovement"""
+
+    @staticmethod
+    def ghi_bien_dong(kho, bien_dong, loai, chung_tu=''):
+        """Ghi nhật ký biến động; bien_dong: danh sách (san_pham_id, so_luong, gia_tri)"""
+        thoi_gian = timezone.now()
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                kho=kho,
+                san_pham_id=san_pham_id,
+                thoi_gian=thoi_gian,
+                loai=loai,
+                so_luong=so_luong,
+                gia_tri=gia_tri,
+                chung_tu=chung_tu
+            )
+            for san_pham_id, so_luong, gia_tri in bien_dong
+        ])
+        # Mọi thay đổi tồn kho đều qua đây (kể cả UPDATE hàng loạt không phát tín hiệu)
+        BoNhoDem.tang_phien_ban('ton_kho')
+
     @staticmethod
     @transaction.atomic
-    def nhap_hang(kho, san_pham, so_luong):
-        """Xử lý nhập hàng vào kho"""
-        ton_kho, created = TonKho.objects.get_or_create(
+    def nhap_hang(kho, san_pham, so_luong, loai='nhap', chung_tu='', gia_tri=0):
+        """Xử lý nhập hàng vào kho
+
+        Cộng trực tiếp trong câu lệnh UPDATE (F expression) nên không mất cập nhật
+        khi nhiều người nhập cùng một sản phẩm. Trả về số dòng bị ảnh hưởng.
+        """
+        QuanLyTonKho.ghi_bien_dong(kho, [(san_pham.pk, so_luong, gia_tri)], loai, chung_tu)
+
+        so_dong = TonKho.objects.filter(kho=kho, san_pham=san_pham).update(
+            so_luong_ton=F('so_luong_ton') + so_luong,
+            so_luong_kha_dung=F('so_luong_kha_dung') + so_luong,
+            sap_het=QuanLyTonKho._sap_het_sau(Value(so_luong)),
+            ngay_cap_nhat=timezone.now()
+        )
+        if so_dong:
+            return so_dong
+
+        try:
+            with transaction.atomic():
+                TonKho.objects.create(
+                    kho=kho,
+                    san_pham=san_pham,
+                    so_luong_ton=so_luong,
+                    so_luong_kha_dung=so_luong,
+                    muc_toi_thieu=san_pham.so_luong_toi_thieu
+                )
+            return 1
+        except IntegrityError:
+            # Dòng tồn kho vừa được tạo bởi một giao dịch khác -> cộng dồn vào dòng đó
+            return TonKho.objects.filter(kho=kho, san_pham=san_pham).update(
+                so_luong_ton=F('so_luong_ton') + so_luong,
+                so_luong_kha_dung=F('so_luong_kha_dung') + so_luong,
+                sap_het=QuanLyTonKho._sap_het_sau(Value(so_luong)),
+                ngay_cap_nhat=timezone.now()
+            )
+
+    @staticmethod
+    @transaction.atomic
+    def xuat_hang(kho, san_pham, so_luong, loai='xuat', chung_tu=''):
+        """Xử lý xuất hàng từ kho
+
+        Trừ có điều kiện: UPDATE ... WHERE so_luong_kha_dung >= so_luong. Số dòng bị
+        ảnh hưởng bằng 0 nghĩa là không đủ hàng (hoặc chưa có tồn kho).
+        """
+        so_dong = TonKho.objects.filter(
             kho=kho,
             san_pham=san_pham,
-            defaults={
-                'so_luong_ton': so_luong,
-                'so_luong_kha_dung': so_luong
-            }
+            so_luong_kha_dung__gte=so_luong
+        ).update(
+            so_luong_ton=F('so_luong_ton') - so_luong,
+            so_luong_kha_dung=F('so_luong_kha_dung') - so_luong,
+            sap_het=QuanLyTonKho._sap_het_sau(Value(so_luong), dau=-1),
+            ngay_cap_nhat=timezone.now()
         )
+        if so_dong:
+            QuanLyTonKho.ghi_bien_dong(kho, [(san_pham.pk, -so_luong, 0)], loai, chung_tu)
+            return so_dong
+
+        # Chỉ đọc lại tồn kho khi thất bại để báo lỗi
+        ton_kho = TonKho.objects.filter(kho=kho, san_pham=san_pham).first()
+        if ton_kho is None:
+            raise ValueError(f"Sản phẩm {getattr(san_pham, 'ten_san_pham', san_pham)} không tồn tại trong kho")
+        raise ValueError(
+            f"Không đủ số lượng tồn kho. "
+            f"Yêu cầu: {so_luong}, Tồn kho: {ton_kho.so_luong_kha_dung}"
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def cong_hang_loat(kho, so_luong_theo_san_pham, loai='nhap', chung_tu='', gia_tri_theo_san_pham=None,
+                       san_pham_da_co=None, muc_toi_thieu_theo_san_pham=None):
+        """Cộng tồn kho cho nhiều sản phẩm cùng lúc
+
+        so_luong_theo_san_pham: {san_pham_id: so_luong}. Các dòng TonKho còn thiếu
+        được tạo bằng một lệnh bulk_create, sau đó cộng dồn bằng UPDATE ... CASE
+        theo từng lô thay vì get_or_create + save cho từng sản phẩm.
+        san_pham_da_co: tập san_pham_id đã biết là có dòng TonKho (bỏ qua bước tạo).
+        muc_toi_thieu_theo_san_pham: {san_pham_id: so_luong_toi_thieu} nếu đã đọc sẵn sản phẩm.
+        """
+        if not so_luong_theo_san_pham:
+            return
+
+        gia_tri_theo_san_pham = gia_tri_theo_san_pham or {}
+        QuanLyTonKho.ghi_bien_dong(kho, [
+            (san_pham_id, so_luong, gia_tri_theo_san_pham.get(san_pham_id, 0))
+            for san_pham_id, so_luong in so_luong_theo_san_pham.items()
+        ], loai, chung_tu)
 
-        if not created:
-            ton_kho.so_luong_ton += so_luong
-            ton_kho.so_luong_kha_dung += so_luong
-            ton_kho.save()
+        thieu = [
+            san_pham_id for san_pham_id in so_luong_theo_san_pham
+            if san_pham_da_co is None or san_pham_id not in san_pham_da_co
+        ]
+        if thieu:
+            QuanLyTonKho._tao_dong_ton_kho(kho, thieu, muc_toi_thieu_theo_san_pham)
 
-        return ton_kho
+        items = list(so_luong_theo_san_pham.items())
+        for i in range(0, len(items), KICH_THUOC_LO):
+            lo = items[i:i + KICH_THUOC_LO]
+            chenh_lech = QuanLyTonKho._chenh_lech_theo_san_pham(lo)
+            TonKho.objects.filter(kho=kho, san_pham_id__in=[san_pham_id for san_pham_id, _ in lo]).update(
+                so_luong_ton=F('so_luong_ton') + chenh_lech,
+                so_luong_kha_dung=F('so_luong_kha_dung') + chenh_lech,
+                sap_het=QuanLyTonKho._sap_het_sau(chenh_lech),
+                ngay_cap_nhat=timezone.now(),
+            )
 
     @staticmethod
     @transaction.atomic
-    def xuat_hang(kho, san_pham, so_luong):
-        """Xử lý xuất hàng từ kho"""
-        try:
-            ton_kho = TonKho.objects.get(kho=kho, san_pham=san_pham)
+    def tru_hang_loat(kho, so_luong_theo_san_pham, loai='xuat', chung_tu=''):
+        """Trừ tồn kho cho nhiều sản phẩm cùng lúc, có điều kiện đủ hàng
+
+        Mỗi lô là một UPDATE ... WHERE (san_pham_id = x AND so_luong_kha_dung >= n) OR ...
+        Nếu số dòng bị ảnh hưởng ít hơn số sản phẩm (tồn kho vừa bị giao dịch khác trừ)
+        thì báo ValueError và toàn bộ thay đổi được hoàn tác.
+        """
+        if not so_luong_theo_san_pham:
+            return
 
-            if ton_kho.so_luong_kha_dung < so_luong:
-                raise ValueError(
-                    f"Không đủ số lượng tồn kho. "
-                    f"Yêu cầu: {so_luong}, Tồn kho: {ton_kho.so_luong_kha_dung}"
+        items = list(so_luong_theo_san_pham.items())
+        for i in range(0, len(items), KICH_THUOC_LO):
+            lo = items[i:i + KICH_THUOC_LO]
+            du_hang = Q()
+            for san_pham_id, so_luong in lo:
+                du_hang |= Q(san_pham_id=san_pham_id, so_luong_kha_dung__gte=so_luong)
+            chenh_lech = QuanLyTonKho._chenh_lech_theo_san_pham(lo)
+            so_dong = TonKho.objects.filter(du_hang, kho=kho).update(
+                so_luong_ton=F('so_luong_ton') - chenh_lech,
+                so_luong_kha_dung=F('so_luong_kha_dung') - chenh_lech,
+                sap_het=QuanLyTonKho._sap_het_sau(chenh_lech, dau=-1),
+                ngay_cap_nhat=timezone.now(),
+            )
+            if so_dong != len(lo):
+                raise ValueError("Tồn kho đã thay đổi trong lúc xử lý, không đủ hàng để xuất. Vui lòng thử lại!")
+
+        QuanLyTonKho.ghi_bien_dong(kho, [
+            (san_pham_id, -so_luong, 0) for san_pham_id, so_luong in items
+        ], loai, chung_tu)
+
+    @staticmethod
+    def _sap_het_sau(chenh_lech, dau=1):
+        """Cờ sap_het sau khi cộng (dau=1) / trừ (dau=-1) chenh_lech, tính trong cùng câu UPDATE
+
+        Vế phải của UPDATE đọc giá trị cũ nên điều kiện được viết theo số lượng trước khi đổi:
+        ton + d <= muc  <=>  ton <= muc - d.
+        """
+        nguong = F('muc_toi_thieu') - chenh_lech if dau > 0 else F('muc_toi_thieu') + chenh_lech
+        return Case(
+            When(so_luong_ton__lte=nguong, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        )
+
+    @staticmethod
+    def _tao_dong_ton_kho(kho, san_pham_ids, muc_toi_thieu_theo_san_pham=None):
+        """Tạo các dòng TonKho còn thiếu (số lượng 0) kèm mức tối thiểu của sản phẩm"""
+        san_pham_ids = list(san_pham_ids)
+        if not san_pham_ids:
+            return
+        if muc_toi_thieu_theo_san_pham is None:
+            muc_toi_thieu_theo_san_pham = dict(
+                SanPham.objects.filter(pk__in=san_pham_ids).values_list('id', 'so_luong_toi_thieu')
+            )
+        TonKho.objects.bulk_create(
+            [
+                TonKho(
+                    kho=kho,
+                    san_pham_id=san_pham_id,
+                    muc_toi_thieu=muc_toi_thieu_theo_san_pham.get(san_pham_id, 10),
+                    sap_het=True
                 )
+                for san_pham_id in san_pham_ids
+            ],
+            ignore_conflicts=True,
+            batch_size=500
+        )
 
-            ton_kho.so_luong_ton -= so_luong
-            ton_kho.so_luong_kha_dung -= so_luong
-            ton_kho.save()
+    @staticmethod
+    def cap_nhat_muc_toi_thieu(san_pham_ids=None):
+        """Chép lại SanPham.so_luong_toi_thieu vào TonKho và tính lại cờ sap_het
 
-            return ton_kho
+        san_pham_ids: danh sách/queryset id sản phẩm cần đồng bộ (None = toàn bộ).
+        Chỉ các dòng có mức tối thiểu khác sản phẩm mới bị ghi. Trả về số dòng đã cập nhật.
+        """
+        muc = Subquery(SanPham.objects.filter(pk=OuterRef('san_pham_id')).values('so_luong_toi_thieu')[:1])
+        ton_kho = TonKho.objects.all()
+        if san_pham_ids is not None:
+            ton_kho = ton_kho.filter(san_pham_id__in=san_pham_ids)
+        so_dong = ton_kho.exclude(muc_toi_thieu=muc).update(
+            muc_toi_thieu=muc,
+            sap_het=Case(When(so_luong_ton__lte=muc, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        )
+        if so_dong:
+            BoNhoDem.tang_phien_ban('ton_kho')
+        return so_dong
 
-        except TonKho.DoesNotExist:
-            raise ValueError(f"Sản phẩm {getattr(san_pham, 'ten_san_pham', san_pham)} không tồn tại trong kho")
+    @staticmethod
+    def dat_muc_toi_thieu(san_pham_id, muc_toi_thieu):
+        """Đổi mức tối thiểu của một sản phẩm trên mọi kho bằng một câu lệnh"""
+        so_dong = TonKho.objects.filter(san_pham_id=san_pham_id).exclude(muc_toi_thieu=muc_toi_thieu).update(
+            muc_toi_thieu=muc_toi_thieu,
+            sap_het=Case(
+                When(so_luong_ton__lte=muc_toi_thieu, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+        )
+        if so_dong:
+            BoNhoDem.tang_phien_ban('ton_kho')
+        return so_dong
+
+    @staticmethod
+    def _chenh_lech_theo_san_pham(lo):
+        return Case(
+            *[When(san_pham_id=san_pham_id, then=Value(so_luong)) for san_pham_id, so_luong in lo],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def dung_lai_tu_nhat_ky():
+        """Dựng lại toàn bộ TonKho từ nhật ký StockMovement trong một lượt gom nhóm
+
+        Trả về số dòng tồn kho được ghi.
+        """
+        thoi_gian = timezone.now()
+        tong_theo_cap = (
+            StockMovement.objects
+            .values('kho_id', 'san_pham_id')
+            .annotate(ton=models.Sum('so_luong'))
+            .order_by()
+        )
+
+        so_dong = 0
+        lo = []
+        for dong in tong_theo_cap.iterator(chunk_size=2000):
+            lo.append(TonKho(
+                kho_id=dong['kho_id'],
+                san_pham_id=dong['san_pham_id'],
+                so_luong_ton=dong['ton'],
+                so_luong_kha_dung=dong['ton'],
+                ngay_cap_nhat=thoi_gian
+            ))
+            if len(lo) >= 2000:
+                so_dong += QuanLyTonKho._ghi_de_ton_kho(lo)
+                lo = []
+        so_dong += QuanLyTonKho._ghi_de_ton_kho(lo)
+
+        # Dòng tồn kho không có biến động nào trong nhật ký -> về 0
+        TonKho.objects.exclude(
+            models.Exists(StockMovement.objects.filter(
+                kho_id=models.OuterRef('kho_id'),
+                san_pham_id=models.OuterRef('san_pham_id')
+            ))
+        ).update(so_luong_ton=0, so_luong_kha_dung=0, ngay_cap_nhat=thoi_gian)
+
+        # Dòng mới tạo mang mức mặc định -> đồng bộ mức tối thiểu rồi tính lại cờ sắp hết
+        QuanLyTonKho.cap_nhat_muc_toi_thieu()
+        TonKho.objects.update(sap_het=Case(
+            When(so_luong_ton__lte=F('muc_toi_thieu'), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        ))
+
+        BoNhoDem.tang_phien_ban('ton_kho')
+        return so_dong
+
+    @staticmethod
+    def _ghi_de_ton_kho(ton_kho_list):
+        if not ton_kho_list:
+            return 0
+        TonKho.objects.bulk_create(
+            ton_kho_list,
+            update_conflicts=True,
+            unique_fields=['kho', 'san_pham'],
+            update_fields=['so_luong_ton', 'so_luong_kha_dung', 'ngay_cap_nhat'],
+        )
+        return len(ton_kho_list)
 
     @staticmethod
     def kiem_tra_ton_kho(kho, san_pham):
@@ -57,6 +369,84 @@ class QuanLyTonKho:
         except TonKho.DoesNotExist:
             return {'so_luong_ton': 0, 'so_luong_kha_dung': 0}
 
+    @staticmethod
+    def kha_dung_hang_loat(san_pham_ids=(), ma_san_pham=(), kho_ids=()):
+        """Tồn kho của nhiều sản phẩm ở nhiều kho bằng một truy vấn TonKho
+
+        Sản phẩm được chỉ định bằng id và/hoặc mã; kho_ids rỗng nghĩa là mọi kho.
+        Truy vấn luôn đọc mọi kho của các sản phẩm đó để tính tổng toàn hệ thống,
+        việc lọc theo kho làm trong bộ nhớ. Trả về dict:
+            dong: [(kho_id, san_pham_id, so_luong_ton, so_luong_kha_dung)] - khi có kho_ids thì
+                  đủ mọi cặp (kho, sản phẩm đã biết id), cặp chưa có dòng tồn kho được điền 0
+            tong: {san_pham_id: (tổng tồn, tổng khả dụng)} trên toàn hệ thống
+            ma: {mã: san_pham_id} cho các mã tìm thấy dòng tồn kho
+            khong_co_ton: các mã không có dòng tồn kho nào (mã sai hoặc chưa từng nhập)
+        """
+        san_pham_ids = set(san_pham_ids)
+        ma_san_pham = set(ma_san_pham)
+        kho_ids = set(kho_ids)
+
+        dieu_kien = models.Q(san_pham_id__in=san_pham_ids) if san_pham_ids else models.Q()
+        if ma_san_pham:
+            theo_ma = models.Q(san_pham__ma_san_pham__in=ma_san_pham)
+            dieu_kien = dieu_kien | theo_ma if san_pham_ids else theo_ma
+        if not san_pham_ids and not ma_san_pham:
+            return {'dong': [], 'tong': {}, 'ma': {}, 'khong_co_ton': []}
+
+        ton_theo_cap = {}
+        tong = {}
+        ma = {}
+        for kho_id, san_pham_id, ma_sp, ton, kha_dung in TonKho.objects.filter(dieu_kien).values_list(
+            'kho_id', 'san_pham_id', 'san_pham__ma_san_pham', 'so_luong_ton', 'so_luong_kha_dung'
+        ).order_by('san_pham_id', 'kho_id'):
+            tong_sp = tong.get(san_pham_id, (0, 0))
+            tong[san_pham_id] = (tong_sp[0] + ton, tong_sp[1] + kha_dung)
+            if ma_sp in ma_san_pham:
+                ma[ma_sp] = san_pham_id
+            if not kho_ids or kho_id in kho_ids:
+                ton_theo_cap[(kho_id, san_pham_id)] = (ton, kha_dung)
+
+        cac_san_pham = san_pham_ids | set(ma.values())
+        if kho_ids:
+            dong = [
+                (kho_id, san_pham_id) + ton_theo_cap.get((kho_id, san_pham_id), (0, 0))
+                for san_pham_id in sorted(cac_san_pham) for kho_id in sorted(kho_ids)
+            ]
+        else:
+            dong = [cap + gia_tri for cap, gia_tri in ton_theo_cap.items()]
+        for san_pham_id in san_pham_ids:
+            tong.setdefault(san_pham_id, (0, 0))
+
+        return {
+            'dong': dong,
+            'tong': tong,
+            'ma': ma,
+            'khong_co_ton': sorted(ma_san_pham - set(ma)),
+        }
+
+    @staticmethod
+    def ma_tran(kho_ids, ton_kho=None):
+        """Ma trận tồn kho sản phẩm x kho bằng tổng có điều kiện (SUM ... FILTER/CASE)
+
+        Trả về (dong, tong_theo_kho):
+            dong: queryset một dòng mỗi sản phẩm với cột kho_<id> cho từng kho trong kho_ids
+                  và cột tong (tổng dòng), sắp theo mã sản phẩm - phân trang trực tiếp được
+            tong_theo_kho: dict {kho_<id>: tổng cột, 'tong': tổng chung} tính bằng một aggregate
+        ton_kho: queryset TonKho đã lọc (theo sản phẩm/danh mục...), mặc định toàn bộ.
+        """
+        ton_kho = (TonKho.objects.all() if ton_kho is None else ton_kho).filter(kho_id__in=kho_ids)
+        cot = {
+            f'kho_{kho_id}': Sum('so_luong_ton', filter=Q(kho_id=kho_id), default=0)
+            for kho_id in kho_ids
+        }
+        dong = (
+            ton_kho.values('san_pham_id', 'san_pham__ma_san_pham', 'san_pham__ten_san_pham')
+            .annotate(**cot, tong=Sum('so_luong_ton'))
+            .order_by('san_pham__ma_san_pham')
+        )
+        tong_theo_kho = ton_kho.aggregate(**cot, tong=Sum('so_luong_ton', default=0))
+        return dong, tong_theo_kho
+
     @staticmethod
     def get_tong_ton_kho(san_pham):
         """Lấy tổng tồn kho của sản phẩm across all kho"""
@@ -68,3 +458,423 @@ class QuanLyTonKho:
             'tong_ton': tong_ton_kho['tong_ton'] or 0,
             'tong_kha_dung': tong_ton_kho['tong_kha_dung'] or 0
         }
+
+    @staticmethod
+    def kiem_tra_san_pham(dong_hang, san_pham_theo_id):
+        """Báo ValueError nếu dong_hang rỗng hoặc có mã sản phẩm không còn trong danh mục"""
+        if not dong_hang:
+            raise ValueError("Phiếu phải có ít nhất một sản phẩm!")
+        thieu = sorted({dong[0] for dong in dong_hang} - set(san_pham_theo_id))
+        if thieu:
+            raise ValueError(f"Không tìm thấy sản phẩm có id {', '.join(map(str, thieu))}, vui lòng chọn lại!")
+
+
+class QuanLyLuuChuyen:
+    """Cập nhật bảng tổng hợp DailyStockFlow theo ngày chứng từ
+
+    Mỗi cột là một dict {san_pham_id: chênh lệch}. Dòng còn thiếu được tạo bằng
+    bulk_create(ignore_conflicts), sau đó cộng dồn bằng UPDATE ... CASE theo lô như TonKho.
+    """
+
+    COT_SO_LUONG = ['so_luong_nhap', 'so_luong_nhan', 'so_luong_xuat']
+
+    @staticmethod
+    def ngay_chung_tu(thoi_gian):
+        return timezone.localdate(thoi_gian) if timezone.is_aware(thoi_gian) else thoi_gian.date()
+
+    @staticmethod
+    @transaction.atomic
+    def cong(kho, ngay, **chenh_lech_theo_cot):
+        chenh_lech_theo_cot = {cot: gia_tri for cot, gia_tri in chenh_lech_theo_cot.items() if gia_tri}
+        if not chenh_lech_theo_cot:
+            return
+
+        san_pham_ids = sorted({sp_id for gia_tri in chenh_lech_theo_cot.values() for sp_id in gia_tri})
+        DailyStockFlow.objects.bulk_create(
+            [DailyStockFlow(kho=kho, san_pham_id=sp_id, ngay=ngay) for sp_id in san_pham_ids],
+            ignore_conflicts=True,
+        )
+
+        kich_thuoc_lo = max(1, KICH_THUOC_LO // len(chenh_lech_theo_cot))
+        for i in range(0, len(san_pham_ids), kich_thuoc_lo):
+            lo = san_pham_ids[i:i + kich_thuoc_lo]
+            cap_nhat = {}
+            for cot, gia_tri in chenh_lech_theo_cot.items():
+                kieu = DecimalField(max_digits=18, decimal_places=2) if cot == 'gia_tri_nhap' else IntegerField()
+                cap_nhat[cot] = F(cot) + Case(
+                    *[When(san_pham_id=sp_id, then=Value(gia_tri[sp_id], output_field=kieu))
+                      for sp_id in lo if sp_id in gia_tri],
+                    default=Value(0, output_field=kieu),
+                    output_field=kieu,
+                )
+            DailyStockFlow.objects.filter(kho=kho, ngay=ngay, san_pham_id__in=lo).update(**cap_nhat)
+        BoNhoDem.tang_phien_ban('luu_chuyen')
+
+    @staticmethod
+    def ghi_phieu_nhap(phieu_nhap, dau=1):
+        """Cộng (dau=1) hoặc trừ (dau=-1) toàn bộ dòng của một phiếu nhập"""
+        so_luong, gia_tri = {}, {}
+        for sp_id, sl, gt in (
+            phieu_nhap.chi_tiet_nhap.values('san_pham_id')
+            .annotate(sl=Sum('so_luong'), gt=Sum('thanh_tien'))
+            .values_list('san_pham_id', 'sl', 'gt')
+            .order_by()
+        ):
+            so_luong[sp_id] = dau * sl
+            gia_tri[sp_id] = dau * gt
+        QuanLyLuuChuyen.cong(
+            phieu_nhap.kho, QuanLyLuuChuyen.ngay_chung_tu(phieu_nhap.ngay_nhap),
+            so_luong_nhap=so_luong, gia_tri_nhap=gia_tri
+        )
+
+    @staticmethod
+    def ghi_phieu_xuat(phieu_xuat, dau=1):
+        """Cộng (dau=1) hoặc trừ (dau=-1) toàn bộ dòng của một phiếu chuyển kho"""
+        so_luong = {
+            sp_id: dau * sl
+            for sp_id, sl in (
+                phieu_xuat.chi_tiet_xuat.values('san_pham_id')
+                .annotate(sl=Sum('so_luong'))
+                .values_list('san_pham_id', 'sl')
+                .order_by()
+            )
+        }
+        QuanLyLuuChuyen.ghi_chuyen_kho(phieu_xuat, so_luong)
+
+    @staticmethod
+    def ghi_chuyen_kho(phieu_xuat, so_luong_theo_san_pham):
+        ngay = QuanLyLuuChuyen.ngay_chung_tu(phieu_xuat.ngay_xuat)
+        QuanLyLuuChuyen.cong(phieu_xuat.kho, ngay, so_luong_xuat=so_luong_theo_san_pham)
+        QuanLyLuuChuyen.cong(phieu_xuat.kho_nhan, ngay, so_luong_nhan=so_luong_theo_san_pham)
+
+    @staticmethod
+    @transaction.atomic
+    def dung_lai(tu_ngay=None, den_ngay=None):
+        """Dựng lại DailyStockFlow từ bảng chứng từ (toàn bộ hoặc trong khoảng ngày)
+
+        Ba truy vấn gom nhóm theo ngày (nhập, xuất chuyển, nhận chuyển) được ghi lần lượt
+        bằng bulk_create(update_conflicts) theo khối, không giữ toàn bộ kết quả trong bộ nhớ.
+        Trả về số dòng tổng hợp sau khi dựng lại.
+        """
+        pham_vi = DailyStockFlow.objects.all()
+        if tu_ngay:
+            pham_vi = pham_vi.filter(ngay__gte=tu_ngay)
+        if den_ngay:
+            pham_vi = pham_vi.filter(ngay__lte=den_ngay)
+        pham_vi.delete()
+
+        def loc_ngay(queryset, truong):
+            if tu_ngay:
+                queryset = queryset.filter(**{f'{truong}__gte': tu_ngay})
+            if den_ngay:
+                queryset = queryset.filter(**{f'{truong}__lte': den_ngay})
+            return queryset
+
+        nhap = loc_ngay(
+            ChiTietNhapKho.objects.annotate(ngay=TruncDate('phieu_nhap__ngay_nhap')), 'ngay'
+        ).values('phieu_nhap__kho_id', 'san_pham_id', 'ngay').annotate(
+            so_luong_nhap=Sum('so_luong'), gia_tri_nhap=Sum('thanh_tien')
+        ).order_by()
+        QuanLyLuuChuyen._ghi_de(
+            (DailyStockFlow(
+                kho_id=dong['phieu_nhap__kho_id'], san_pham_id=dong['san_pham_id'], ngay=dong['ngay'],
+                so_luong_nhap=dong['so_luong_nhap'], gia_tri_nhap=dong['gia_tri_nhap']
+            ) for dong in nhap.iterator(chunk_size=2000)),
+            ['so_luong_nhap', 'gia_tri_nhap']
+        )
+
+        chuyen = loc_ngay(
+            ChiTietXuatKho.objects.annotate(ngay=TruncDate('phieu_xuat__ngay_xuat')), 'ngay'
+        )
+        for truong_kho, cot in (('phieu_xuat__kho_id', 'so_luong_xuat'), ('phieu_xuat__kho_nhan_id', 'so_luong_nhan')):
+            tong = chuyen.values(truong_kho, 'san_pham_id', 'ngay').annotate(sl=Sum('so_luong')).order_by()
+            QuanLyLuuChuyen._ghi_de(
+                (DailyStockFlow(
+                    kho_id=dong[truong_kho], san_pham_id=dong['san_pham_id'], ngay=dong['ngay'], **{cot: dong['sl']}
+                ) for dong in tong.iterator(chunk_size=2000)),
+                [cot]
+            )
+
+        BoNhoDem.tang_phien_ban('luu_chuyen')
+        return pham_vi.count()
+
+    @staticmethod
+    def _ghi_de(cac_dong, cot_cap_nhat, kich_thuoc=2000):
+        lo = []
+        for dong in cac_dong:
+            lo.append(dong)
+            if len(lo) >= kich_thuoc:
+                DailyStockFlow.objects.bulk_create(
+                    lo, update_conflicts=True,
+                    unique_fields=['kho', 'san_pham', 'ngay'], update_fields=cot_cap_nhat
+                )
+                lo = []
+        if lo:
+            DailyStockFlow.objects.bulk_create(
+                lo, update_conflicts=True,
+                unique_fields=['kho', 'san_pham', 'ngay'], update_fields=cot_cap_nhat
+            )
+
+
+class QuanLyNhapKho:
+    @staticmethod
+    @transaction.atomic
+    def tao_phieu_nhap(kho, nha_cung_cap, nguoi_lap, dong_hang, ghi_chu=''):
+        """Tạo phiếu nhập kho cùng toàn bộ chi tiết theo lô
+
+        dong_hang: danh sách (san_pham_id, so_luong, don_gia) đã được kiểm tra kiểu.
+        Báo ValueError nếu phiếu không có dòng hoặc có sản phẩm không tồn tại (trước khi tạo phiếu).
+        """
+        # Tra cứu toàn bộ sản phẩm của phiếu bằng một truy vấn
+        san_pham_theo_id = SanPham.objects.in_bulk({san_pham_id for san_pham_id, _, _ in dong_hang})
+        QuanLyTonKho.kiem_tra_san_pham(dong_hang, san_pham_theo_id)
+
+        nhapkho = NhapKho.objects.create(
+            nha_cung_cap=nha_cung_cap,
+            nguoi_lap=nguoi_lap,
+            kho=kho,
+            ghi_chu=ghi_chu,
+            ngay_nhap=timezone.now(),
+            tong_tien=0
+        )
+
+        chi_tiet_list = []
+        so_luong_theo_san_pham = {}
+        gia_tri_theo_san_pham = {}
+        tong_tien = Decimal('0')
+        for san_pham_id, so_luong, don_gia in dong_hang:
+            sp = san_pham_theo_id[san_pham_id]
+            thanh_tien = so_luong * don_gia
+            chi_tiet_list.append(ChiTietNhapKho(
+                phieu_nhap=nhapkho,
+                san_pham=sp,
+                so_luong=so_luong,
+                don_gia=don_gia,
+                thanh_tien=thanh_tien
+            ))
+            so_luong_theo_san_pham[sp.id] = so_luong_theo_san_pham.get(sp.id, 0) + so_luong
+            gia_tri_theo_san_pham[sp.id] = gia_tri_theo_san_pham.get(sp.id, 0) + thanh_tien
+            tong_tien += thanh_tien
+
+        # bulk_create bỏ qua ChiTietNhapKho.save() nên tồn kho và tổng tiền được cập nhật một lần ở đây
+        ChiTietNhapKho.objects.bulk_create(chi_tiet_list)
+        QuanLyTonKho.cong_hang_loat(
+            kho, so_luong_theo_san_pham,
+            chung_tu=nhapkho.ma_phieu, gia_tri_theo_san_pham=gia_tri_theo_san_pham,
+            muc_toi_thieu_theo_san_pham={sp.id: sp.so_luong_toi_thieu for sp in san_pham_theo_id.values()}
+        )
+        QuanLyLuuChuyen.cong(
+            kho, QuanLyLuuChuyen.ngay_chung_tu(nhapkho.ngay_nhap),
+            so_luong_nhap=so_luong_theo_san_pham, gia_tri_nhap=gia_tri_theo_san_pham
+        )
+
+        nhapkho.tong_tien = tong_tien
+        nhapkho.save(update_fields=['tong_tien'])
+
+        return nhapkho
+
+
+class QuanLyXuatKho:
+    @staticmethod
+    @transaction.atomic
+    def tao_phieu_chuyen(kho_xuat, kho_nhan, nguoi_lap, dong_hang, ghi_chu=''):
+        """Tạo phiếu xuất chuyển kho nội bộ trong một lượt
+
+        dong_hang: danh sách (san_pham_id, so_luong) đã được kiểm tra kiểu.
+        Sản phẩm và tồn kho của cả hai kho được đọc bằng hai truy vấn, toàn bộ dòng
+        được kiểm tra trong bộ nhớ rồi mới trừ/cộng tồn kho theo lô.
+        Báo ValueError nếu phiếu không có dòng, có sản phẩm không tồn tại hoặc không đủ tồn kho
+        (trước khi tạo phiếu nên không tốn số XKNB).
+        """
+        san_pham_theo_id = SanPham.objects.in_bulk({san_pham_id for san_pham_id, _ in dong_hang})
+        QuanLyTonKho.kiem_tra_san_pham(dong_hang, san_pham_theo_id)
+
+        dong_hop_le = []
+        so_luong_theo_san_pham = {}
+        for san_pham_id, so_luong in dong_hang:
+            sp = san_pham_theo_id[san_pham_id]
+            dong_hop_le.append((sp, so_luong))
+            so_luong_theo_san_pham[sp.id] = so_luong_theo_san_pham.get(sp.id, 0) + so_luong
+
+        ton_kho_xuat = {}
+        san_pham_kho_nhan = set()
+        for kho_id, san_pham_id, kha_dung in TonKho.objects.filter(
+            kho__in=[kho_xuat, kho_nhan],
+            san_pham_id__in=so_luong_theo_san_pham
+        ).values_list('kho_id', 'san_pham_id', 'so_luong_kha_dung'):
+            if kho_id == kho_xuat.id:
+                ton_kho_xuat[san_pham_id] = kha_dung
+            else:
+                san_pham_kho_nhan.add(san_pham_id)
+
+        for sp, _ in dong_hop_le:
+            con_lai = ton_kho_xuat.get(sp.id, 0)
+            if con_lai < so_luong_theo_san_pham[sp.id]:
+                raise ValueError(f"Sản phẩm {sp.ten_san_pham} không đủ tồn kho (còn {con_lai})!")
+
+        xuatkho = XuatKho.objects.create(
+            ma_phieu=CapSoChungTu.cap_ma('XKNB'),
+            nguoi_lap=nguoi_lap,
+            kho=kho_xuat,
+            kho_nhan=kho_nhan,
+            ghi_chu=ghi_chu,
+            ngay_xuat=timezone.now()
+        )
+
+        # bulk_create bỏ qua ChiTietXuatKho.save() vì tồn kho đã được kiểm tra ở trên
+        ChiTietXuatKho.objects.bulk_create([
+            ChiTietXuatKho(phieu_xuat=xuatkho, san_pham=sp, so_luong=so_luong)
+            for sp, so_luong in dong_hop_le
+        ])
+        QuanLyTonKho.tru_hang_loat(kho_xuat, so_luong_theo_san_pham, chung_tu=xuatkho.ma_phieu)
+        QuanLyTonKho.cong_hang_loat(
+            kho_nhan, so_luong_theo_san_pham,
+            loai='nhan', chung_tu=xuatkho.ma_phieu, san_pham_da_co=san_pham_kho_nhan,
+            muc_toi_thieu_theo_san_pham={sp.id: sp.so_luong_toi_thieu for sp, _ in dong_hop_le}
+        )
+        QuanLyLuuChuyen.ghi_chuyen_kho(xuatkho, so_luong_theo_san_pham)
+
+        return xuatkho
+
+
+class QuanLyKiemKe:
+    @staticmethod
+    def lap_phieu_dem(kiem_ke, san_phams):
+        """Dựng các dòng phiếu kiểm kê cho một nhóm sản phẩm (thường là một trang)
+
+        Tồn kho và kết quả đã nhập được đọc bằng hai truy vấn cho cả nhóm.
+        """
+        san_phams = list(san_phams)
+        ids = [sp.id for sp in san_phams]
+        ton_kho_map = dict(
+            TonKho.objects.filter(kho=kiem_ke.kho, san_pham_id__in=ids)
+            .values_list('san_pham_id', 'so_luong_ton')
+        )
+        chi_tiet_map = {
+            ct.san_pham_id: ct
+            for ct in ChiTietKiemKe.objects.filter(kiem_ke=kiem_ke, san_pham_id__in=ids)
+        }
+
+        dong_list = []
+        for sp in san_phams:
+            so_luong_he_thong = ton_kho_map.get(sp.id, 0)
+            chi_tiet = chi_tiet_map.get(sp.id)
+            dong_list.append({
+                'san_pham': sp,
+                'so_luong_he_thong': so_luong_he_thong,
+                'so_luong_thuc_te': chi_tiet.so_luong_thuc_te if chi_tiet else so_luong_he_thong,
+                'chenh_lech': chi_tiet.chenh_lech if chi_tiet else 0,
+                'ghi_chu': chi_tiet.ghi_chu if chi_tiet else ''
+            })
+        return dong_list
+
+    @staticmethod
+    @transaction.atomic
+    def luu_ket_qua(kiem_ke, ket_qua):
+        """Lưu kết quả đếm thực tế bằng bulk_create/bulk_update
+
+        ket_qua: {san_pham_id: (so_luong_thuc_te, ghi_chu)}. Trả về số dòng đã lưu.
+        Báo ValueError nếu có số lượng thực tế âm.
+        """
+        if any(so_luong_thuc_te < 0 for so_luong_thuc_te, _ in ket_qua.values()):
+            raise ValueError("Số lượng thực tế không được âm!")
+        ids = set(SanPham.objects.filter(id__in=ket_qua).values_list('id', flat=True))
+        ton_kho_map = dict(
+            TonKho.objects.filter(kho=kiem_ke.kho, san_pham_id__in=ids)
+            .values_list('san_pham_id', 'so_luong_ton')
+        )
+        chi_tiet_map = {
+            ct.san_pham_id: ct
+            for ct in ChiTietKiemKe.objects.filter(kiem_ke=kiem_ke, san_pham_id__in=ids)
+        }
+
+        tao_moi = []
+        cap_nhat = []
+        for san_pham_id in ids:
+            so_luong_thuc_te, ghi_chu = ket_qua[san_pham_id]
+            so_luong_he_thong = ton_kho_map.get(san_pham_id, 0)
+            chi_tiet = chi_tiet_map.get(san_pham_id)
+            if chi_tiet is None:
+                chi_tiet = ChiTietKiemKe(kiem_ke=kiem_ke, san_pham_id=san_pham_id)
+                tao_moi.append(chi_tiet)
+            else:
+                cap_nhat.append(chi_tiet)
+            chi_tiet.so_luong_he_thong = so_luong_he_thong
+            chi_tiet.so_luong_thuc_te = so_luong_thuc_te
+            # bulk_* bỏ qua ChiTietKiemKe.save() nên tự tính chênh lệch
+            chi_tiet.chenh_lech = so_luong_thuc_te - so_luong_he_thong
+            chi_tiet.ghi_chu = ghi_chu
+
+        ChiTietKiemKe.objects.bulk_create(tao_moi, batch_size=500)
+        ChiTietKiemKe.objects.bulk_update(
+            cap_nhat,
+            ['so_luong_he_thong', 'so_luong_thuc_te', 'chenh_lech', 'ghi_chu'],
+            batch_size=500
+        )
+        return len(tao_moi) + len(cap_nhat)
+
+    @staticmethod
+    @transaction.atomic
+    def ghi_so_chenh_lech(kiem_ke):
+        """Ghi chênh lệch kiểm kê vào TonKho (chỉ một lần cho mỗi đợt)
+
+        Toàn bộ chênh lệch được cộng bằng một lệnh UPDATE lấy giá trị từ ChiTietKiemKe,
+        được ghi thành phiếu điều chỉnh (mã DC-xxxx) và vào nhật ký biến động.
+        Trả về False nếu đợt kiểm kê đã được ghi sổ trước đó.
+        """
+        thoi_gian = timezone.now()
+
+        # Đánh dấu đã ghi sổ có điều kiện -> gọi lại lần hai không làm gì
+        so_dong = KiemKe.objects.filter(
+            pk=kiem_ke.pk,
+            trang_thai='hoan_thanh',
+            ngay_ghi_so__isnull=True
+        ).update(ngay_ghi_so=thoi_gian)
+        if not so_dong:
+            if not KiemKe.objects.filter(pk=kiem_ke.pk, trang_thai='hoan_thanh').exists():
+                raise ValueError("Chỉ ghi sổ được đợt kiểm kê đã hoàn thành!")
+            return False
+
+        ma_dieu_chinh = CapSoChungTu.cap_ma('DC')
+        KiemKe.objects.filter(pk=kiem_ke.pk).update(ma_dieu_chinh=ma_dieu_chinh)
+        BoNhoDem.tang_phien_ban('kiem_ke')
+        kiem_ke.ngay_ghi_so = thoi_gian
+        kiem_ke.ma_dieu_chinh = ma_dieu_chinh
+
+        co_chenh_lech = ChiTietKiemKe.objects.filter(kiem_ke=kiem_ke).exclude(chenh_lech=0)
+
+        # Sản phẩm thừa nhưng chưa có dòng tồn kho -> tạo dòng 0 trước khi cộng
+        chua_co_ton = (
+            co_chenh_lech.filter(chenh_lech__gt=0)
+            .exclude(san_pham_id__in=TonKho.objects.filter(kho=kiem_ke.kho).values('san_pham_id'))
+            .values_list('san_pham_id', flat=True)
+        )
+        QuanLyTonKho._tao_dong_ton_kho(kiem_ke.kho, chua_co_ton.iterator())
+        # Sản phẩm thiếu mà không có dòng tồn kho thì không có gì để trừ -> bỏ qua ở cả UPDATE
+        # lẫn nhật ký, để dựng lại TonKho từ nhật ký không ra số âm
+        co_chenh_lech = co_chenh_lech.filter(
+            san_pham_id__in=TonKho.objects.filter(kho=kiem_ke.kho).values('san_pham_id')
+        )
+
+        chenh_lech = Subquery(
+            ChiTietKiemKe.objects.filter(kiem_ke=kiem_ke, san_pham_id=OuterRef('san_pham_id')).values('chenh_lech')[:1]
+        )
+        TonKho.objects.filter(
+            kho=kiem_ke.kho,
+            san_pham_id__in=co_chenh_lech.values('san_pham_id')
+        ).update(
+            so_luong_ton=F('so_luong_ton') + chenh_lech,
+            so_luong_kha_dung=F('so_luong_kha_dung') + chenh_lech,
+            sap_het=QuanLyTonKho._sap_het_sau(chenh_lech),
+            ngay_cap_nhat=thoi_gian
+        )
+
+        lo = []
+        for san_pham_id, so_luong in co_chenh_lech.values_list('san_pham_id', 'chenh_lech').iterator(chunk_size=5000):
+            lo.append((san_pham_id, so_luong, 0))
+            if len(lo) >= 5000:
+                QuanLyTonKho.ghi_bien_dong(kiem_ke.kho, lo, 'kiem_ke', ma_dieu_chinh)
+                lo = []
+        QuanLyTonKho.ghi_bien_dong(kiem_ke.kho, lo, 'kiem_ke', ma_dieu_chinh)
+
+        return True
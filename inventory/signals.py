@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+from partners.models import NhaCungCap
+from products.models import SanPham, DanhMucSanPham, DonViTinh
+from .cache import BoNhoDem
+from .models import Kho, TonKho, NhapKho, XuatKho, KiemKe
+from .search import TimKiemChungTu
+
+# Model -> nhóm dữ liệu cần tăng phiên bản khi có bản ghi được lưu/xóa.
+# Các thao tác hàng loạt (bulk_create, update()) không phát tín hiệu nên
+# lớp dịch vụ tự gọi BoNhoDem.tang_phien_ban.
+NHOM_THEO_MODEL = {
+    NhapKho: ['nhap_kho'],
+    XuatKho: ['xuat_kho'],
+    TonKho: ['ton_kho'],
+    KiemKe: ['kiem_ke'],
+    Kho: ['kho'],
+    SanPham: ['san_pham'],
+    DanhMucSanPham: ['san_pham'],
+    DonViTinh: ['san_pham'],
+    NhaCungCap: ['doi_tac'],
+}
+
+
+def tang_phien_ban_du_lieu(sender, **kwargs):
+    BoNhoDem.tang_phien_ban(*NHOM_THEO_MODEL[sender])
+
+
+for _model in NHOM_THEO_MODEL:
+    post_save.connect(tang_phien_ban_du_lieu, sender=_model, dispatch_uid=f'bnd_luu_{_model.__name__}')
+    post_delete.connect(tang_phien_ban_du_lieu, sender=_model, dispatch_uid=f'bnd_xoa_{_model.__name__}')
+
+
+def dong_bo_muc_toi_thieu(sender, instance, **kwargs):
+    """Mức tối thiểu của sản phẩm được chép sang TonKho để cờ sắp hết luôn đúng"""
+    from .services import QuanLyTonKho
+    QuanLyTonKho.dat_muc_toi_thieu(instance.pk, instance.so_luong_toi_thieu)
+
+
+post_save.connect(dong_bo_muc_toi_thieu, sender=SanPham, dispatch_uid='dong_bo_muc_toi_thieu')
+
+
+# Chỉ mục tìm kiếm toàn văn của chứng từ (inventory/search.py)
+LOAI_TIM_KIEM = {NhapKho: 'nhap', XuatKho: 'xuat', KiemKe: 'kiem_ke'}
+
+
+def cap_nhat_tim_kiem(sender, instance, **kwargs):
+    TimKiemChungTu.cap_nhat(LOAI_TIM_KIEM[sender], [instance.pk])
+
+
+def xoa_tim_kiem(sender, instance, **kwargs):
+    TimKiemChungTu.xoa(LOAI_TIM_KIEM[sender], [instance.pk])
+
+
+for _model in LOAI_TIM_KIEM:
+    post_save.connect(cap_nhat_tim_kiem, sender=_model, dispatch_uid=f'tim_kiem_luu_{_model.__name__}')
+    post_delete.connect(xoa_tim_kiem, sender=_model, dispatch_uid=f'tim_kiem_xoa_{_model.__name__}')
+
+
+def dat_lai_ho_tro_tim_kiem(sender, **kwargs):
+    # Migration 0018 tạo/xóa bảng FTS mà không qua TimKiemChungTu -> dò lại sau migrate
+    TimKiemChungTu.dat_lai_ho_tro()
+
+
+post_migrate.connect(dat_lai_ho_tro_tim_kiem, dispatch_uid='dat_lai_ho_tro_tim_kiem')
+
+
+# Kho/nhà cung cấp/người dùng đổi tên thì ghi lại tài liệu của các chứng từ liên quan
+THAM_CHIEU_TIM_KIEM = {
+    Kho: ('kho', {'ten_kho'}),
+    NhaCungCap: ('nha_cung_cap', {'ten_nha_cung_cap', 'ma_nha_cung_cap'}),
+    get_user_model(): ('nguoi_dung', {'username'}),
+}
+
+
+def cap_nhat_tim_kiem_theo_tham_chieu(sender, instance, created, update_fields=None, **kwargs):
+    tham_chieu, truong = THAM_CHIEU_TIM_KIEM[sender]
+    # Bản ghi mới chưa có chứng từ; lưu từng trường (vd. last_login khi đăng nhập) thì bỏ qua
+    if created or (update_fields is not None and not truong & set(update_fields)):
+        return
+    TimKiemChungTu.cap_nhat_theo_tham_chieu(tham_chieu, instance.pk)
+
+
+for _model in THAM_CHIEU_TIM_KIEM:
+    post_save.connect(
+        cap_nhat_tim_kiem_theo_tham_chieu, sender=_model, dispatch_uid=f'tim_kiem_tham_chieu_{_model.__name__}'
+    )
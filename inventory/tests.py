@@ -1,3 +1,802 @@
-from django.test import TestCase
+import csv
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from debt.models import CongNo
+from partners.models import NhaCungCap
+from products.models import SanPham, DanhMucSanPham, DonViTinh
+from settings_app.models import Profile
+from .cache import BoNhoDem
+from .do_hieu_nang import phan_vi, so_sanh_moc
+from .models import BoDemChungTu, ChiTietKiemKe, DailyStockFlow, KiemKe, Kho, NhapKho, StockMovement, TonKho, XuatKho
+from .search import TimKiemChungTu
+from .services import CapSoChungTu, QuanLyKiemKe, QuanLyLuuChuyen, QuanLyNhapKho, QuanLyTonKho, QuanLyXuatKho
+
+
+class QuanLyTonKhoDongThoiTest(TransactionTestCase):
+    """Nhiều luồng cùng nhập/xuất một sản phẩm không được làm mất cập nhật hay âm kho"""
+
+    SO_LUONG = 8
+    SO_LAN = 25
+
+    def setUp(self):
+        danh_muc = DanhMucSanPham.objects.create(ten_danh_muc='Danh mục')
+        don_vi = DonViTinh.objects.create(ten_don_vi='Cái')
+        self.san_pham = SanPham.objects.create(
+            danh_muc=danh_muc,
+            don_vi_tinh=don_vi,
+            ma_san_pham='SP-0001',
+            ten_san_pham='Sản phẩm',
+            gia_nhap=1000,
+            gia_ban=2000
+        )
+        self.kho = Kho.objects.create(ma_kho='K1', ten_kho='Kho 1', dia_chi='HN')
+
+    def chay_dong_thoi(self, ham):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('CSDL test SQLite trong bộ nhớ không cho phép nhiều kết nối')
+        loi = []
+
+        def worker():
+            try:
+                for _ in range(self.SO_LAN):
+                    ham()
+            except Exception as e:  # pragma: no cover - báo lỗi về luồng chính
+                loi.append(e)
+            finally:
+                connections.close_all()
+
+        luong = [threading.Thread(target=worker) for _ in range(self.SO_LUONG)]
+        for t in luong:
+            t.start()
+        for t in luong:
+            t.join()
+        return loi
+
+    def test_nhap_hang_dong_thoi_khong_mat_cap_nhat(self):
+        loi = self.chay_dong_thoi(lambda: QuanLyTonKho.nhap_hang(self.kho, self.san_pham, 1))
+
+        self.assertEqual(loi, [])
+        ton = TonKho.objects.get(kho=self.kho, san_pham=self.san_pham)
+        self.assertEqual(ton.so_luong_ton, self.SO_LUONG * self.SO_LAN)
+        self.assertEqual(ton.so_luong_kha_dung, self.SO_LUONG * self.SO_LAN)
+
+    def test_xuat_hang_dong_thoi_khong_am_kho(self):
+        ton_ban_dau = self.SO_LUONG * self.SO_LAN // 2
+        TonKho.objects.create(
+            kho=self.kho,
+            san_pham=self.san_pham,
+            so_luong_ton=ton_ban_dau,
+            so_luong_kha_dung=ton_ban_dau
+        )
+        thanh_cong = []
+
+        def xuat():
+            try:
+                thanh_cong.append(QuanLyTonKho.xuat_hang(self.kho, self.san_pham, 1))
+            except ValueError:
+                pass
+
+        loi = self.chay_dong_thoi(xuat)
+
+        self.assertEqual(loi, [])
+        self.assertEqual(len(thanh_cong), ton_ban_dau)
+        ton = TonKho.objects.get(kho=self.kho, san_pham=self.san_pham)
+        self.assertEqual(ton.so_luong_ton, 0)
+        self.assertEqual(ton.so_luong_kha_dung, 0)
+
+    def test_xuat_hang_khong_du_ton(self):
+        QuanLyTonKho.nhap_hang(self.kho, self.san_pham, 3)
+
+        with self.assertRaises(ValueError):
+            QuanLyTonKho.xuat_hang(self.kho, self.san_pham, 4)
+
+        self.assertEqual(QuanLyTonKho.xuat_hang(self.kho, self.san_pham, 3), 1)
+        self.assertEqual(QuanLyTonKho.kiem_tra_ton_kho(self.kho, self.san_pham)['so_luong_kha_dung'], 0)
+
+
+def tao_nguoi_dung(username):
+    """Tạo người dùng kèm Profile giống du_lieu_mau: bulk_create không phát post_save"""
+    NguoiDung = get_user_model()
+    nguoi_dung = NguoiDung(username=username)
+    nguoi_dung.set_password('x')
+    NguoiDung.objects.bulk_create([nguoi_dung])
+    nguoi_dung = NguoiDung.objects.get(username=username)
+    Profile.objects.create(user=nguoi_dung)
+    return nguoi_dung
+
+
+class KhoNhoMixin:
+    """Dữ liệu dựng tay cho test dịch vụ: 3 sản phẩm (mức tối thiểu 5), 2 kho, 1 nhà cung cấp"""
+
+    @classmethod
+    def setUpTestData(cls):
+        danh_muc = DanhMucSanPham.objects.create(ten_danh_muc='Danh mục')
+        don_vi = DonViTinh.objects.create(ten_don_vi='Cái')
+        cls.san_pham = [
+            SanPham.objects.create(
+                danh_muc=danh_muc, don_vi_tinh=don_vi, ma_san_pham=f'SP-{i:04d}', ten_san_pham=f'Sản phẩm {i}',
+                gia_nhap=1000, gia_ban=2000, so_luong_toi_thieu=5
+            )
+            for i in range(1, 4)
+        ]
+        cls.kho = Kho.objects.create(ma_kho='K1', ten_kho='Kho 1', dia_chi='HN')
+        cls.kho_nhan = Kho.objects.create(ma_kho='K2', ten_kho='Kho 2', dia_chi='HCM')
+        cls.nha_cung_cap = NhaCungCap.objects.create(
+            ma_nha_cung_cap='NCC-0001', ten_nha_cung_cap='Nhà cung cấp', dia_chi='HN', dien_thoai='0900'
+        )
+        cls.nguoi_dung = tao_nguoi_dung('nv')
+
+    def nhap(self, kho, so_luong_theo_san_pham, don_gia='1000'):
+        """Tạo phiếu nhập; so_luong_theo_san_pham: {chỉ số sản phẩm: số lượng}"""
+        return QuanLyNhapKho.tao_phieu_nhap(kho, self.nha_cung_cap, self.nguoi_dung, [
+            (self.san_pham[i].id, so_luong, Decimal(don_gia)) for i, so_luong in so_luong_theo_san_pham.items()
+        ])
+
+    def ton(self, kho):
+        """{chỉ số sản phẩm: số lượng tồn} của kho"""
+        chi_so = {sp.id: i for i, sp in enumerate(self.san_pham)}
+        return {
+            chi_so[san_pham_id]: so_luong
+            for san_pham_id, so_luong in TonKho.objects.filter(kho=kho).values_list('san_pham_id', 'so_luong_ton')
+        }
+
+    def nhat_ky(self, kho):
+        """Tồn kho tính lại từ nhật ký StockMovement, cùng dạng với ton()"""
+        chi_so = {sp.id: i for i, sp in enumerate(self.san_pham)}
+        return {
+            chi_so[dong['san_pham_id']]: dong['tong']
+            for dong in StockMovement.objects.filter(kho=kho).values('san_pham_id').annotate(tong=Sum('so_luong'))
+        }
+
+
+class CapSoChungTuTest(KhoNhoMixin, TestCase):
+    """Cấp số chứng từ theo khối liên tiếp và khởi tạo bộ đếm từ mã đã có (migration 0011)"""
+
+    def test_cap_khoi_lien_tiep_khong_trung(self):
+        khoi_1 = CapSoChungTu.cap_ma_hang_loat('TEST', 3)
+        khoi_2 = CapSoChungTu.cap_ma_hang_loat('TEST', 4)
+        mot_ma = CapSoChungTu.cap_ma('TEST')
+        self.assertEqual(khoi_1, ['TEST-0001', 'TEST-0002', 'TEST-0003'])
+        self.assertEqual(khoi_2, ['TEST-0004', 'TEST-0005', 'TEST-0006', 'TEST-0007'])
+        self.assertEqual(mot_ma, 'TEST-0008')
+        # Tiền tố khác có bộ đếm riêng
+        self.assertEqual(CapSoChungTu.cap_ma_hang_loat('KHAC', 2), ['KHAC-0001', 'KHAC-0002'])
+        with self.assertRaises(ValueError):
+            CapSoChungTu.cap_ma_hang_loat('TEST', 0)
+
+    def test_khoi_tao_bo_dem_giu_ma_da_co(self):
+        for ma in ('NK-0041', 'NK-0007', 'NK-CU'):
+            NhapKho.objects.create(
+                ma_phieu=ma, kho=self.kho, nha_cung_cap=self.nha_cung_cap, nguoi_lap=self.nguoi_dung, tong_tien=0
+            )
+        BoDemChungTu.objects.all().delete()
+
+        import_module('inventory.migrations.0011_bodemchungtu').khoi_tao_bo_dem(django_apps, None)
+
+        self.assertEqual(BoDemChungTu.objects.get(tien_to='NK').gia_tri, 41)
+        self.assertEqual(
+            sorted(NhapKho.objects.values_list('ma_phieu', flat=True)), ['NK-0007', 'NK-0041', 'NK-CU']
+        )
+        self.assertEqual(self.nhap(self.kho, {0: 1}).ma_phieu, 'NK-0042')
+
+
+class GhiSoKiemKeTest(KhoNhoMixin, TestCase):
+    """Ghi sổ chênh lệch kiểm kê: chỉ một lần, nhật ký luôn khớp TonKho"""
+
+    def test_ghi_so_hai_lan_chi_doi_mot_lan(self):
+        self.nhap(self.kho, {0: 10})
+        kiem_ke = KiemKe.objects.create(
+            ma_kiem_ke='KK-0001', ten_dot_kiem_ke='Kiểm kê', ngay_kiem_ke=timezone.now(), kho=self.kho,
+            nguoi_phu_trach=self.nguoi_dung, trang_thai='hoan_thanh'
+        )
+        # Thiếu 3; thừa 4 ở sản phẩm chưa có tồn; thiếu 2 ở sản phẩm không có dòng tồn kho
+        for i, he_thong, thuc_te in ((0, 10, 7), (1, 0, 4), (2, 0, -2)):
+            ChiTietKiemKe.objects.create(
+                kiem_ke=kiem_ke, san_pham=self.san_pham[i], so_luong_he_thong=he_thong, so_luong_thuc_te=thuc_te
+            )
+
+        self.assertTrue(QuanLyKiemKe.ghi_so_chenh_lech(kiem_ke))
+        kiem_ke.refresh_from_db()
+        ma_dieu_chinh = kiem_ke.ma_dieu_chinh
+        self.assertTrue(ma_dieu_chinh.startswith('DC-'))
+        self.assertEqual(self.ton(self.kho), {0: 7, 1: 4})
+        self.assertEqual(self.nhat_ky(self.kho), self.ton(self.kho))
+        so_bien_dong = StockMovement.objects.count()
+
+        self.assertFalse(QuanLyKiemKe.ghi_so_chenh_lech(kiem_ke))
+        kiem_ke.refresh_from_db()
+        self.assertEqual(kiem_ke.ma_dieu_chinh, ma_dieu_chinh)
+        self.assertEqual(self.ton(self.kho), {0: 7, 1: 4})
+        self.assertEqual(StockMovement.objects.count(), so_bien_dong)
+        self.assertEqual(StockMovement.objects.filter(loai='kiem_ke', chung_tu=ma_dieu_chinh).count(), 2)
+
+
+class DungLaiTuNhatKyTest(KhoNhoMixin, TestCase):
+    """Dựng lại TonKho từ StockMovement phải ra đúng số dư đang có"""
+
+    def test_dung_lai_khop_so_du(self):
+        self.nhap(self.kho, {0: 20, 1: 8})
+        self.nhap(self.kho, {0: 5, 2: 3})
+        QuanLyXuatKho.tao_phieu_chuyen(
+            self.kho, self.kho_nhan, self.nguoi_dung, [(self.san_pham[0].id, 12), (self.san_pham[2].id, 3)]
+        )
+        kiem_ke = KiemKe.objects.create(
+            ma_kiem_ke='KK-0001', ten_dot_kiem_ke='Kiểm kê', ngay_kiem_ke=timezone.now(), kho=self.kho_nhan,
+            nguoi_phu_trach=self.nguoi_dung, trang_thai='hoan_thanh'
+        )
+        QuanLyKiemKe.luu_ket_qua(kiem_ke, {self.san_pham[0].id: (10, ''), self.san_pham[1].id: (1, '')})
+        QuanLyKiemKe.ghi_so_chenh_lech(kiem_ke)
+
+        def so_du():
+            return sorted(TonKho.objects.values_list(
+                'kho_id', 'san_pham_id', 'so_luong_ton', 'so_luong_kha_dung', 'muc_toi_thieu', 'sap_het'
+            ))
+
+        truoc = so_du()
+        self.assertEqual(self.ton(self.kho), {0: 13, 1: 8, 2: 0})
+        self.assertEqual(self.ton(self.kho_nhan), {0: 10, 1: 1, 2: 3})
+
+        # Làm hỏng số dư rồi dựng lại
+        TonKho.objects.update(so_luong_ton=999, so_luong_kha_dung=999, sap_het=False)
+        QuanLyTonKho.dung_lai_tu_nhat_ky()
+        self.assertEqual(so_du(), truoc)
+
+
+class SanPhamKhongTonTaiTest(KhoNhoMixin, TestCase):
+    """Chứng từ có sản phẩm không còn trong danh mục bị từ chối trước khi tạo phiếu và cấp số"""
+
+    def test_phieu_nhap(self):
+        khong_co = self.san_pham[-1].id + 100
+        with self.captureOnCommitCallbacks(execute=True):
+            for dong_hang in ([], [(khong_co, 1, Decimal('1000'))], [
+                (self.san_pham[0].id, 3, Decimal('1000')), (khong_co, 1, Decimal('1000'))
+            ]):
+                with self.assertRaises(ValueError):
+                    QuanLyNhapKho.tao_phieu_nhap(self.kho, self.nha_cung_cap, self.nguoi_dung, dong_hang)
+        self.assertFalse(NhapKho.objects.exists())
+        self.assertFalse(CongNo.objects.exists())
+        self.assertEqual(self.ton(self.kho), {})
+        self.assertEqual(CapSoChungTu.cap_ma('NK'), 'NK-0001')
+
+    def test_form_nhap_kho_bao_loi(self):
+        self.client.force_login(self.nguoi_dung)
+        phan_hoi = self.client.post(reverse('inventory:nhap_kho_create'), {
+            'kho_id': self.kho.id, 'nha_cung_cap_id': self.nha_cung_cap.id,
+            'san_pham_id': [self.san_pham[-1].id + 100], 'so_luong': ['2'], 'don_gia': ['1000'],
+        })
+        self.assertEqual(phan_hoi.status_code, 200)
+        self.assertIn('Không tìm thấy sản phẩm', [str(m) for m in phan_hoi.context['messages']][0])
+        self.assertFalse(NhapKho.objects.exists())
+
+    def test_phieu_chuyen(self):
+        self.nhap(self.kho, {0: 5})
+        khong_co = self.san_pham[-1].id + 100
+        for dong_hang in ([(khong_co, 1)], [(self.san_pham[0].id, 1), (khong_co, 1)], []):
+            with self.assertRaises(ValueError):
+                QuanLyXuatKho.tao_phieu_chuyen(self.kho, self.kho_nhan, self.nguoi_dung, dong_hang)
+        self.assertFalse(XuatKho.objects.exists())
+        self.assertEqual(self.ton(self.kho), {0: 5})
+        self.assertEqual(CapSoChungTu.cap_ma('XKNB'), 'XKNB-0001')
+
+    def test_form_chuyen_kho_bao_loi(self):
+        self.client.force_login(self.nguoi_dung)
+        phan_hoi = self.client.post(reverse('inventory:xuatkho_form'), {
+            'kho_xuat': self.kho.id, 'kho_nhan': self.kho_nhan.id,
+            'san_pham_id': [self.san_pham[-1].id + 100], 'so_luong': ['1'],
+        }, follow=True)
+        self.assertRedirects(phan_hoi, reverse('inventory:xuatkho_form'))
+        self.assertIn('Không tìm thấy sản phẩm', [str(m) for m in phan_hoi.context['messages']][0])
+        self.assertFalse(XuatKho.objects.exists())
+
+
+class CoSapHetTest(KhoNhoMixin, TestCase):
+    """Cờ sap_het tính trong câu UPDATE phải luôn bằng so_luong_ton <= muc_toi_thieu"""
+
+    def sap_het(self, kho):
+        chi_so = {sp.id: i for i, sp in enumerate(self.san_pham)}
+        cac_dong = list(TonKho.objects.filter(kho=kho).values_list(
+            'san_pham_id', 'so_luong_ton', 'muc_toi_thieu', 'sap_het'
+        ))
+        for _, so_luong_ton, muc_toi_thieu, sap_het in cac_dong:
+            self.assertEqual(sap_het, so_luong_ton <= muc_toi_thieu)
+        return {chi_so[san_pham_id]: sap_het for san_pham_id, _, _, sap_het in cac_dong}
+
+    def test_sap_het_qua_nhap_xuat_kiem_ke_va_doi_muc(self):
+        # Mức tối thiểu 5: tồn đúng bằng mức vẫn là sắp hết
+        self.nhap(self.kho, {0: 5, 1: 6})
+        self.assertEqual(self.sap_het(self.kho), {0: True, 1: False})
+
+        QuanLyXuatKho.tao_phieu_chuyen(self.kho, self.kho_nhan, self.nguoi_dung, [(self.san_pham[1].id, 1)])
+        self.assertEqual(self.sap_het(self.kho), {0: True, 1: True})
+        self.assertEqual(self.sap_het(self.kho_nhan), {1: True})
+
+        self.nhap(self.kho, {0: 1})
+        self.assertEqual(self.sap_het(self.kho), {0: False, 1: True})
+
+        kiem_ke = KiemKe.objects.create(
+            ma_kiem_ke='KK-0001', ten_dot_kiem_ke='Kiểm kê', ngay_kiem_ke=timezone.now(), kho=self.kho,
+            nguoi_phu_trach=self.nguoi_dung, trang_thai='hoan_thanh'
+        )
+        QuanLyKiemKe.luu_ket_qua(kiem_ke, {self.san_pham[0].id: (3, ''), self.san_pham[1].id: (9, '')})
+        QuanLyKiemKe.ghi_so_chenh_lech(kiem_ke)
+        self.assertEqual(self.ton(self.kho), {0: 3, 1: 9})
+        self.assertEqual(self.sap_het(self.kho), {0: True, 1: False})
+
+        # Lưu sản phẩm -> tín hiệu post_save đồng bộ mức tối thiểu sang mọi kho
+        san_pham = self.san_pham[0]
+        san_pham.so_luong_toi_thieu = 2
+        san_pham.save()
+        self.assertEqual(self.sap_het(self.kho), {0: False, 1: False})
+
+        # update() hàng loạt không phát tín hiệu -> đồng bộ bằng cap_nhat_muc_toi_thieu
+        SanPham.objects.filter(pk=self.san_pham[1].pk).update(so_luong_toi_thieu=20)
+        self.assertEqual(QuanLyTonKho.cap_nhat_muc_toi_thieu([self.san_pham[1].pk]), 2)
+        self.assertEqual(self.sap_het(self.kho), {0: False, 1: True})
+        self.assertEqual(self.sap_het(self.kho_nhan), {1: True})
+        self.assertEqual(
+            set(TonKho.objects.filter(san_pham=self.san_pham[1]).values_list('muc_toi_thieu', flat=True)), {20}
+        )
+
+
+class BoNhoDemTest(KhoNhoMixin, TestCase):
+    """Trang đã đệm phải đổi ngay sau khi giao dịch tạo chứng từ commit"""
+
+    def setUp(self):
+        cache.clear()
+        BoNhoDem.dat_lai_thong_ke()
+        self.client.force_login(self.nguoi_dung)
+
+    def test_phieu_nhap_lam_moi_trang_da_dem(self):
+        trang = [
+            ('dashboard', 'dashboard', 'total_import_quantity'),
+            ('reports_dashboard', 'reports_dashboard', 'monthly_import_quantity'),
+            ('inventory:chi_tiet_ton_kho', 'chi_tiet_ton_kho', 'total_quantity'),
+        ]
+        for url, _, khoa in trang:
+            self.assertEqual(self.client.get(reverse(url)).context[khoa], 0)
+            # Lần đọc thứ hai lấy từ bộ nhớ đệm
+            self.assertEqual(self.client.get(reverse(url)).context[khoa], 0)
+        thong_ke = BoNhoDem.thong_ke()
+        for _, ten, _ in trang:
+            self.assertEqual((thong_ke[ten]['miss'], thong_ke[ten]['hit']), (1, 1), ten)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.nhap(self.kho, {0: 7, 1: 4})
+
+        for url, ten, khoa in trang:
+            self.assertEqual(self.client.get(reverse(url)).context[khoa], 11, ten)
+            self.assertEqual(BoNhoDem.thong_ke()[ten]['miss'], 2, ten)
+
+
+class XuatTonKhoTest(KhoNhoMixin, TestCase):
+    """File xuất tồn kho: đúng tiêu đề, đúng dòng và theo bộ lọc của trang tồn kho"""
+
+    TIEU_DE = [
+        'Mã kho', 'Tên kho', 'Mã sản phẩm', 'Tên sản phẩm', 'Danh mục', 'Đơn vị tính', 'Số lượng tồn', 'Số lượng khả dụng'
+    ]
+
+    def setUp(self):
+        self.nhap(self.kho, {0: 4, 1: 9})
+        self.nhap(self.kho_nhan, {2: 3})
+        self.client.force_login(self.nguoi_dung)
+
+    def dong(self, kho, i, so_luong):
+        sp = self.san_pham[i]
+        return [kho.ma_kho, kho.ten_kho, sp.ma_san_pham, sp.ten_san_pham, 'Danh mục', 'Cái', so_luong, so_luong]
+
+    def doc_csv(self, **tham_so):
+        response = self.client.get(reverse('inventory:xuat_ton_kho_csv'), tham_so)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="ton_kho_', response['Content-Disposition'])
+        noi_dung = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(noi_dung.startswith('\ufeff'))
+        return list(csv.reader(StringIO(noi_dung[1:])))
+
+    def test_csv_tieu_de_va_dong(self):
+        self.assertEqual(self.doc_csv(), [
+            self.TIEU_DE,
+            [str(o) for o in self.dong(self.kho, 0, 4)],
+            [str(o) for o in self.dong(self.kho, 1, 9)],
+            [str(o) for o in self.dong(self.kho_nhan, 2, 3)],
+        ])
+
+    def test_csv_theo_bo_loc(self):
+        self.assertEqual(self.doc_csv(kho=self.kho_nhan.pk), [
+            self.TIEU_DE, [str(o) for o in self.dong(self.kho_nhan, 2, 3)],
+        ])
+        self.assertEqual(self.doc_csv(kho=self.kho.pk, san_pham=self.san_pham[1].pk), [
+            self.TIEU_DE, [str(o) for o in self.dong(self.kho, 1, 9)],
+        ])
+        self.assertEqual(self.doc_csv(kho=self.kho_nhan.pk, san_pham=self.san_pham[0].pk), [self.TIEU_DE])
+
+    def test_xlsx_theo_bo_loc(self):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            response = self.client.get(reverse('inventory:xuat_ton_kho_xlsx'), {'kho': self.kho.pk}, follow=True)
+            self.assertRedirects(response, reverse('inventory:chi_tiet_ton_kho'))
+            self.assertIn('openpyxl', [str(m) for m in response.context['messages']][0])
+            return
+
+        response = self.client.get(reverse('inventory:xuat_ton_kho_xlsx'), {'kho': self.kho.pk})
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        self.assertEqual(workbook.sheetnames, ['Tồn kho'])
+        self.assertEqual([list(dong) for dong in workbook.worksheets[0].iter_rows(values_only=True)], [
+            self.TIEU_DE, self.dong(self.kho, 0, 4), self.dong(self.kho, 1, 9),
+        ])
+        workbook.close()
+
+
+class PhieuDemKiemKeTest(KhoNhoMixin, TestCase):
+    """Trang phiếu đếm kiểm kê không nhận số lượng thực tế âm"""
+
+    def test_tu_choi_so_luong_am(self):
+        kiem_ke = KiemKe.objects.create(
+            ma_kiem_ke='KK-0001', ten_dot_kiem_ke='Kiểm kê', ngay_kiem_ke=timezone.now(), kho=self.kho,
+            nguoi_phu_trach=self.nguoi_dung, trang_thai='dang_kiem_ke'
+        )
+        self.client.force_login(self.nguoi_dung)
+        url = reverse('inventory:chi_tiet_kiem_ke', kwargs={'id': kiem_ke.id})
+
+        phan_hoi = self.client.post(url, {
+            f'so_luong_{self.san_pham[0].id}': '4', f'so_luong_{self.san_pham[1].id}': '-1',
+        }, follow=True)
+        self.assertEqual(phan_hoi.status_code, 200)
+        self.assertIn('không được âm', ' '.join(str(m) for m in phan_hoi.context['messages']))
+        self.assertFalse(ChiTietKiemKe.objects.filter(kiem_ke=kiem_ke).exists())
+
+        self.client.post(url, {f'so_luong_{self.san_pham[0].id}': '4'})
+        self.assertEqual(
+            list(ChiTietKiemKe.objects.filter(kiem_ke=kiem_ke).values_list('so_luong_thuc_te', flat=True)), [4]
+        )
+        with self.assertRaises(ValueError):
+            QuanLyKiemKe.luu_ket_qua(kiem_ke, {self.san_pham[1].id: (-1, '')})
+
+
+class TimKiemChungTuTest(KhoNhoMixin, TestCase):
+    """Tìm chứng từ qua FTS5 và qua bộ lọc icontains khi CSDL không có FTS5"""
+
+    def setUp(self):
+        self.client.force_login(self.nguoi_dung)
+        self.phieu = [self.nhap(self.kho, {0: 1}), self.nhap(self.kho_nhan, {1: 2})]
+
+    def tim(self):
+        danh_sach = self.client.get(reverse('inventory:nhapkho_list'), {'q': self.phieu[1].ma_phieu})
+        api = self.client.get(reverse('inventory:tim_kiem_chung_tu'), {'q': self.phieu[1].ma_phieu, 'loai': 'nhap'})
+        return [phieu.id for phieu in danh_sach.context['phieu_nhap']], api.json()
+
+    def test_tim_qua_fts(self):
+        if not TimKiemChungTu.ho_tro():
+            self.skipTest('SQLite không có FTS5')
+        ids, api = self.tim()
+        self.assertEqual(ids, [self.phieu[1].id])
+        self.assertTrue(api['xep_hang'])
+        self.assertEqual([kq['id'] for kq in api['ket_qua']], [self.phieu[1].id])
+
+    def test_khong_co_fts_thi_dung_icontains(self):
+        with mock.patch.object(TimKiemChungTu, 'ho_tro', staticmethod(lambda ket_noi=None: False)):
+            self.assertIsNone(TimKiemChungTu.dieu_kien_tim('nhap', 'NK'))
+            ids, api = self.tim()
+        self.assertEqual(ids, [self.phieu[1].id])
+        self.assertFalse(api['xep_hang'])
+        self.assertEqual(
+            [(kq['loai'], kq['id'], kq['ma']) for kq in api['ket_qua']],
+            [('nhap', self.phieu[1].id, self.phieu[1].ma_phieu)]
+        )
+
+    def test_dat_lai_ho_tro_do_lai_bang(self):
+        co_fts = TimKiemChungTu.ho_tro()
+        TimKiemChungTu._ho_tro[TimKiemChungTu._khoa(connection)] = not co_fts
+        TimKiemChungTu.dat_lai_ho_tro()
+        self.assertEqual(TimKiemChungTu.ho_tro(), co_fts)
+
+
+class TonKhoHangLoatApiTest(KhoNhoMixin, TestCase):
+    """API tồn kho hàng loạt giới hạn theo số cặp sản phẩm x kho"""
+
+    def test_gioi_han_so_cap(self):
+        self.nhap(self.kho, {0: 4, 1: 2})
+        self.client.force_login(self.nguoi_dung)
+        url = reverse('inventory:ton_kho_hang_loat_api')
+        san_pham = ','.join(str(sp.id) for sp in self.san_pham)
+
+        with mock.patch('inventory.views.TON_KHO_API_TOI_DA_CAP', 5):
+            # 3 sản phẩm x 2 kho (mọi kho) = 6 cặp
+            self.assertEqual(self.client.get(url, {'san_pham': san_pham}).status_code, 400)
+            phan_hoi = self.client.get(url, {'san_pham': san_pham, 'kho': self.kho.id})
+        self.assertEqual(phan_hoi.status_code, 200)
+        self.assertEqual(phan_hoi.json()['dong'], [
+            [self.kho.id, self.san_pham[0].id, 4, 4],
+            [self.kho.id, self.san_pham[1].id, 2, 2],
+            [self.kho.id, self.san_pham[2].id, 0, 0],
+        ])
+
+    def test_post_truong_sai_kieu_tra_ve_400(self):
+        self.client.force_login(self.nguoi_dung)
+        url = reverse('inventory:ton_kho_hang_loat_api')
+        for du_lieu in ({'san_pham': 5}, {'ma': {'a': 1}}, {'kho': True}, [1, 2]):
+            phan_hoi = self.client.post(url, du_lieu, content_type='application/json')
+            self.assertEqual(phan_hoi.status_code, 400, du_lieu)
+            self.assertEqual(phan_hoi.json(), {'success': False, 'error': 'JSON không hợp lệ'})
+
+        phan_hoi = self.client.post(
+            url, {'san_pham': [self.san_pham[0].id], 'kho': str(self.kho.id)}, content_type='application/json'
+        )
+        self.assertEqual(phan_hoi.status_code, 200)
+        self.assertEqual(phan_hoi.json()['dong'], [[self.kho.id, self.san_pham[0].id, 0, 0]])
+
+
+# Một URL cần đo: tên (kèm namespace), kwargs của reverse(), query string,
+# số truy vấn tối đa, phương thức và dữ liệu POST
+TruongHop = namedtuple('TruongHop', 'ten kwargs query so_truy_van method data', defaults=({}, '', 0, 'get', None))
+
+
+class NganSachTruyVanMixin:
+    """Kiểm tra trần số truy vấn và thời gian của mọi URL trên bộ dữ liệu lớn
+
+    Trần là hằng số, không phụ thuộc kích thước dữ liệu: dữ liệu mẫu có hàng nghìn sản phẩm
+    và hàng chục nghìn dòng chứng từ nên một truy vấn N+1 (mỗi dòng một truy vấn) sẽ vượt trần
+    ngay. Lớp con khai báo URLCONF và cac_truong_hop(); test_moi_url_deu_co_ngan_sach bắt
+    buộc URL mới thêm vào urls.py phải có ngân sách.
+    """
+
+    URLCONF = None
+    THOI_GIAN_TOI_DA = 2.0  # giây cho mỗi request, gồm cả render template
+
+    # Tham số cho lệnh seed_warehouse: ~15 nghìn dòng nhập, ~5 nghìn dòng chuyển kho
+    DU_LIEU_MAU = {
+        'kho': 8, 'san_pham': 2000, 'nha_cung_cap': 50, 'nhan_vien': 40,
+        'phieu_nhap': 1500, 'dong_moi_phieu': 10, 'phieu_chuyen': 800, 'dong_moi_phieu_chuyen': 8,
+        'kiem_ke': 40, 'dong_moi_kiem_ke': 100, 'so_ngay': 180,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        call_command('seed_warehouse', stdout=StringIO(), **cls.DU_LIEU_MAU)
+        NguoiDung = get_user_model()
+        cls.du_lieu = {
+            'nguoi_dung': NguoiDung.objects.get(username='quan_tri'),
+            # Nhân viên đã nghỉ không lập chứng từ nào nên xóa được mà không kéo theo chứng từ
+            'nhan_vien': list(NguoiDung.objects.filter(trang_thai=False).order_by('id')),
+            'kho': list(Kho.objects.order_by('id')),
+            'san_pham': list(SanPham.objects.order_by('id')),
+            'nha_cung_cap': list(NhaCungCap.objects.order_by('id')),
+            'phieu_nhap': list(NhapKho.objects.order_by('id')),
+            'phieu_chuyen': list(XuatKho.objects.order_by('id')),
+            'kiem_ke': list(KiemKe.objects.order_by('id')),
+        }
+        cls.nguoi_dung = cls.du_lieu['nguoi_dung']
+
+    def setUp(self):
+        super().setUp()
+        # Đo trên bộ nhớ đệm rỗng: số liệu đệm theo phiên bản không được che truy vấn thật
+        cache.clear()
+        self.client.force_login(self.nguoi_dung)
+
+    def cac_truong_hop(self):
+        raise NotImplementedError
+
+    def goi(self, truong_hop):
+        url = reverse(truong_hop.ten, kwargs=truong_hop.kwargs)
+        if truong_hop.query:
+            url = f'{url}?{truong_hop.query}'
+        goi = self.client.post if truong_hop.method == 'post' else self.client.get
+        with CaptureQueriesContext(connection) as truy_van:
+            bat_dau = time.perf_counter()
+            response = goi(url, truong_hop.data or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+            thoi_gian = time.perf_counter() - bat_dau
+        return response, truy_van, thoi_gian
+
+    def test_ngan_sach_truy_van(self):
+        for truong_hop in self.cac_truong_hop():
+            with self.subTest(ten=truong_hop.ten, query=truong_hop.query, method=truong_hop.method):
+                cache.clear()
+                response, truy_van, thoi_gian = self.goi(truong_hop)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(
+                    len(truy_van), truong_hop.so_truy_van,
+                    '\n'.join(q['sql'][:200] for q in truy_van.captured_queries)
+                )
+                self.assertLessEqual(thoi_gian, self.THOI_GIAN_TOI_DA)
+
+    def test_moi_url_deu_co_ngan_sach(self):
+        module = import_module(self.URLCONF)
+        tien_to = f'{module.app_name}:' if getattr(module, 'app_name', None) else ''
+        cac_ten = {
+            tien_to + mau.name for mau in module.urlpatterns if isinstance(mau, URLPattern) and mau.name
+        }
+        da_kiem = {truong_hop.ten for truong_hop in self.cac_truong_hop()}
+        self.assertEqual(cac_ten - da_kiem, set())
+
+
+class NganSachTruyVanKhoTest(NganSachTruyVanMixin, TestCase):
+    URLCONF = 'inventory.urls'
+
+    def cac_truong_hop(self):
+        kho = self.du_lieu['kho'][0]
+        san_pham = self.du_lieu['san_pham'][0]
+        phieu_nhap = self.du_lieu['phieu_nhap'][-1]
+        phieu_chuyen = self.du_lieu['phieu_chuyen'][-1]
+        kiem_ke = self.du_lieu['kiem_ke'][0]
+        da_hoan_thanh = next(
+            dot for dot in self.du_lieu['kiem_ke'] if dot.trang_thai == 'hoan_thanh' and not dot.ngay_ghi_so
+        )
+        return [
+            TruongHop('inventory:nhapkho_list', so_truy_van=4),
+            TruongHop('inventory:nhapkho_list', query='q=Nhập định kỳ', so_truy_van=4),
+            TruongHop('inventory:nhap_kho_create', so_truy_van=4),
+            TruongHop('inventory:nhap_kho_create', method='post', so_truy_van=34, data={
+                'kho_id': kho.id, 'nha_cung_cap_id': self.du_lieu['nha_cung_cap'][0].id,
+                'san_pham_id': [sp.id for sp in self.du_lieu['san_pham'][:50]],
+                'so_luong': ['3'] * 50, 'don_gia': ['1000'] * 50,
+            }),
+            TruongHop('inventory:nhap_kho_detail', {'pk': phieu_nhap.id}, so_truy_van=5),
+            TruongHop('inventory:xoa_phieu_nhap', {'pk': phieu_nhap.id}, so_truy_van=3),
+            TruongHop('inventory:xuatkho_list', so_truy_van=5),
+            TruongHop('inventory:xuatkho_list', query=f'kho={kho.id}', so_truy_van=5),
+            TruongHop('inventory:xuatkho_form', so_truy_van=3),
+            TruongHop('inventory:xuatkho_form', method='post', so_truy_van=35, data={
+                'kho_xuat': kho.id, 'kho_nhan': self.du_lieu['kho'][1].id,
+                'san_pham_id': list(
+                    TonKho.objects.filter(kho=kho, so_luong_kha_dung__gt=0).values_list('san_pham_id', flat=True)[:50]
+                ),
+                'so_luong': ['1'] * 50,
+            }),
+            TruongHop('inventory:xuat_kho_detail', {'pk': phieu_chuyen.id}, so_truy_van=4),
+            TruongHop('inventory:xoa_phieu_xuat', {'pk': phieu_chuyen.id}, so_truy_van=3),
+            TruongHop('inventory:danh_sach_kiem_ke', so_truy_van=3),
+            TruongHop('inventory:tao_kiem_ke', so_truy_van=3),
+            TruongHop('inventory:chi_tiet_kiem_ke', {'id': kiem_ke.id}, so_truy_van=8),
+            TruongHop('inventory:chi_tiet_kiem_ke', {'id': kiem_ke.id}, query='page=5', so_truy_van=8),
+            TruongHop('inventory:ghi_so_kiem_ke', {'id': da_hoan_thanh.id}, method='post', so_truy_van=15),
+            TruongHop('inventory:danh_sach_kho', so_truy_van=3),
+            TruongHop('inventory:tao_kho', so_truy_van=2),
+            TruongHop('inventory:chi_tiet_ton_kho', so_truy_van=6),
+            TruongHop('inventory:chi_tiet_ton_kho', {'kho_id': kho.id}, so_truy_van=6),
+            TruongHop('inventory:ma_tran_ton_kho', so_truy_van=7),
+            TruongHop('inventory:ma_tran_ton_kho', query='q=Bút&moi_trang=500&page=2', so_truy_van=7),
+            TruongHop('inventory:ma_tran_ton_kho_json', so_truy_van=6),
+            TruongHop('inventory:xuat_ton_kho_csv', so_truy_van=3),
+            TruongHop('inventory:xuat_ton_kho_xlsx', so_truy_van=2),
+            TruongHop('inventory:tim_kiem_chung_tu', query='q=Kho Hà Nội', so_truy_van=3),
+            TruongHop('inventory:ton_kho_hang_loat_api', query='san_pham=' + ','.join(
+                str(sp.id) for sp in self.du_lieu['san_pham'][:500]
+            ), so_truy_van=4),
+            TruongHop('inventory:thong_ke_bo_nho_dem', so_truy_van=2),
+            TruongHop('inventory:ton_kho_sap_het', so_truy_van=4),
+            TruongHop('inventory:ton_kho_sap_het_theo_kho', {'kho_id': kho.id}, so_truy_van=4),
+            TruongHop('inventory:ton_kho_sap_het_theo_san_pham', {'san_pham_id': san_pham.id}, so_truy_van=4),
+        ]
+
+
+class SinhDuLieuMauTest(TestCase):
+    """Lệnh seed_warehouse: tồn kho và lưu chuyển sinh ra phải khớp với chứng từ"""
+
+    def test_ton_kho_va_luu_chuyen_khop_chung_tu(self):
+        call_command(
+            'seed_warehouse', kho=3, san_pham=80, nha_cung_cap=5, nhan_vien=5, phieu_nhap=60,
+            phieu_chuyen=30, kiem_ke=6, dong_moi_kiem_ke=20, so_ngay=30, stdout=StringIO()
+        )
+        ton = dict(
+            ((dong.kho_id, dong.san_pham_id), dong.so_luong_ton) for dong in TonKho.objects.all()
+        )
+        nhat_ky = dict(
+            ((dong['kho_id'], dong['san_pham_id']), dong['tong'])
+            for dong in StockMovement.objects.values('kho_id', 'san_pham_id').annotate(tong=Sum('so_luong'))
+        )
+        self.assertTrue(ton)
+        self.assertEqual(ton, nhat_ky)
+        self.assertTrue(all(so_luong >= 0 for so_luong in ton.values()))
+
+        def luu_chuyen():
+            return set(DailyStockFlow.objects.values_list(
+                'kho_id', 'san_pham_id', 'ngay', 'so_luong_nhap', 'gia_tri_nhap', 'so_luong_nhan', 'so_luong_xuat'
+            ))
+
+        da_sinh = luu_chuyen()
+        QuanLyLuuChuyen.dung_lai()
+        self.assertEqual(da_sinh, luu_chuyen())
+
+        # Mã chứng từ theo đúng tiền tố của luồng chạy thật, bộ đếm nối tiếp mã đã sinh
+        so_phieu_chuyen = XuatKho.objects.count()
+        self.assertTrue(so_phieu_chuyen)
+        self.assertFalse(XuatKho.objects.exclude(ma_phieu__startswith='XKNB-').exists())
+        self.assertEqual(CapSoChungTu.cap_ma('XKNB'), CapSoChungTu.dinh_dang('XKNB', so_phieu_chuyen + 1))
+        self.assertEqual(CapSoChungTu.cap_ma('KK'), CapSoChungTu.dinh_dang('KK', KiemKe.objects.count() + 1))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_warehouse', stdout=StringIO())
+
+
+class MaTranTonKhoTest(TestCase):
+    """Ma trận sản phẩm x kho: ô, tổng dòng, tổng cột phải khớp TonKho"""
+
+    def test_ma_tran_khop_ton_kho(self):
+        call_command(
+            'seed_warehouse', kho=3, san_pham=60, nha_cung_cap=5, nhan_vien=5, phieu_nhap=40,
+            phieu_chuyen=20, kiem_ke=2, dong_moi_kiem_ke=10, so_ngay=20, stdout=StringIO()
+        )
+        Kho.objects.filter(pk=Kho.objects.order_by('ma_kho').last().pk).update(trang_thai='ngung_hoat_dong')
+        self.client.force_login(get_user_model().objects.get(username='quan_tri'))
+
+        phan_hoi = self.client.get(reverse('inventory:ma_tran_ton_kho_json'), {'moi_trang': 500})
+        self.assertEqual(phan_hoi.status_code, 200)
+        ma_tran = phan_hoi.json()
+
+        kho_ids = [kho['id'] for kho in ma_tran['kho']]
+        self.assertEqual(
+            kho_ids, list(Kho.objects.filter(trang_thai='dang_hoat_dong').order_by('ma_kho').values_list('id', flat=True))
+        )
+        ton = dict(
+            ((dong.san_pham_id, dong.kho_id), dong.so_luong_ton)
+            for dong in TonKho.objects.filter(kho_id__in=kho_ids)
+        )
+        self.assertEqual(ma_tran['trang']['tong_so_dong'], len({san_pham_id for san_pham_id, _ in ton}))
+        for dong in ma_tran['dong']:
+            self.assertEqual(dong['ton'], [ton.get((dong['san_pham_id'], kho_id), 0) for kho_id in kho_ids])
+            self.assertEqual(dong['tong'], sum(dong['ton']))
+        self.assertEqual(ma_tran['tong_theo_kho'], [
+            sum(so_luong for (_, kho_id), so_luong in ton.items() if kho_id == k) for k in kho_ids
+        ])
+        self.assertEqual(ma_tran['tong'], sum(ton.values()))
+
+        self.assertEqual(
+            self.client.get(reverse('inventory:ma_tran_ton_kho_json'), {'moi_trang': 'x'}).status_code, 400
+        )
+        # Trang HTML không trả JSON lỗi mà hiển thị với bộ lọc mặc định kèm thông báo
+        phan_hoi = self.client.get(reverse('inventory:ma_tran_ton_kho'), {'moi_trang': 'x', 'danh_muc': 'y'})
+        self.assertEqual(phan_hoi.status_code, 200)
+        self.assertEqual(phan_hoi.context['moi_trang'], 50)
+        self.assertIn('không hợp lệ', ' '.join(str(m) for m in phan_hoi.context['messages']))
+
+
+class SoSanhMocTest(SimpleTestCase):
+    """Lệnh bench: phân vị và phát hiện hồi quy so với baseline"""
+
+    def test_phan_vi_theo_hang_gan_nhat(self):
+        gia_tri = list(range(1, 21))
+        self.assertEqual(phan_vi(gia_tri, 50), 10)
+        self.assertEqual(phan_vi(gia_tri, 95), 19)
+        self.assertEqual(phan_vi([7], 95), 7)
+        self.assertIsNone(phan_vi([], 50))
+
+    def test_hoi_quy_va_cai_thien(self):
+        moc = {
+            'dashboard': {'p50_ms': 50, 'p95_ms': 80, 'so_truy_van': 12, 'bo_nho_dinh_kb': 300},
+            'ds_ton_kho': {'p50_ms': 40, 'p95_ms': 60, 'so_truy_van': 6, 'bo_nho_dinh_kb': 1200},
+        }
+        ket_qua = {
+            # p95 tăng 25% và số truy vấn tăng 1 là hồi quy; p50 tăng 10% nằm trong ngưỡng
+            'dashboard': {'p50_ms': 55, 'p95_ms': 100, 'so_truy_van': 13, 'bo_nho_dinh_kb': 310},
+            'ds_ton_kho': {'p50_ms': 20, 'p95_ms': 60.5, 'so_truy_van': 6, 'bo_nho_dinh_kb': 1200},
+            'kich_ban_moi': {'p50_ms': 1, 'p95_ms': 1, 'so_truy_van': 1, 'bo_nho_dinh_kb': 1},
+        }
+
+        hoi_quy, cai_thien = so_sanh_moc(ket_qua, moc, nguong=0.2)
+
+        self.assertEqual(
+            sorted((muc['kich_ban'], muc['chi_so']) for muc in hoi_quy),
+            [('dashboard', 'p95_ms'), ('dashboard', 'so_truy_van')]
+        )
+        self.assertEqual([(muc['kich_ban'], muc['chi_so']) for muc in cai_thien], [('ds_ton_kho', 'p50_ms')])
+        self.assertEqual(hoi_quy[0]['thay_doi_phan_tram'], 25.0)
@@ -16,8 +16,19 @@ urlpatterns = [
     path('', views.danh_sach_kiem_ke, name='danh_sach_kiem_ke'),
     path('tao-kiem-ke/', views.tao_kiem_ke, name='tao_kiem_ke'),
     path('chi-tiet-kiem-ke/<int:id>/', views.chi_tiet_kiem_ke, name='chi_tiet_kiem_ke'),
+    path('chi-tiet-kiem-ke/<int:id>/ghi-so/', views.ghi_so_kiem_ke, name='ghi_so_kiem_ke'),
     path('kho/', views.danh_sach_kho, name='danh_sach_kho'),
     path('kho/tao-moi/', views.tao_kho, name='tao_kho'),
     path('ton-kho/', views.chi_tiet_ton_kho, name='chi_tiet_ton_kho'),
     path('kho/<int:kho_id>/ton-kho/', views.chi_tiet_ton_kho, name='chi_tiet_ton_kho'),
+    path('ton-kho/ma-tran/', views.ma_tran_ton_kho, name='ma_tran_ton_kho'),
+    path('ton-kho/ma-tran/json/', views.ma_tran_ton_kho, {'dinh_dang': 'json'}, name='ma_tran_ton_kho_json'),
+    path('ton-kho/xuat-csv/', views.xuat_ton_kho_csv, name='xuat_ton_kho_csv'),
+    path('ton-kho/xuat-xlsx/', views.xuat_ton_kho_xlsx, name='xuat_ton_kho_xlsx'),
+    path('tim-kiem/', views.tim_kiem_chung_tu, name='tim_kiem_chung_tu'),
+    path('api/ton-kho/', views.ton_kho_hang_loat_api, name='ton_kho_hang_loat_api'),
+    path('bo-nho-dem/thong-ke/', views.thong_ke_bo_nho_dem, name='thong_ke_bo_nho_dem'),
+    path('ton-kho/sap-het/', views.ton_kho_sap_het, name='ton_kho_sap_het'),
+    path('kho/<int:kho_id>/sap-het/', views.ton_kho_sap_het, name='ton_kho_sap_het_theo_kho'),
+    path('san-pham/<int:san_pham_id>/sap-het/', views.ton_kho_sap_het, name='ton_kho_sap_het_theo_san_pham'),
 ]
\ No newline at end of file
@@ -1,32 +1,58 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
-from django.contrib.auth.decorators import login_required
-from .models import KiemKe, ChiTietKiemKe
-from .models import Kho, TonKho
-from products.models import SanPham, DanhMucSanPham, DonViTinh
-from .models import NhapKho, ChiTietNhapKho, XuatKho, ChiTietXuatKho
-from .forms import NhapKhoForm, ChiTietNhapKhoFormSet, XuatKhoForm, ChiTietXuatKhoFormSet
-from .services import QuanLyTonKho
-from django.db import transaction
-from partners.models import NhaCungCap
-from datetime import datetime, timedelta
-from debt.models import CongNo
-from django.utils import timezone
+import csv
+import json
+import tempfile
 from decimal import Decimal
+
 from django.contrib import messages
-from django.db import OperationalError
+from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-import json
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, JsonResponse, QueryDict, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
+
+from partners.models import NhaCungCap
+from products.models import SanPham, DanhMucSanPham
+from .cache import BoNhoDem
+from .forms import NhapKhoForm
+from .models import Kho, TonKho, NhapKho, ChiTietNhapKho, XuatKho, ChiTietXuatKho, KiemKe
+from .pagination import TrangKeyset, phan_trang_keyset, dem_uoc_luong, tham_so_loc
+from .search import TimKiemChungTu
+from .services import QuanLyTonKho, QuanLyNhapKho, QuanLyXuatKho, QuanLyKiemKe
+
+
+def _tong_chi_tiet(chi_tiet, truong_phieu, bieu_thuc, output_field):
+    """Tổng hợp dòng chi tiết của từng phiếu bằng truy vấn con tương quan
+
+    Khác annotate() qua JOIN + GROUP BY (phải gộp mọi phiếu trước khi LIMIT), truy vấn con
+    chỉ chạy cho các phiếu của trang hiện tại.
+    """
+    return Coalesce(
+        Subquery(
+            chi_tiet.filter(**{truong_phieu: OuterRef('pk')}).order_by()
+            .values(truong_phieu).annotate(gia_tri=bieu_thuc).values('gia_tri')
+        ),
+        0,
+        output_field=output_field,
+    )
+
 
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q, Sum
-from django.shortcuts import render
-from .models import NhapKho
+def _loc_tim_kiem(queryset, loai, chuoi, *truong_du_phong):
+    """Lọc chứng từ theo chỉ mục FTS5; backend không có FTS thì OR icontains trên các trường dự phòng"""
+    dieu_kien = TimKiemChungTu.dieu_kien_tim(loai, chuoi)
+    if dieu_kien is not None:
+        return queryset.filter(id__in=dieu_kien)
+    loc = Q()
+    for truong in truong_du_phong:
+        loc |= Q(**{f'{truong}__icontains': chuoi})
+    return queryset.filter(loc)
 
 
 def danh_sach_nhap(request):
-    # Lấy tất cả phiếu nhập
-    phieu_nhap = NhapKho.objects.select_related('nha_cung_cap', 'nguoi_lap', 'kho').order_by('-ngay_nhap')
+    # Một truy vấn: phiếu nhập kèm số dòng chi tiết và tổng thành tiền tính trong SQL (xem _tong_chi_tiet)
+    phieu_nhap = NhapKho.objects.select_related('nha_cung_cap', 'nguoi_lap', 'kho')
 
     # --- Xử lý bộ lọc ---
     search_query = request.GET.get('q', '')
@@ -41,46 +67,37 @@ def danh_sach_nhap(request):
 
     # Tìm kiếm
     if search_query:
-        phieu_nhap = phieu_nhap.filter(
-            Q(ma_phieu__icontains=search_query) |
-            Q(nha_cung_cap__ten_nha_cung_cap__icontains=search_query) |
-            Q(nguoi_lap__username__icontains=search_query)
+        phieu_nhap = _loc_tim_kiem(
+            phieu_nhap, 'nhap', search_query,
+            'ma_phieu', 'nha_cung_cap__ten_nha_cung_cap', 'nguoi_lap__username'
         )
 
-    # --- Phân trang ---
-    paginator = Paginator(phieu_nhap, 20)  # 20 item mỗi trang
-    page_number = request.GET.get('page')
-
-    try:
-        page_obj = paginator.get_page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.get_page(1)
-    except EmptyPage:
-        page_obj = paginator.get_page(paginator.num_pages)
-
-    # Tính tổng tiền cho từng phiếu trên trang hiện tại
-    total_amount = 0
-    for phieu in page_obj:
-        # Cách 1: Nếu có trường tong_tien trong model
-        if hasattr(phieu, 'tong_tien') and phieu.tong_tien:
-            tong_tien = phieu.tong_tien
-        else:
-            # Cách 2: Tính tổng từ chi tiết
-            tong_tien = ChiTietNhapKho.objects.filter(phieu_nhap=phieu).aggregate(
-                tong=Sum('thanh_tien')
-            )['tong'] or 0
-            phieu.tong_tien_calculated = tong_tien
-
-        total_amount += tong_tien
+    # --- Phân trang theo con trỏ (ngay_nhap, id), không dùng OFFSET ---
+    chi_tiet = ChiTietNhapKho.objects.all()
+    page_obj = phan_trang_keyset(
+        phieu_nhap.annotate(
+            so_san_pham=_tong_chi_tiet(chi_tiet, 'phieu_nhap', Count('id'), IntegerField()),
+            tong_tien_chi_tiet=_tong_chi_tiet(chi_tiet, 'phieu_nhap', Sum('thanh_tien'), DecimalField()),
+        ),
+        'ngay_nhap',
+        sau=request.GET.get('sau'), truoc=request.GET.get('truoc'), moi_trang=20
+    )
+    # Tổng số phiếu chỉ đếm tới ngưỡng (đếm trên tập chưa annotate)
+    tong_so_phieu, tren_nguong = dem_uoc_luong(phieu_nhap.values('id'))
 
-        # Đếm số lượng sản phẩm
-        phieu.so_san_pham = phieu.chi_tiet_nhap.count()
+    # Tổng tiền trên trang hiện tại: phiếu cũ chưa có tong_tien thì lấy tổng chi tiết
+    total_amount = sum(
+        (phieu.tong_tien or phieu.tong_tien_chi_tiet or 0) for phieu in page_obj
+    )
 
     context = {
-        'phieu_nhap': page_obj,  # Dùng page_obj thay vì phieu_nhap
+        'phieu_nhap': page_obj,
         'page_obj': page_obj,
-        'is_paginated': paginator.num_pages > 1,
+        'is_paginated': page_obj.has_other_pages(),
         'total_amount': total_amount,
+        'tong_so_phieu': tong_so_phieu,
+        'tren_nguong': tren_nguong,
+        'tham_so_loc': tham_so_loc(request),
         'search_query': search_query,
         'start_date': start_date,
         'end_date': end_date,
@@ -132,46 +149,41 @@ def nhap_kho_create(request):
                     messages.error(request, "Vui lòng chọn kho!")
                     return redirect('inventory:nhap_kho_create')
 
-                # --- 3️. Tạo phiếu nhập ---
-                nhapkho = NhapKho.objects.create(
-                    nha_cung_cap=nha_cung_cap,
-                    nguoi_lap=request.user,
-                    kho=kho,
-                    ghi_chu=ghi_chu,
-                    ngay_nhap=timezone.now(),
-                    tong_tien=0  # Khởi tạo tổng tiền = 0
-                )
-
-                # --- 4️. Lưu chi tiết sản phẩm ---
-                ten_san_pham_list = request.POST.getlist('ten_san_pham')
+                # --- 3️. Đọc chi tiết sản phẩm ---
+                san_pham_id_list = request.POST.getlist('san_pham_id')
                 so_luong_list = request.POST.getlist('so_luong')
                 don_gia_list = request.POST.getlist('don_gia')
 
-                for i, ten_sp in enumerate(ten_san_pham_list):
-                    if not ten_sp.strip():
+                dong_hang = []
+                for i, san_pham_id in enumerate(san_pham_id_list):
+                    if not san_pham_id.strip():
                         continue
                     try:
-                        sp = SanPham.objects.get(ten_san_pham=ten_sp)
+                        sp_id = int(san_pham_id)
                         sl = int(so_luong_list[i])
                         dg = Decimal(don_gia_list[i])
-                    except (ValueError, IndexError, SanPham.DoesNotExist):
+                    except (ValueError, IndexError, ArithmeticError):
                         continue
 
                     if sl <= 0 or dg <= 0:
                         continue
 
-                    # Tạo chi tiết nhập (sẽ tự động cập nhật tong_tien qua save method)
-                    ChiTietNhapKho.objects.create(
-                        phieu_nhap=nhapkho,
-                        san_pham=sp,
-                        so_luong=sl,
-                        don_gia=dg
-                    )
+                    dong_hang.append((sp_id, sl, dg))
 
+                if not dong_hang:
+                    messages.error(request, "Vui lòng chọn ít nhất một sản phẩm từ danh sách gợi ý!")
+                    return redirect('inventory:nhap_kho_create')
 
-                # Tạo công nợ tự động (sử dụng nhapkho.tong_tien đã được tính)
-                tao_cong_no_tu_dong(nhapkho)
+                # --- 4️. Tạo phiếu nhập và chi tiết theo lô (cập nhật tồn kho, tổng tiền một lần) ---
+                nhapkho = QuanLyNhapKho.tao_phieu_nhap(
+                    kho=kho,
+                    nha_cung_cap=nha_cung_cap,
+                    nguoi_lap=request.user,
+                    dong_hang=dong_hang,
+                    ghi_chu=ghi_chu
+                )
 
+                # Công nợ phải trả được ghi sổ sau commit (debt.signals -> QuanLyCongNo)
                 messages.success(request, f"Tạo phiếu nhập {nhapkho.ma_phieu} thành công! Tổng tiền: {nhapkho.tong_tien:,.0f}₫")
                 return redirect('inventory:nhapkho_list')
 
@@ -179,23 +191,18 @@ def nhap_kho_create(request):
             messages.error(request, f"Lỗi khi nhập kho: {e}")
 
     # GET request
+    # Sản phẩm được gợi ý qua products:product_autocomplete, không đổ cả danh mục vào trang
     context = {
         'form': NhapKhoForm(user=request.user),
-        'san_pham_list': SanPham.objects.filter(trang_thai=True),
-        'nha_cung_cap_list': NhaCungCap.objects.all(),
-        'danh_muc_list': DanhMucSanPham.objects.all(),
-        'don_vi_tinh_list': DonViTinh.objects.all(),
+        'nha_cung_cap_list': NhaCungCap.objects.only('id', 'ten_nha_cung_cap'),
         'kho_list': kho_list,
     }
     return render(request, 'inventory/nhapkho_form.html', context)
 
 
-from django.db.models import Sum
-
-
 def nhap_kho_detail(request, pk):
-    phieu_nhap = get_object_or_404(NhapKho, pk=pk)
-    chi_tiet_list = phieu_nhap.chi_tiet_nhap.all()
+    phieu_nhap = get_object_or_404(NhapKho.objects.select_related('kho', 'nha_cung_cap', 'nguoi_lap'), pk=pk)
+    chi_tiet_list = phieu_nhap.chi_tiet_nhap.select_related('san_pham')
 
     tong_tien = chi_tiet_list.aggregate(
         tong=Sum('thanh_tien')
@@ -207,19 +214,6 @@ def nhap_kho_detail(request, pk):
         'tong_tien': tong_tien
     })
 
-def tao_cong_no_tu_dong(nhapkho):
-    from datetime import datetime, timedelta
-    from debt.models import CongNo
-    han_thanh_toan = datetime.now() + timedelta(days=30)
-    CongNo.objects.create(
-        nha_cung_cap=nhapkho.nha_cung_cap,
-        phieu_nhap=nhapkho,
-        loai_cong_no='nhap_hang',
-        so_tien=nhapkho.tong_tien,
-        so_tien_con_lai=nhapkho.tong_tien,
-        han_thanh_toan=han_thanh_toan.date(),
-        ghi_chu=f"Công nợ từ phiếu nhập {nhapkho.ma_phieu}"
-    )
 def xoa_phieu_nhap(request, pk):
     phieu = get_object_or_404(NhapKho, pk=pk)
     if request.method == 'POST':
@@ -230,14 +224,24 @@ def xoa_phieu_nhap(request, pk):
 
 @login_required
 def danh_sach_xuat(request):
-    """Danh sách xuất kho với bộ lọc đơn giản"""
-    # Lấy tất cả phiếu xuất
-    xuatkho_list = XuatKho.objects.select_related('kho', 'kho_nhan', 'nguoi_lap').order_by('-ngay_xuat')
+    """Danh sách xuất kho với bộ lọc đơn giản, phân trang theo con trỏ (ngay_xuat, id)"""
+    # Số dòng chi tiết và tổng số lượng được tính ngay trong truy vấn danh sách
+    xuatkho_list = XuatKho.objects.select_related('kho', 'kho_nhan', 'nguoi_lap')
 
     # Lấy tham số lọc
     search_query = request.GET.get('q', '')
     start_date = request.GET.get('start_date', '')
     end_date = request.GET.get('end_date', '')
+    kho_id = request.GET.get('kho', '')
+    kho_nhan_id = request.GET.get('kho_nhan', '')
+    kho_id = int(kho_id) if kho_id.isdigit() else None
+    kho_nhan_id = int(kho_nhan_id) if kho_nhan_id.isdigit() else None
+
+    # Lọc theo kho xuất / kho nhận (index xuat_kho_kho_ngay_idx, xuat_kho_kho_nhan_ngay_idx)
+    if kho_id:
+        xuatkho_list = xuatkho_list.filter(kho_id=kho_id)
+    if kho_nhan_id:
+        xuatkho_list = xuatkho_list.filter(kho_nhan_id=kho_nhan_id)
 
     # Lọc theo ngày
     if start_date:
@@ -248,16 +252,31 @@ def danh_sach_xuat(request):
 
     # Tìm kiếm
     if search_query:
-        xuatkho_list = xuatkho_list.filter(
-            Q(ma_phieu__icontains=search_query) |
-            Q(kho__ten_kho__icontains=search_query) |
-            Q(kho_nhan__ten_kho__icontains=search_query) |
-            Q(nguoi_lap__username__icontains=search_query) |
-            Q(ghi_chu__icontains=search_query)
+        xuatkho_list = _loc_tim_kiem(
+            xuatkho_list, 'xuat', search_query,
+            'ma_phieu', 'kho__ten_kho', 'kho_nhan__ten_kho', 'nguoi_lap__username', 'ghi_chu'
         )
 
+    page_obj = phan_trang_keyset(
+        xuatkho_list.annotate(
+            so_san_pham=_tong_chi_tiet(ChiTietXuatKho.objects.all(), 'phieu_xuat', Count('id'), IntegerField()),
+            tong_so_luong=_tong_chi_tiet(ChiTietXuatKho.objects.all(), 'phieu_xuat', Sum('so_luong'), IntegerField()),
+        ),
+        'ngay_xuat',
+        sau=request.GET.get('sau'), truoc=request.GET.get('truoc'), moi_trang=20
+    )
+    tong_so_phieu, tren_nguong = dem_uoc_luong(xuatkho_list.values('id'))
+
     context = {
-        'xuatkho_list': xuatkho_list,
+        'xuatkho_list': page_obj,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+        'tong_so_phieu': tong_so_phieu,
+        'tren_nguong': tren_nguong,
+        'tham_so_loc': tham_so_loc(request),
+        'danh_sach_kho': Kho.objects.order_by('ten_kho').values('id', 'ten_kho'),
+        'kho_id': kho_id,
+        'kho_nhan_id': kho_nhan_id,
         'search_query': search_query,
         'start_date': start_date,
         'end_date': end_date,
@@ -288,86 +307,52 @@ def xuat_kho_create(request):
                     return redirect('inventory:xuatkho_form')
 
                 # --- Lấy danh sách sản phẩm và số lượng ---
-                ten_san_pham_list = request.POST.getlist('ten_san_pham')
+                san_pham_id_list = request.POST.getlist('san_pham_id')
                 so_luong_list = request.POST.getlist('so_luong')
 
                 # Vì đã xóa don_gia từ form và model, nên không cần lấy don_gia_list
 
                 # --- Kiểm tra đầu vào ---
-                if not ten_san_pham_list or not so_luong_list:
+                if not san_pham_id_list or not so_luong_list:
                     messages.error(request, "Vui lòng thêm ít nhất một sản phẩm!")
                     return redirect('inventory:xuatkho_form')
 
                 # Kiểm tra xem các list có cùng độ dài không
-                if len(ten_san_pham_list) != len(so_luong_list):
+                if len(san_pham_id_list) != len(so_luong_list):
                     messages.error(request, "Dữ liệu sản phẩm không hợp lệ!")
                     return redirect('inventory:xuatkho_form')
 
-                # --- Bước 1: Kiểm tra tồn kho trước ---
-                for i, ten_sp in enumerate(ten_san_pham_list):
-                    if not ten_sp.strip():
+                dong_hang = []
+                for i, san_pham_id in enumerate(san_pham_id_list):
+                    if not san_pham_id.strip():
                         continue
                     try:
-                        sp = SanPham.objects.get(ten_san_pham=ten_sp)
+                        sp_id = int(san_pham_id)
                         sl = int(so_luong_list[i])
-                    except (ValueError, IndexError, SanPham.DoesNotExist):
-                        continue
-
-                    ton = QuanLyTonKho.kiem_tra_ton_kho(kho_xuat, sp)
-                    if ton['so_luong_kha_dung'] < sl:
-                        messages.error(request,
-                                       f"Sản phẩm {sp.ten_san_pham} không đủ tồn kho (còn {ton['so_luong_kha_dung']})!")
-                        return redirect('inventory:xuatkho_form')
-
-                # --- Bước 2: Tạo phiếu xuất ---
-                xuatkho = XuatKho.objects.create(
-                    nguoi_lap=request.user,
-                    kho=kho_xuat,
-                    kho_nhan=kho_nhan,
-                    ghi_chu=ghi_chu,
-                    ngay_xuat=timezone.now()
-                )
-
-                # Sinh mã phiếu
-                last = XuatKho.objects.order_by('-id').first()
-                seq = (last.id + 1) if last else 1
-                xuatkho.ma_phieu = f"XKNB-{seq:04d}"
-                xuatkho.save()
-
-                # --- Bước 3: Lưu chi tiết và cập nhật tồn kho ---
-                for i, ten_sp in enumerate(ten_san_pham_list):
-                    if not ten_sp.strip():
-                        continue
-                    try:
-                        sp = SanPham.objects.get(ten_san_pham=ten_sp)
-                        sl = int(so_luong_list[i])
-                    except (ValueError, IndexError, SanPham.DoesNotExist):
+                    except (ValueError, IndexError):
                         continue
 
                     if sl <= 0:
                         continue
 
-                    # Tạo chi tiết xuất KHÔNG có don_gia
-                    ChiTietXuatKho.objects.create(
-                        phieu_xuat=xuatkho,
-                        san_pham=sp,
-                        so_luong=sl
+                    dong_hang.append((sp_id, sl))
 
-                    )
+                if not dong_hang:
+                    messages.error(request, "Vui lòng chọn ít nhất một sản phẩm từ danh sách gợi ý!")
+                    return redirect('inventory:xuatkho_form')
 
-                    # Trừ kho xuất
-                    try:
-                        QuanLyTonKho.xuat_hang(kho_xuat, sp, sl)
-                    except ValueError as e:
-                        messages.error(request, str(e))
-                        xuatkho.delete()  # Xóa phiếu xuất nếu có lỗi
-                        return redirect('inventory:xuatkho_form')
-
-                    # Cộng kho nhận
-                    ton_nhan, created = TonKho.objects.get_or_create(kho=kho_nhan, san_pham=sp)
-                    ton_nhan.so_luong_ton += sl
-                    ton_nhan.so_luong_kha_dung += sl
-                    ton_nhan.save()
+                # --- Kiểm tra tồn kho, tạo phiếu và chuyển tồn kho trong một lượt ---
+                try:
+                    xuatkho = QuanLyXuatKho.tao_phieu_chuyen(
+                        kho_xuat=kho_xuat,
+                        kho_nhan=kho_nhan,
+                        nguoi_lap=request.user,
+                        dong_hang=dong_hang,
+                        ghi_chu=ghi_chu
+                    )
+                except ValueError as e:
+                    messages.error(request, str(e))
+                    return redirect('inventory:xuatkho_form')
 
                 messages.success(request, f"Tạo phiếu xuất nội bộ {xuatkho.ma_phieu} thành công!")
                 return redirect('inventory:xuatkho_list')
@@ -375,18 +360,16 @@ def xuat_kho_create(request):
         except Exception as e:
             messages.error(request, f"Lỗi khi tạo phiếu xuất: {str(e)}")
 
+    # Sản phẩm được gợi ý qua products:product_autocomplete, không đổ cả danh mục vào trang
     context = {
-        'san_pham_list': SanPham.objects.filter(trang_thai=True),
-        'danh_muc_list': DanhMucSanPham.objects.all(),
-        'don_vi_tinh_list': DonViTinh.objects.all(),
         'kho_list': kho_list,
     }
     return render(request, 'inventory/xuatkho_form.html', context)
 
 
 def xuat_kho_detail(request, pk):
-    phieu_xuat = get_object_or_404(XuatKho, pk=pk)
-    chi_tiet_list = phieu_xuat.chi_tiet_xuat.all()
+    phieu_xuat = get_object_or_404(XuatKho.objects.select_related('kho', 'kho_nhan', 'nguoi_lap'), pk=pk)
+    chi_tiet_list = phieu_xuat.chi_tiet_xuat.select_related('san_pham__don_vi_tinh')
     return render(request, 'inventory/xuatkho_detail.html', {
         'phieu_xuat': phieu_xuat,
         'chi_tiet_list': chi_tiet_list
@@ -402,11 +385,14 @@ def xoa_phieu_xuat(request, pk):
 #  KIỂM KÊ
 
 
+KIEM_KE_DANH_SACH_MOI_TRANG = 20
+
+
 @login_required
 def danh_sach_kiem_ke(request):
     try:
         # Bắt đầu với tất cả kiểm kê
-        danh_sach = KiemKe.objects.all().order_by('-ngay_tao')
+        danh_sach = KiemKe.objects.select_related('kho', 'nguoi_phu_trach').order_by('-ngay_tao')
 
         # Lấy các tham số lọc từ GET request
         search_query = request.GET.get('q', '')
@@ -421,19 +407,25 @@ def danh_sach_kiem_ke(request):
             danh_sach = danh_sach.filter(ngay_kiem_ke__lte=end_date)
 
         if search_query:
-            danh_sach = danh_sach.filter(
-                Q(ma_kiem_ke__icontains=search_query) |
-                Q(ten_dot_kiem_ke__icontains=search_query) |
-                Q(kho__ten_kho__icontains=search_query) |
-                Q(nguoi_phu_trach__username__icontains=search_query)
+            danh_sach = _loc_tim_kiem(
+                danh_sach, 'kiem_ke', search_query,
+                'ma_kiem_ke', 'ten_dot_kiem_ke', 'kho__ten_kho', 'nguoi_phu_trach__username'
             )
 
+        # Phân trang theo con trỏ như danh sách phiếu nhập/chuyển kho
+        page_obj = phan_trang_keyset(
+            danh_sach, 'ngay_tao', sau=request.GET.get('sau'), truoc=request.GET.get('truoc'),
+            moi_trang=KIEM_KE_DANH_SACH_MOI_TRANG
+        )
     except OperationalError:
-        danh_sach = []
+        page_obj = TrangKeyset([])
         messages.error(request, 'Có lỗi database. Vui lòng chạy migrations.')
 
     return render(request, 'inventory/danh_sach_kiem_ke.html', {
-        'danh_sach_kiem_ke': danh_sach
+        'danh_sach_kiem_ke': page_obj,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+        'tham_so_loc': tham_so_loc(request),
     })
 @login_required
 def tao_kiem_ke(request):
@@ -474,12 +466,16 @@ def tao_kiem_ke(request):
     return render(request, 'inventory/tao_kiem_ke.html', {'danh_sach_kho': danh_sach_kho})
 
 
+# Số sản phẩm trên một trang phiếu kiểm kê
+KIEM_KE_MOI_TRANG = 100
+
+
 @login_required
 def chi_tiet_kiem_ke(request, id):
     try:
         # Đảm bảo id là số nguyên
         kiem_ke_id = int(id)
-        kiem_ke = get_object_or_404(KiemKe, id=kiem_ke_id)
+        kiem_ke = get_object_or_404(KiemKe.objects.select_related('kho', 'nguoi_phu_trach'), id=kiem_ke_id)
     except (ValueError, TypeError):
         # Nếu không phải số, thử tìm bằng mã kiểm kê
         try:
@@ -493,81 +489,101 @@ def chi_tiet_kiem_ke(request, id):
         messages.error(request, 'Dữ liệu kho không hợp lệ')
         return redirect('inventory:danh_sach_kiem_ke')
 
-    # Lấy danh sách sản phẩm
-    san_phams = SanPham.objects.all()
+    # Lấy danh sách sản phẩm (lọc theo danh mục, phân trang phía server)
+    danh_muc_filter = request.GET.get('danh_muc', '')
+    san_phams = SanPham.objects.select_related('don_vi_tinh').order_by('ma_san_pham')
+    if danh_muc_filter:
+        try:
+            san_phams = san_phams.filter(danh_muc_id=int(danh_muc_filter))
+        except (ValueError, TypeError):
+            danh_muc_filter = ''
 
-    if request.method == 'POST':
+    if request.method == 'POST' and kiem_ke.ngay_ghi_so:
+        messages.error(request, 'Đợt kiểm kê đã ghi sổ chênh lệch, không thể sửa kết quả.')
+    elif request.method == 'POST':
         try:
+            # Chỉ các sản phẩm có trên trang vừa gửi
+            ket_qua = {}
+            so_dong_am = 0
+            for key, value in request.POST.items():
+                if not key.startswith('so_luong_') or not value.strip():
+                    continue
+                try:
+                    san_pham_id = int(key[len('so_luong_'):])
+                    so_luong_thuc_te = int(value)
+                except ValueError:
+                    continue
+                if so_luong_thuc_te < 0:
+                    so_dong_am += 1
+                    continue
+                ket_qua[san_pham_id] = (
+                    so_luong_thuc_te,
+                    request.POST.get(f'ghi_chu_{san_pham_id}', '').strip()
+                )
+
+            if so_dong_am:
+                messages.error(request, f'Số lượng thực tế không được âm ({so_dong_am} sản phẩm). Chưa lưu trang này.')
+                return redirect(f"{request.path}?{request.GET.urlencode()}")
+
             with transaction.atomic():
-                for san_pham in san_phams:
-                    so_luong_thuc_te_key = f'so_luong_{san_pham.id}'
-                    so_luong_thuc_te = request.POST.get(so_luong_thuc_te_key)
-
-                    if so_luong_thuc_te and so_luong_thuc_te.strip():
-                        # Kiểm tra tồn kho
-                        ton_kho_info = QuanLyTonKho.kiem_tra_ton_kho(kiem_ke.kho, san_pham)
-                        so_luong_he_thong = ton_kho_info['so_luong_ton']
-                        so_luong_thuc_te_int = int(so_luong_thuc_te)
-
-                        # Tạo hoặc cập nhật chi tiết kiểm kê
-                        chi_tiet, created = ChiTietKiemKe.objects.get_or_create(
-                            kiem_ke=kiem_ke,
-                            san_pham=san_pham,
-                            defaults={
-                                'so_luong_he_thong': so_luong_he_thong,
-                                'so_luong_thuc_te': so_luong_thuc_te_int
-                            }
-                        )
-
-                        if not created:
-                            chi_tiet.so_luong_he_thong = so_luong_he_thong
-                            chi_tiet.so_luong_thuc_te = so_luong_thuc_te_int
-                            chi_tiet.save()
-
-                kiem_ke.trang_thai = 'hoan_thanh'
-                kiem_ke.save()
-
-                messages.success(request, 'Cập nhật kiểm kê thành công!')
-                return redirect('inventory:danh_sach_kiem_ke')
+                QuanLyKiemKe.luu_ket_qua(kiem_ke, ket_qua)
+
+                if 'hoan_thanh' in request.POST:
+                    kiem_ke.trang_thai = 'hoan_thanh'
+                    kiem_ke.save()
+
+                    messages.success(request, 'Cập nhật kiểm kê thành công!')
+                    return redirect('inventory:danh_sach_kiem_ke')
+
+            messages.success(request, f'Đã lưu {len(ket_qua)} sản phẩm trên trang này.')
+            return redirect(f"{request.path}?{request.GET.urlencode()}")
 
         except Exception as e:
             messages.error(request, f'Có lỗi xảy ra: {str(e)}')
 
     # Chuẩn bị dữ liệu cho template
-    chi_tiet_kiem_ke_list = []
-    for san_pham in san_phams:
-        # Kiểm tra tồn kho
-        try:
-            ton_kho_info = QuanLyTonKho.kiem_tra_ton_kho(kiem_ke.kho, san_pham)
-            so_luong_he_thong = ton_kho_info['so_luong_ton']
-        except:
-            so_luong_he_thong = 0
+    paginator = Paginator(san_phams, KIEM_KE_MOI_TRANG)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    chi_tiet_kiem_ke_list = QuanLyKiemKe.lap_phieu_dem(kiem_ke, page_obj)
 
-        # Lấy chi tiết kiểm kê hiện có
-        chi_tiet_existing = ChiTietKiemKe.objects.filter(
-            kiem_ke=kiem_ke,
-            san_pham=san_pham
-        ).first()
-
-        chi_tiet_kiem_ke_list.append({
-            'san_pham': san_pham,
-            'so_luong_he_thong': so_luong_he_thong,
-            'so_luong_thuc_te': chi_tiet_existing.so_luong_thuc_te if chi_tiet_existing else so_luong_he_thong,
-            'chenh_lech': chi_tiet_existing.chenh_lech if chi_tiet_existing else 0,
-            'ghi_chu': chi_tiet_existing.ghi_chu if chi_tiet_existing else ''
-        })
+    query_params = request.GET.copy()
+    query_params.pop('page', None)
 
     context = {
         'kiem_ke': kiem_ke,
-        'chi_tiet_kiem_ke_list': chi_tiet_kiem_ke_list
+        'chi_tiet_kiem_ke_list': chi_tiet_kiem_ke_list,
+        'page_obj': page_obj,
+        'is_paginated': paginator.num_pages > 1,
+        'danh_muc_list': DanhMucSanPham.objects.all(),
+        'selected_danh_muc': danh_muc_filter,
+        'query_string': query_params.urlencode(),
     }
     return render(request, 'inventory/chi_tiet_kiem_ke.html', context)
 
+@login_required
+def ghi_so_kiem_ke(request, id):
+    """Ghi chênh lệch của đợt kiểm kê đã hoàn thành vào tồn kho"""
+    kiem_ke = get_object_or_404(KiemKe.objects.select_related('kho'), id=id)
+    if request.method != 'POST':
+        return redirect('inventory:chi_tiet_kiem_ke', id=kiem_ke.id)
+
+    try:
+        if QuanLyKiemKe.ghi_so_chenh_lech(kiem_ke):
+            messages.success(request, f'Đã ghi sổ chênh lệch kiểm kê (phiếu điều chỉnh {kiem_ke.ma_dieu_chinh}).')
+        else:
+            messages.info(request, 'Đợt kiểm kê này đã được ghi sổ trước đó.')
+    except ValueError as e:
+        messages.error(request, str(e))
+    except IntegrityError:
+        messages.error(request, 'Không thể ghi sổ: tồn kho hiện tại không đủ để trừ phần thiếu hụt.')
+
+    return redirect('inventory:chi_tiet_kiem_ke', id=kiem_ke.id)
+
 # QUẢN LÝ KHO
 
 @login_required
 def danh_sach_kho(request):
-    danh_sach_kho = Kho.objects.all().order_by('ma_kho')
+    danh_sach_kho = Kho.objects.select_related('nguoi_quan_ly').order_by('ma_kho')
     return render(request, 'inventory/danh_sach_kho.html', {
         'danh_sach_kho': danh_sach_kho
     })
@@ -600,101 +616,366 @@ def tao_kho(request):
 
 
 
-@login_required
-def chi_tiet_ton_kho(request, kho_id=None):
+def _loc_ton_kho(request, kho_id=None):
+    """Áp dụng bộ lọc kho/sản phẩm cho TonKho, dùng chung cho trang tồn kho và file xuất
+
+    Thứ tự ưu tiên kho: bộ lọc từ form (kể cả rỗng = tất cả kho), sau đó kho_id từ URL.
+    Trả về (queryset, kho_id đang lọc hoặc None).
+    """
+    ton_kho_query = TonKho.objects.all()
+    kho_dang_loc = None
+
+    if 'kho' in request.GET:  # Form đã được submit
+        kho_filter = request.GET.get('kho', '')
+        if kho_filter:
+            try:
+                kho_dang_loc = int(kho_filter)
+            except (ValueError, TypeError):
+                pass
+    elif kho_id:
+        kho_dang_loc = kho_id
+
+    if kho_dang_loc:
+        ton_kho_query = ton_kho_query.filter(kho_id=kho_dang_loc)
+
+    # Filter sản phẩm (luôn từ form)
+    san_pham_filter = request.GET.get('san_pham', '')
+    if san_pham_filter:
+        try:
+            ton_kho_query = ton_kho_query.filter(san_pham_id=int(san_pham_filter))
+        except (ValueError, TypeError):
+            pass
+
+    return ton_kho_query.order_by('kho__ten_kho', 'san_pham__ten_san_pham'), kho_dang_loc
+
 
-    print(f"=== DEBUG: View called ===")
-    print(f"kho_id from URL: {kho_id}")
-    print(f"GET parameters: {dict(request.GET)}")
+# Số dòng tồn kho trên một trang chi tiết tồn kho
+TON_KHO_MOI_TRANG = 100
 
-    # Lấy danh sách kho và sản phẩm
+
+@login_required
+def chi_tiet_ton_kho(request, kho_id=None):
+    # Danh sách kho cho bộ lọc; sản phẩm được gợi ý qua products:product_autocomplete
     danh_sach_kho = Kho.objects.filter(trang_thai='dang_hoat_dong')
-    danh_sach_san_pham = SanPham.objects.all()
 
     # Lấy filter từ GET parameters
     kho_filter = request.GET.get('kho', '')
     san_pham_filter = request.GET.get('san_pham', '')
+    so_trang = request.GET.get('page', 1)
 
-    # QUERY BAN ĐẦU
-    ton_kho_query = TonKho.objects.all().select_related(
+    ton_kho_query, kho_dang_loc = _loc_ton_kho(request, kho_id)
+    ton_kho_query = ton_kho_query.select_related(
         'kho',
         'san_pham',
         'san_pham__danh_muc',
         'san_pham__don_vi_tinh'
     )
 
-    # LOGIC LỌC THEO THỨ TỰ ƯU TIÊN:
-    # 1. Ưu tiên filter từ form trước
-    # 2. Nếu không có filter từ form, dùng kho_id từ URL
-    # 3. Nếu không có gì cả, hiển thị tất cả
-
-    if 'kho' in request.GET:  # Form đã được submit
-        print("Form has been submitted")
-        if kho_filter and kho_filter != '':
-            # Filter theo giá trị từ form
-            try:
-                kho_filter_id = int(kho_filter)
-                ton_kho_query = ton_kho_query.filter(kho_id=kho_filter_id)
-                print(f"Filtering by form: kho_id={kho_filter_id}")
-            except (ValueError, TypeError):
-                print(f"Invalid form filter: {kho_filter}")
-        else:
-            # kho_filter = '' -> hiển thị tất cả
-            print("Form kho is empty - showing ALL warehouses")
-            # KHÔNG thêm filter nào
-    else:
-        # Không có form submission
-        print("No form submission")
-        if kho_id:
-            # Dùng kho_id từ URL
-            try:
-                ton_kho_query = ton_kho_query.filter(kho_id=kho_id)
-                print(f"Filtering by URL kho_id: {kho_id}")
-            except (ValueError, TypeError):
-                print(f"Invalid URL kho_id: {kho_id}")
-        else:
-            print("No kho_id in URL - showing ALL warehouses")
-
-    # Filter sản phẩm (luôn từ form)
-    if san_pham_filter and san_pham_filter != '':
-        try:
-            san_pham_filter_id = int(san_pham_filter)
-            ton_kho_query = ton_kho_query.filter(san_pham_id=san_pham_filter_id)
-            print(f"Filtering by product: {san_pham_filter_id}")
-        except (ValueError, TypeError):
-            print(f"Invalid product filter: {san_pham_filter}")
-
-    # Sắp xếp
-    ton_kho_query = ton_kho_query.order_by('kho__ten_kho', 'san_pham__ten_san_pham')
-
-    # Debug: đếm số lượng
-    total_records = ton_kho_query.count()
-    print(f"Total records: {total_records}")
-
-    # Đếm theo từng kho
-    for kho in danh_sach_kho:
-        count = ton_kho_query.filter(kho=kho).count()
-        if count > 0:
-            print(f"Warehouse '{kho.ten_kho}' (ID={kho.id}): {count} products")
+    def tinh():
+        page = Paginator(ton_kho_query, TON_KHO_MOI_TRANG).get_page(so_trang)
+        return {
+            'ton_kho': list(page.object_list),
+            'trang': {'trang': page.number, 'so_trang': page.paginator.num_pages},
+            'total_records': page.paginator.count,
+            'total_quantity': ton_kho_query.aggregate(total=Sum('so_luong_ton'))['total'] or 0,
+        }
+
+    # Trang và tổng chỉ đổi khi tồn kho/sản phẩm/kho thay đổi -> đệm theo phiên bản dữ liệu
+    so_lieu = BoNhoDem.lay_hoac_tinh(
+        'chi_tiet_ton_kho',
+        ['ton_kho', 'san_pham', 'kho'],
+        tinh,
+        tham_so=(kho_dang_loc, san_pham_filter, so_trang),
+    )
+    total_quantity = so_lieu['total_quantity']
+    total_records = so_lieu['total_records']
 
-    print("=== END DEBUG ===\n")
+    san_pham_dang_loc = None
+    if san_pham_filter.isdigit():
+        san_pham_dang_loc = SanPham.objects.filter(pk=san_pham_filter).only(
+            'id', 'ma_san_pham', 'ten_san_pham'
+        ).first()
 
-    # Thống kê
-    total_quantity = ton_kho_query.aggregate(
-        total=Sum('so_luong_ton')
-    )['total'] or 0
+    # Tham số cho liên kết xuất file (giữ nguyên bộ lọc đang xem)
+    export_params = QueryDict(mutable=True)
+    if kho_dang_loc:
+        export_params['kho'] = kho_dang_loc
+    if san_pham_filter:
+        export_params['san_pham'] = san_pham_filter
 
     context = {
         'danh_sach_kho': danh_sach_kho,
-        'danh_sach_san_pham': danh_sach_san_pham,
-        'ton_kho': ton_kho_query,
+        'san_pham_dang_loc': san_pham_dang_loc,
+        'ton_kho': so_lieu['ton_kho'],
+        'trang': so_lieu['trang'],
+        'tham_so_loc': tham_so_loc(request),
         'selected_kho': kho_filter,
         'selected_san_pham': san_pham_filter,
         'total_quantity': total_quantity,
         'total_records': total_records,
+        'export_query': export_params.urlencode(),
     }
 
     return render(request, 'inventory/chi_tiet_ton_kho.html', context)
+
+
+MA_TRAN_MOI_TRANG = 50
+MA_TRAN_TOI_DA_MOI_TRANG = 500
+
+
+@login_required
+def ma_tran_ton_kho(request, dinh_dang='html'):
+    """Ma trận tồn kho: một dòng mỗi sản phẩm, một cột mỗi kho đang hoạt động
+
+    Xoay TonKho bằng một truy vấn tổng có điều kiện, tổng dòng/cột tính trong SQL,
+    phân trang theo sản phẩm và đệm theo phiên bản dữ liệu tồn kho/sản phẩm/kho.
+    Tham số GET: q (mã/tên sản phẩm), danh_muc, page, moi_trang.
+    """
+    chuoi = request.GET.get('q', '').strip()
+    so_trang = request.GET.get('page', 1)
+    try:
+        danh_muc_id = int(request.GET['danh_muc']) if request.GET.get('danh_muc') else None
+        moi_trang = max(1, min(int(request.GET.get('moi_trang', MA_TRAN_MOI_TRANG)), MA_TRAN_TOI_DA_MOI_TRANG))
+    except ValueError:
+        if dinh_dang == 'json':
+            return JsonResponse({'loi': 'Tham số không hợp lệ'}, status=400)
+        # Trang HTML: báo lỗi và hiển thị với bộ lọc mặc định
+        messages.warning(request, 'Tham số lọc không hợp lệ, đang hiển thị theo bộ lọc mặc định.')
+        danh_muc_id, moi_trang = None, MA_TRAN_MOI_TRANG
+
+    def tinh():
+        danh_sach_kho = list(
+            Kho.objects.filter(trang_thai='dang_hoat_dong').order_by('ma_kho').values('id', 'ma_kho', 'ten_kho')
+        )
+        kho_ids = [kho['id'] for kho in danh_sach_kho]
+        ton_kho = TonKho.objects.all()
+        if chuoi:
+            ton_kho = ton_kho.filter(
+                Q(san_pham__ma_san_pham__icontains=chuoi) | Q(san_pham__ten_san_pham__icontains=chuoi)
+            )
+        if danh_muc_id:
+            ton_kho = ton_kho.filter(san_pham__danh_muc_id=danh_muc_id)
+
+        dong, tong_theo_kho = QuanLyTonKho.ma_tran(kho_ids, ton_kho)
+        page = Paginator(dong, moi_trang).get_page(so_trang)
+        return {
+            'kho': danh_sach_kho,
+            'dong': [
+                {
+                    'san_pham_id': d['san_pham_id'],
+                    'ma_san_pham': d['san_pham__ma_san_pham'],
+                    'ten_san_pham': d['san_pham__ten_san_pham'],
+                    'ton': [d[f'kho_{kho_id}'] for kho_id in kho_ids],
+                    'tong': d['tong'],
+                }
+                for d in page.object_list
+            ],
+            'tong_theo_kho': [tong_theo_kho[f'kho_{kho_id}'] for kho_id in kho_ids],
+            'tong': tong_theo_kho['tong'],
+            'trang': {
+                'trang': page.number,
+                'so_trang': page.paginator.num_pages,
+                'tong_so_dong': page.paginator.count,
+            },
+        }
+
+    so_lieu = BoNhoDem.lay_hoac_tinh(
+        'ma_tran_ton_kho',
+        ['ton_kho', 'san_pham', 'kho'],
+        tinh,
+        tham_so=(chuoi, danh_muc_id, so_trang, moi_trang),
+    )
+
+    if dinh_dang == 'json':
+        return JsonResponse(so_lieu, json_dumps_params={'ensure_ascii': False})
+
+    context = {
+        **so_lieu,
+        'danh_sach_danh_muc': DanhMucSanPham.objects.order_by('ten_danh_muc').only('id', 'ten_danh_muc'),
+        'selected_q': chuoi,
+        'selected_danh_muc': danh_muc_id,
+        'moi_trang': moi_trang,
+        'tham_so_loc': tham_so_loc(request),
+    }
+    return render(request, 'inventory/ma_tran_ton_kho.html', context)
+
+
+SAP_HET_MOI_TRANG = 50
+SAP_HET_TOI_DA_MOI_TRANG = 500
+
+
+@login_required
+def ton_kho_sap_het(request, kho_id=None, san_pham_id=None):
+    """Danh sách dòng tồn kho sắp hết (JSON, phân trang) theo kho hoặc theo sản phẩm
+
+    Lọc trên cờ sap_het nên chỉ đọc index riêng phần tonkho_sap_het_*, không quét cả bảng.
+    Tham số GET: kho, san_pham (khi không có trong URL), page, moi_trang.
+    """
+    kho_id = kho_id or request.GET.get('kho') or None
+    san_pham_id = san_pham_id or request.GET.get('san_pham') or None
+    try:
+        moi_trang = min(int(request.GET.get('moi_trang', SAP_HET_MOI_TRANG)), SAP_HET_TOI_DA_MOI_TRANG)
+        kho_id = int(kho_id) if kho_id else None
+        san_pham_id = int(san_pham_id) if san_pham_id else None
+    except ValueError:
+        return JsonResponse({'loi': 'Tham số không hợp lệ'}, status=400)
+
+    ton_kho = TonKho.objects.filter(sap_het=True)
+    if kho_id:
+        ton_kho = ton_kho.filter(kho_id=kho_id)
+    if san_pham_id:
+        ton_kho = ton_kho.filter(san_pham_id=san_pham_id)
+
+    page = Paginator(
+        ton_kho.order_by('so_luong_ton', 'kho_id', 'san_pham_id').values(
+            'kho_id', 'kho__ten_kho', 'san_pham_id', 'san_pham__ma_san_pham', 'san_pham__ten_san_pham',
+            'so_luong_ton', 'so_luong_kha_dung', 'muc_toi_thieu'
+        ),
+        max(moi_trang, 1)
+    ).get_page(request.GET.get('page'))
+
+    return JsonResponse({
+        'dong': [
+            {
+                'kho_id': dong['kho_id'],
+                'kho': dong['kho__ten_kho'],
+                'san_pham_id': dong['san_pham_id'],
+                'ma_san_pham': dong['san_pham__ma_san_pham'],
+                'ten_san_pham': dong['san_pham__ten_san_pham'],
+                'so_luong_ton': dong['so_luong_ton'],
+                'so_luong_kha_dung': dong['so_luong_kha_dung'],
+                'muc_toi_thieu': dong['muc_toi_thieu'],
+                'can_bo_sung': dong['muc_toi_thieu'] - dong['so_luong_ton'],
+            }
+            for dong in page.object_list
+        ],
+        'trang': page.number,
+        'so_trang': page.paginator.num_pages,
+        'tong_so_dong': page.paginator.count,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+@login_required
+def tim_kiem_chung_tu(request):
+    """Tìm phiếu nhập/chuyển kho/kiểm kê, kết quả xếp hạng bm25 (JSON)
+
+    Tham số GET: q, loai (nhap | xuat | kiem_ke, tùy chọn), gioi_han (tối đa 100).
+    """
+    chuoi = request.GET.get('q', '').strip()
+    loai = request.GET.get('loai') or None
+    if loai is not None and loai not in ('nhap', 'xuat', 'kiem_ke'):
+        return JsonResponse({'loi': 'Loại chứng từ không hợp lệ'}, status=400)
+    try:
+        gioi_han = max(1, min(int(request.GET.get('gioi_han', 20)), 100))
+    except ValueError:
+        return JsonResponse({'loi': 'Tham số không hợp lệ'}, status=400)
+
+    ket_qua = TimKiemChungTu.tim(chuoi, loai, gioi_han)
+    xep_hang = ket_qua is not None
+    if ket_qua is None:
+        # Không có FTS: tìm theo mã chứng từ, mới nhất trước, không xếp hạng
+        ket_qua = []
+        nguon = {
+            'nhap': (NhapKho, 'ma_phieu', '-ngay_nhap'),
+            'xuat': (XuatKho, 'ma_phieu', '-ngay_xuat'),
+            'kiem_ke': (KiemKe, 'ma_kiem_ke', '-ngay_kiem_ke'),
+        }
+        for ten, (model, truong_ma, sap_xep) in nguon.items():
+            if chuoi and (loai is None or loai == ten):
+                ket_qua += [
+                    {'loai': ten, 'id': id_, 'ma': ma, 'trich_doan': '', 'diem': None}
+                    for id_, ma in model.objects.filter(**{f'{truong_ma}__icontains': chuoi})
+                    .order_by(sap_xep).values_list('id', truong_ma)[:gioi_han]
+                ]
+        ket_qua = ket_qua[:gioi_han]
+
+    return JsonResponse(
+        {'q': chuoi, 'xep_hang': xep_hang, 'ket_qua': ket_qua},
+        json_dumps_params={'ensure_ascii': False}
+    )
+
+
+@login_required
+def thong_ke_bo_nho_dem(request):
+    """Số lần hit/miss của bộ nhớ đệm dashboard/báo cáo trong tiến trình hiện tại"""
+    if request.GET.get('dat_lai') and request.user.is_staff:
+        BoNhoDem.dat_lai_thong_ke()
+    return JsonResponse({'khoi': BoNhoDem.thong_ke()})
+
+
+# Cột của file xuất tồn kho: (tiêu đề, trường trong .values_list())
+COT_XUAT_TON_KHO = [
+    ('Mã kho', 'kho__ma_kho'),
+    ('Tên kho', 'kho__ten_kho'),
+    ('Mã sản phẩm', 'san_pham__ma_san_pham'),
+    ('Tên sản phẩm', 'san_pham__ten_san_pham'),
+    ('Danh mục', 'san_pham__danh_muc__ten_danh_muc'),
+    ('Đơn vị tính', 'san_pham__don_vi_tinh__ten_don_vi'),
+    ('Số lượng tồn', 'so_luong_ton'),
+    ('Số lượng khả dụng', 'so_luong_kha_dung'),
+]
+KICH_THUOC_KHOI_XUAT = 2000
+
+
+def _dong_xuat_ton_kho(request):
+    """Duyệt tồn kho theo khối bằng .values_list().iterator() để bộ nhớ không tăng theo số dòng"""
+    ton_kho_query, _ = _loc_ton_kho(request)
+    return ton_kho_query.values_list(*[truong for _, truong in COT_XUAT_TON_KHO]).iterator(
+        chunk_size=KICH_THUOC_KHOI_XUAT
+    )
+
+
+class _BoDemGhi:
+    """Đối tượng giả file: csv.writer ghi vào thì trả lại chuỗi để stream ngay"""
+
+    def write(self, value):
+        return value
+
+
+@login_required
+def xuat_ton_kho_csv(request):
+    """Xuất tồn kho ra CSV dạng stream"""
+    writer = csv.writer(_BoDemGhi())
+
+    def noi_dung():
+        yield '\ufeff'  # BOM để Excel nhận đúng UTF-8
+        yield writer.writerow([tieu_de for tieu_de, _ in COT_XUAT_TON_KHO])
+        for dong in _dong_xuat_ton_kho(request):
+            yield writer.writerow(dong)
+
+    response = StreamingHttpResponse(noi_dung(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="ton_kho_{timezone.now():%Y%m%d_%H%M}.csv"'
+    return response
+
+
+@login_required
+def xuat_ton_kho_xlsx(request):
+    """Xuất tồn kho ra XLSX bằng chế độ write-only của openpyxl"""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        messages.error(request, 'Chưa cài đặt openpyxl nên không thể xuất Excel. Vui lòng dùng xuất CSV.')
+        return redirect('inventory:chi_tiet_ton_kho')
+
+    # write-only: từng dòng được ghi thẳng ra file tạm, không giữ cả bảng tính trong bộ nhớ
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Tồn kho')
+    sheet.append([tieu_de for tieu_de, _ in COT_XUAT_TON_KHO])
+    for dong in _dong_xuat_ton_kho(request):
+        sheet.append(dong)
+
+    tep_tam = tempfile.TemporaryFile()
+    workbook.save(tep_tam)
+    tep_tam.seek(0)
+
+    return FileResponse(
+        tep_tam,
+        as_attachment=True,
+        filename=f'ton_kho_{timezone.now():%Y%m%d_%H%M}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
 #  API & UTILITIES
 def kiem_tra_ton_kho_api(request, kho_id, san_pham_id):
     """API kiểm tra tồn kho"""
@@ -716,6 +997,71 @@ def kiem_tra_ton_kho_api(request, kho_id, san_pham_id):
         })
 
 
+TON_KHO_API_TOI_DA_SAN_PHAM = 5000
+# Số cặp (sản phẩm, kho) tối đa một lần gọi - giới hạn kích thước phản hồi dựng trong bộ nhớ
+TON_KHO_API_TOI_DA_CAP = 50000
+
+
+def _doc_danh_sach(gia_tri):
+    """'1,2,3' hoặc ['1', '2'] hoặc [1, 2] -> danh sách chuỗi không rỗng"""
+    if isinstance(gia_tri, str):
+        gia_tri = gia_tri.split(',')
+    return [str(x).strip() for x in gia_tri or [] if str(x).strip()]
+
+
+@login_required
+def ton_kho_hang_loat_api(request):
+    """API tồn kho hàng loạt cho nhiều sản phẩm x nhiều kho (một truy vấn TonKho)
+
+    GET: ?san_pham=1,2,3&ma=SP01,SP02&kho=1,2 (tham số có thể lặp lại)
+    POST: JSON {"san_pham": [...], "ma": [...], "kho": [...]} cho danh sách dài.
+    Kết quả dạng cột để gọn: dong = [[kho_id, san_pham_id, ton, kha_dung], ...],
+    tong = {san_pham_id: [ton, kha_dung]} trên toàn hệ thống.
+    """
+    if request.method == 'POST':
+        try:
+            du_lieu = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'JSON không hợp lệ'}, status=400)
+        if not isinstance(du_lieu, dict) or any(
+            not isinstance(du_lieu.get(k), (list, str, type(None))) for k in ('san_pham', 'ma', 'kho')
+        ):
+            return JsonResponse({'success': False, 'error': 'JSON không hợp lệ'}, status=400)
+        san_pham, ma, kho = (_doc_danh_sach(du_lieu.get(k)) for k in ('san_pham', 'ma', 'kho'))
+    else:
+        san_pham, ma, kho = (
+            [x for gia_tri in request.GET.getlist(k) for x in _doc_danh_sach(gia_tri)]
+            for k in ('san_pham', 'ma', 'kho')
+        )
+
+    try:
+        san_pham_ids = [int(x) for x in san_pham]
+        kho_ids = [int(x) for x in kho]
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Mã sản phẩm/kho phải là số nguyên'}, status=400)
+    so_san_pham = len(set(san_pham_ids)) + len(set(ma))
+    if so_san_pham > TON_KHO_API_TOI_DA_SAN_PHAM:
+        return JsonResponse({
+            'success': False, 'error': f'Tối đa {TON_KHO_API_TOI_DA_SAN_PHAM} sản phẩm mỗi lần gọi'
+        }, status=400)
+    # Không chỉ định kho nghĩa là mọi kho
+    if so_san_pham and so_san_pham * (len(set(kho_ids)) or Kho.objects.count()) > TON_KHO_API_TOI_DA_CAP:
+        return JsonResponse({
+            'success': False,
+            'error': f'Tối đa {TON_KHO_API_TOI_DA_CAP} cặp sản phẩm x kho mỗi lần gọi, hãy chia nhỏ danh sách'
+        }, status=400)
+
+    ket_qua = QuanLyTonKho.kha_dung_hang_loat(san_pham_ids, ma, kho_ids)
+    return JsonResponse({
+        'success': True,
+        'cot': ['kho_id', 'san_pham_id', 'so_luong_ton', 'so_luong_kha_dung'],
+        'dong': ket_qua['dong'],
+        'tong': ket_qua['tong'],
+        'ma': ket_qua['ma'],
+        'khong_co_ton': ket_qua['khong_co_ton'],
+    }, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
 def get_danh_sach_kho_api(request):
     """API lấy danh sách kho"""
     try:
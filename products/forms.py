@@ -41,4 +41,15 @@ class SanPhamForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['danh_muc'].queryset = DanhMucSanPham.objects.all().order_by('ten_danh_muc')
-        self.fields['don_vi_tinh'].queryset = DonViTinh.objects.all().order_by('ten_don_vi')
\ No newline at end of file
+        self.fields['don_vi_tinh'].queryset = DonViTinh.objects.all().order_by('ten_don_vi')
+
+class NhapSanPhamForm(forms.Form):
+    tep = forms.FileField(
+        label='File sản phẩm',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'})
+    )
+    tao_danh_muc = forms.BooleanField(
+        label='Tự tạo danh mục/đơn vị tính chưa có',
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.services import NhapSanPhamHangLoat, doc_tep_san_pham
+
+
+class Command(BaseCommand):
+    help = 'Nhập/cập nhật danh mục sản phẩm hàng loạt từ file CSV hoặc XLSX (upsert theo mã sản phẩm)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('duong_dan', help='Đường dẫn file .csv hoặc .xlsx')
+        parser.add_argument(
+            '--kich-thuoc-lo', type=int, default=NhapSanPhamHangLoat.KICH_THUOC_LO,
+            help='Số sản phẩm ghi trong một lô'
+        )
+        parser.add_argument(
+            '--tao-danh-muc', action='store_true',
+            help='Tự tạo danh mục/đơn vị tính chưa có thay vì báo lỗi dòng'
+        )
+        parser.add_argument(
+            '--so-loi-hien-thi', type=int, default=50,
+            help='Số dòng lỗi in ra cuối quá trình'
+        )
+
+    def handle(self, *args, **options):
+        def tien_do(ket_qua):
+            self.stdout.write(
+                f'  Đã xử lý {ket_qua.so_dong} dòng '
+                f'({ket_qua.toc_do:.0f} dòng/giây, {ket_qua.so_loi} lỗi)'
+            )
+
+        try:
+            tep = open(options['duong_dan'], 'rb')
+        except OSError as e:
+            raise CommandError(f'Không mở được file: {e}')
+
+        with tep:
+            bo_nhap = NhapSanPhamHangLoat(
+                kich_thuoc_lo=options['kich_thuoc_lo'],
+                tao_danh_muc_moi=options['tao_danh_muc'],
+                tien_do=tien_do,
+            )
+            # Bộ đọc CSV/XLSX là generator: lỗi đọc file chỉ xuất hiện khi nhap() duyệt các dòng
+            try:
+                ket_qua = bo_nhap.nhap(doc_tep_san_pham(tep, options['duong_dan']))
+            except ImportError:
+                raise CommandError('Chưa cài đặt openpyxl nên không đọc được file Excel. Vui lòng dùng CSV.')
+            except (ValueError, UnicodeDecodeError) as e:
+                raise CommandError(f'Không đọc được file: {e}')
+
+        for so_dong, ly_do in ket_qua.loi[:options['so_loi_hien_thi']]:
+            self.stderr.write(f'  Dòng {so_dong}: {ly_do}')
+        if ket_qua.so_loi > options['so_loi_hien_thi']:
+            self.stderr.write(f'  ... và {ket_qua.so_loi - options["so_loi_hien_thi"]} lỗi khác')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Hoàn tất {ket_qua.so_dong} dòng trong {ket_qua.thoi_gian:.1f} giây '
+            f'({ket_qua.toc_do:.0f} dòng/giây): {ket_qua.tao_moi} tạo mới, '
+            f'{ket_qua.cap_nhat} cập nhật, {ket_qua.so_loi} lỗi.'
+        ))
@@ -0,0 +1,356 @@
+import bisect
+import csv
+import io
+import threading
+import time
+import unicodedata
+import zipfile
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, transaction
+
+from inventory.cache import BoNhoDem
+from inventory.services import QuanLyTonKho
+from .models import SanPham, DanhMucSanPham, DonViTinh
+
+
+# Các cột được nhận trong file nhập (tiêu đề so khớp không phân biệt hoa thường)
+COT_BAT_BUOC = ['ma_san_pham', 'ten_san_pham', 'danh_muc', 'don_vi_tinh', 'gia_nhap', 'gia_ban']
+COT_TUY_CHON = ['so_luong_toi_thieu', 'mo_ta', 'trang_thai']
+TRUONG_CAP_NHAT = [
+    'ten_san_pham', 'danh_muc', 'don_vi_tinh', 'gia_nhap', 'gia_ban',
+    'so_luong_toi_thieu', 'mo_ta', 'trang_thai'
+]
+# Giới hạn của PositiveIntegerField trên mọi backend Django hỗ trợ
+SO_LUONG_TOI_DA = 2147483647
+GIA_TRI_SAI = {'0', 'false', 'khong', 'không', 'ngung', 'ngừng', 'no'}
+
+
+def doc_csv(tep):
+    """Đọc file CSV (nhị phân hoặc văn bản) thành từng dict, không nạp cả file vào bộ nhớ"""
+    if isinstance(tep, (io.TextIOBase, io.StringIO)):
+        van_ban = tep
+    else:
+        van_ban = io.TextIOWrapper(tep, encoding='utf-8-sig', newline='')
+    yield from csv.DictReader(van_ban)
+
+
+def doc_xlsx(tep):
+    """Đọc sheet đầu tiên của file XLSX ở chế độ read-only của openpyxl"""
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        workbook = load_workbook(tep, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ValueError('File không phải là file Excel .xlsx hợp lệ')
+    try:
+        cac_dong = workbook.worksheets[0].iter_rows(values_only=True)
+        tieu_de = next(cac_dong, None) or []
+        tieu_de = ['' if o is None else str(o) for o in tieu_de]
+        for dong in cac_dong:
+            yield dict(zip(tieu_de, ('' if o is None else o for o in dong)))
+    finally:
+        workbook.close()
+
+
+def doc_tep_san_pham(tep, ten_tep):
+    """Chọn bộ đọc theo phần mở rộng của file"""
+    if ten_tep.lower().endswith('.xlsx'):
+        return doc_xlsx(tep)
+    if ten_tep.lower().endswith('.csv'):
+        return doc_csv(tep)
+    raise ValueError('Chỉ hỗ trợ file .csv hoặc .xlsx')
+
+
+class KetQuaNhapSanPham:
+    """Tổng hợp kết quả một lần nhập danh mục sản phẩm"""
+
+    SO_LOI_TOI_DA = 1000
+
+    def __init__(self):
+        self.so_dong = 0
+        self.tao_moi = 0
+        self.cap_nhat = 0
+        self.so_loi = 0
+        self.loi = []  # [(số dòng, lý do)], chỉ giữ SO_LOI_TOI_DA lỗi đầu tiên
+        self.bat_dau = time.monotonic()
+
+    def them_loi(self, so_dong, ly_do):
+        self.so_loi += 1
+        if len(self.loi) < self.SO_LOI_TOI_DA:
+            self.loi.append((so_dong, ly_do))
+
+    @property
+    def thoi_gian(self):
+        return time.monotonic() - self.bat_dau
+
+    @property
+    def toc_do(self):
+        """Số dòng xử lý mỗi giây"""
+        return self.so_dong / self.thoi_gian if self.thoi_gian else 0
+
+
+class NhapSanPhamHangLoat:
+    """Nhập/cập nhật sản phẩm hàng loạt theo mã sản phẩm
+
+    Danh mục và đơn vị tính được tra bằng tên qua bảng tra trong bộ nhớ nạp một lần;
+    các dòng hợp lệ được upsert theo lô bằng bulk_create(update_conflicts=True).
+    Dòng lỗi bị bỏ qua và ghi vào kết quả, không làm dừng cả lô.
+    """
+
+    KICH_THUOC_LO = 1000
+
+    def __init__(self, kich_thuoc_lo=None, tao_danh_muc_moi=False, tien_do=None):
+        self.kich_thuoc_lo = kich_thuoc_lo or self.KICH_THUOC_LO
+        self.tao_danh_muc_moi = tao_danh_muc_moi
+        self.tien_do = tien_do
+        self.danh_muc = self._nap_bang_tra(DanhMucSanPham, 'ten_danh_muc')
+        self.don_vi_tinh = self._nap_bang_tra(DonViTinh, 'ten_don_vi')
+
+    @staticmethod
+    def _chuan_hoa(ten):
+        return ' '.join(str(ten).split()).lower()
+
+    @classmethod
+    def _nap_bang_tra(cls, model, truong_ten):
+        """{tên chuẩn hóa: id}; tên trùng thì lấy bản ghi tạo trước"""
+        bang_tra = {}
+        for id_, ten in model.objects.order_by('-id').values_list('id', truong_ten).iterator():
+            bang_tra[cls._chuan_hoa(ten)] = id_
+        return bang_tra
+
+    def _tra_id(self, bang_tra, model, truong_ten, ten):
+        khoa = self._chuan_hoa(ten)
+        if khoa in bang_tra:
+            return bang_tra[khoa]
+        if not self.tao_danh_muc_moi:
+            return None
+        bang_tra[khoa] = model.objects.create(**{truong_ten: ' '.join(str(ten).split())}).id
+        return bang_tra[khoa]
+
+    @staticmethod
+    def _so_thap_phan(gia_tri, ten_cot):
+        try:
+            so = Decimal(str(gia_tri).replace(',', '').strip())
+        except InvalidOperation:
+            raise ValueError(f'{ten_cot} "{gia_tri}" không phải là số')
+        if not so.is_finite() or so < 0:
+            raise ValueError(f'{ten_cot} phải là số không âm')
+        if so.as_tuple().exponent < -2 or abs(so) >= Decimal('1e13'):
+            raise ValueError(f'{ten_cot} vượt quá độ chính xác cho phép')
+        return so
+
+    def _tao_doi_tuong(self, dong):
+        """Kiểm tra một dòng và dựng SanPham chưa lưu; lỗi thì ném ValueError"""
+        dong = {self._chuan_hoa(k): ('' if v is None else v) for k, v in dong.items() if k}
+
+        thieu = [cot for cot in COT_BAT_BUOC if str(dong.get(cot, '')).strip() == '']
+        if thieu:
+            raise ValueError(f'Thiếu giá trị: {", ".join(thieu)}')
+
+        ma_san_pham = str(dong['ma_san_pham']).strip()
+        ten_san_pham = str(dong['ten_san_pham']).strip()
+        if len(ma_san_pham) > 50:
+            raise ValueError('Mã sản phẩm dài quá 50 ký tự')
+        if len(ten_san_pham) > 200:
+            raise ValueError('Tên sản phẩm dài quá 200 ký tự')
+
+        danh_muc_id = self._tra_id(self.danh_muc, DanhMucSanPham, 'ten_danh_muc', dong['danh_muc'])
+        if danh_muc_id is None:
+            raise ValueError(f'Không tìm thấy danh mục "{dong["danh_muc"]}"')
+        don_vi_tinh_id = self._tra_id(self.don_vi_tinh, DonViTinh, 'ten_don_vi', dong['don_vi_tinh'])
+        if don_vi_tinh_id is None:
+            raise ValueError(f'Không tìm thấy đơn vị tính "{dong["don_vi_tinh"]}"')
+
+        so_luong_toi_thieu = str(dong.get('so_luong_toi_thieu', '')).strip()
+        if so_luong_toi_thieu:
+            try:
+                so_luong_toi_thieu = int(Decimal(so_luong_toi_thieu))
+            except (InvalidOperation, ValueError, OverflowError):
+                # int() của NaN ném ValueError, của Infinity ném OverflowError
+                raise ValueError(f'Số lượng tối thiểu "{so_luong_toi_thieu}" không hợp lệ')
+            if so_luong_toi_thieu < 0:
+                raise ValueError('Số lượng tối thiểu không được âm')
+            if so_luong_toi_thieu > SO_LUONG_TOI_DA:
+                raise ValueError('Số lượng tối thiểu vượt quá giới hạn cho phép')
+        else:
+            so_luong_toi_thieu = 10
+
+        trang_thai = str(dong.get('trang_thai', '')).strip().lower()
+
+        return SanPham(
+            ma_san_pham=ma_san_pham,
+            ten_san_pham=ten_san_pham,
+            danh_muc_id=danh_muc_id,
+            don_vi_tinh_id=don_vi_tinh_id,
+            gia_nhap=self._so_thap_phan(dong['gia_nhap'], 'Giá nhập'),
+            gia_ban=self._so_thap_phan(dong['gia_ban'], 'Giá bán'),
+            so_luong_toi_thieu=so_luong_toi_thieu,
+            mo_ta=str(dong.get('mo_ta', '')).strip() or None,
+            trang_thai=trang_thai not in GIA_TRI_SAI,
+        )
+
+    def _ghi_lo(self, lo, ket_qua):
+        """Upsert một lô {mã: (số dòng, SanPham)}; lô lỗi thì ghi lại từng dòng để tách dòng hỏng"""
+        da_co = set(
+            SanPham.objects.filter(ma_san_pham__in=list(lo)).values_list('ma_san_pham', flat=True)
+        )
+        try:
+            with transaction.atomic():
+                SanPham.objects.bulk_create(
+                    [sp for _, sp in lo.values()],
+                    update_conflicts=True,
+                    unique_fields=['ma_san_pham'],
+                    update_fields=TRUONG_CAP_NHAT,
+                )
+        except DatabaseError:
+            for ma, (so_dong, sp) in lo.items():
+                try:
+                    with transaction.atomic():
+                        SanPham.objects.bulk_create(
+                            [sp],
+                            update_conflicts=True,
+                            unique_fields=['ma_san_pham'],
+                            update_fields=TRUONG_CAP_NHAT,
+                        )
+                except DatabaseError as e:
+                    ket_qua.them_loi(so_dong, f'Lỗi ghi CSDL: {e}')
+                    da_co.discard(ma)
+                    lo[ma] = None
+            lo = {ma: gia_tri for ma, gia_tri in lo.items() if gia_tri is not None}
+
+        ket_qua.cap_nhat += len(da_co)
+        ket_qua.tao_moi += len(lo) - len(da_co)
+        # bulk_create không phát tín hiệu post_save: tự đồng bộ mức tối thiểu sang TonKho
+        if da_co:
+            QuanLyTonKho.cap_nhat_muc_toi_thieu(
+                SanPham.objects.filter(ma_san_pham__in=da_co).values('id')
+            )
+        BoNhoDem.tang_phien_ban('san_pham')
+
+    def nhap(self, cac_dong):
+        """Nhập từ một iterable các dict (mỗi dict là một dòng, dòng 1 là tiêu đề)"""
+        ket_qua = KetQuaNhapSanPham()
+        lo = {}
+
+        for so_dong, dong in enumerate(cac_dong, start=2):
+            ket_qua.so_dong += 1
+            if not any(str(v).strip() for v in dong.values() if v is not None):
+                ket_qua.so_dong -= 1
+                continue
+            try:
+                san_pham = self._tao_doi_tuong(dong)
+            except ValueError as e:
+                ket_qua.them_loi(so_dong, str(e))
+                continue
+
+            # Mã lặp lại trong cùng lô: dòng sau ghi đè dòng trước
+            lo[san_pham.ma_san_pham] = (so_dong, san_pham)
+            if len(lo) >= self.kich_thuoc_lo:
+                self._ghi_lo(lo, ket_qua)
+                lo = {}
+                if self.tien_do:
+                    self.tien_do(ket_qua)
+
+        if lo:
+            self._ghi_lo(lo, ket_qua)
+        if self.tien_do:
+            self.tien_do(ket_qua)
+        return ket_qua
+
+
+def _bang_bo_dau():
+    """Bảng str.translate: chữ Latin có dấu (U+00C0-U+024F, U+1E00-U+1EFF) -> chữ không dấu"""
+    bang = {ord('đ'): 'd', ord('Đ'): 'D'}
+    for ma in list(range(0xC0, 0x250)) + list(range(0x1E00, 0x1F00)):
+        ky_tu = chr(ma)
+        goc = ''.join(c for c in unicodedata.normalize('NFD', ky_tu) if not unicodedata.combining(c))
+        if goc != ky_tu and goc.isascii():
+            bang[ma] = goc
+    return bang
+
+
+BANG_BO_DAU = _bang_bo_dau()
+
+
+def chuan_hoa_tim_kiem(chuoi):
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ) và gộp khoảng trắng - dùng làm khóa tìm theo tiền tố"""
+    return ' '.join(str(chuoi).lower().translate(BANG_BO_DAU).split())
+
+
+class ChiMucSanPham:
+    """Chỉ mục tiền tố trong bộ nhớ tiến trình cho ô gợi ý sản phẩm
+
+    Giữ ba danh sách khóa đã sắp xếp (mã, tên, phần tên bắt đầu từ mỗi từ; đều đã chuẩn hóa),
+    tìm tiền tố bằng bisect nên không chạm CSDL. Chỉ mục được dựng lại khi phiên bản nhóm
+    'san_pham' trong BoNhoDem đổi (lưu/xóa sản phẩm, danh mục, đơn vị tính, nhập hàng loạt).
+    """
+
+    GIOI_HAN_TOI_DA = 50
+
+    _khoa = threading.Lock()
+    _phien_ban = None
+    # Theo thứ tự ưu tiên kết quả: khớp mã, khớp đầu tên, khớp đầu một từ trong tên.
+    # Mỗi danh sách gồm (khóa chuẩn hóa, id) đã sắp xếp.
+    _cac_muc = ([], [], [])
+    _san_pham = {}  # id -> (id, mã, tên, danh mục, đơn vị tính, giá nhập)
+
+    @classmethod
+    def _dung(cls, phien_ban):
+        theo_ma, theo_ten, theo_tu = [], [], []
+        san_pham = {}
+        for dong in SanPham.objects.filter(trang_thai=True).values_list(
+            'id', 'ma_san_pham', 'ten_san_pham', 'danh_muc__ten_danh_muc', 'don_vi_tinh__ten_don_vi', 'gia_nhap'
+        ).iterator(chunk_size=5000):
+            id_, ma, ten_goc = dong[0], dong[1], dong[2]
+            san_pham[id_] = dong
+            ten = chuan_hoa_tim_kiem(ten_goc)
+            theo_ma.append((chuan_hoa_tim_kiem(ma), id_))
+            theo_ten.append((ten, id_))
+            tu = ten.split(' ')
+            for vi_tri in range(1, len(tu)):
+                theo_tu.append((' '.join(tu[vi_tri:]), id_))
+        for danh_sach in (theo_ma, theo_ten, theo_tu):
+            danh_sach.sort()
+        cls._cac_muc, cls._san_pham, cls._phien_ban = (theo_ma, theo_ten, theo_tu), san_pham, phien_ban
+
+    @staticmethod
+    def _thanh_dict(dong):
+        id_, ma, ten, danh_muc, don_vi_tinh, gia_nhap = dong
+        return {
+            'id': id_, 'ma': ma, 'ten': ten, 'danh_muc': danh_muc,
+            'don_vi_tinh': don_vi_tinh, 'gia_nhap': str(gia_nhap),
+        }
+
+    @classmethod
+    def _dam_bao_moi(cls):
+        phien_ban = BoNhoDem.phien_ban('san_pham')
+        if cls._phien_ban != phien_ban:
+            with cls._khoa:
+                if cls._phien_ban != phien_ban:
+                    cls._dung(phien_ban)
+        return cls._cac_muc, cls._san_pham
+
+    @classmethod
+    def tim(cls, tien_to, gioi_han=10):
+        """Tối đa gioi_han sản phẩm đang kinh doanh có mã/tên (hoặc một từ trong tên) bắt đầu bằng tien_to"""
+        tien_to = chuan_hoa_tim_kiem(tien_to)
+        if not tien_to:
+            return []
+        gioi_han = max(1, min(gioi_han, cls.GIOI_HAN_TOI_DA))
+        cac_muc, san_pham = cls._dam_bao_moi()
+
+        ket_qua = []
+        da_co = set()
+        for danh_sach in cac_muc:
+            vi_tri = bisect.bisect_left(danh_sach, (tien_to,))
+            while vi_tri < len(danh_sach) and len(ket_qua) < gioi_han:
+                khoa, id_ = danh_sach[vi_tri]
+                if not khoa.startswith(tien_to):
+                    break
+                if id_ not in da_co:
+                    da_co.add(id_)
+                    ket_qua.append(cls._thanh_dict(san_pham[id_]))
+                vi_tri += 1
+        return ket_qua
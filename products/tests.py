@@ -1,3 +1,119 @@
+import os
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from inventory.models import Kho, TonKho
+from inventory.tests import tao_nguoi_dung
+from .models import SanPham, DanhMucSanPham, DonViTinh
+from .services import NhapSanPhamHangLoat, doc_csv, doc_xlsx
+
+TIEU_DE = 'ma_san_pham,ten_san_pham,danh_muc,don_vi_tinh,gia_nhap,gia_ban,so_luong_toi_thieu\n'
+
+
+class NhapSanPhamHangLoatTest(TestCase):
+    """Nhập danh mục sản phẩm: upsert theo mã, dòng lỗi không làm dừng cả lô"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.danh_muc = DanhMucSanPham.objects.create(ten_danh_muc='Điện tử')
+        cls.don_vi = DonViTinh.objects.create(ten_don_vi='Cái')
+        cls.san_pham = SanPham.objects.create(
+            danh_muc=cls.danh_muc, don_vi_tinh=cls.don_vi, ma_san_pham='SP-0001',
+            ten_san_pham='Tên cũ', gia_nhap=1000, gia_ban=2000, so_luong_toi_thieu=5,
+        )
+        cls.kho = Kho.objects.create(ma_kho='K1', ten_kho='Kho 1', dia_chi='HN')
+        TonKho.objects.create(kho=cls.kho, san_pham=cls.san_pham, so_luong_ton=8, so_luong_kha_dung=8,
+                              muc_toi_thieu=5)
+
+    def nhap(self, noi_dung):
+        return NhapSanPhamHangLoat().nhap(doc_csv(StringIO(TIEU_DE + noi_dung)))
+
+    def test_cap_nhat_ma_da_co_va_dong_bo_muc_toi_thieu(self):
+        ket_qua = self.nhap('SP-0001,Tên mới,điện  tử,CÁI,1500,2500,10\n')
+
+        self.assertEqual((ket_qua.tao_moi, ket_qua.cap_nhat, ket_qua.so_loi), (0, 1, 0))
+        self.assertEqual(SanPham.objects.count(), 1)
+        self.san_pham.refresh_from_db()
+        self.assertEqual(self.san_pham.ten_san_pham, 'Tên mới')
+        self.assertEqual(self.san_pham.gia_nhap, 1500)
+        self.assertEqual(self.san_pham.so_luong_toi_thieu, 10)
+        ton = TonKho.objects.get(kho=self.kho, san_pham=self.san_pham)
+        self.assertEqual(ton.muc_toi_thieu, 10)
+        self.assertTrue(ton.sap_het)
+
+    def test_dong_loi_bi_bo_qua_phan_con_lai_van_nhap(self):
+        ket_qua = self.nhap(
+            'SP-0002,Hợp lệ 1,Điện tử,Cái,100,200,\n'
+            'SP-0003,Danh mục lạ,Không có,Cái,100,200,\n'
+            'SP-0004,Vô hạn,Điện tử,Cái,100,200,Infinity\n'
+            'SP-0005,Không phải số,Điện tử,Cái,100,200,NaN\n'
+            'SP-0006,Quá lớn,Điện tử,Cái,100,200,1e20\n'
+            'SP-0007,Giá âm,Điện tử,Cái,-1,200,\n'
+            'SP-0008,Hợp lệ 2,Điện tử,Cái,100,200,3\n'
+        )
+
+        self.assertEqual((ket_qua.so_dong, ket_qua.tao_moi, ket_qua.so_loi), (7, 2, 5))
+        self.assertEqual([so_dong for so_dong, _ in ket_qua.loi], [3, 4, 5, 6, 7])
+        self.assertEqual(
+            sorted(SanPham.objects.values_list('ma_san_pham', flat=True)), ['SP-0001', 'SP-0002', 'SP-0008']
+        )
+        self.assertEqual(SanPham.objects.get(ma_san_pham='SP-0008').so_luong_toi_thieu, 3)
+
+    def test_file_xlsx_hong_bao_loi_doc_file(self):
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            self.skipTest('Chưa cài đặt openpyxl')
+        with self.assertRaisesMessage(ValueError, 'không phải là file Excel'):
+            list(doc_xlsx(BytesIO(b'ma_san_pham,ten_san_pham\n')))
+
+
+class ImportSanPhamCommandTest(TestCase):
+    """Lệnh import_san_pham báo lỗi đọc file bằng CommandError thay vì traceback"""
+
+    def chay(self, noi_dung, duoi):
+        with tempfile.NamedTemporaryFile(suffix=duoi, delete=False) as tep:
+            tep.write(noi_dung)
+        self.addCleanup(os.remove, tep.name)
+        call_command('import_san_pham', tep.name, stdout=StringIO(), stderr=StringIO())
+
+    def test_csv_khong_phai_utf8(self):
+        with self.assertRaisesMessage(CommandError, 'Không đọc được file'):
+            # 'Café' mã hóa latin-1: byte 0xe9 không hợp lệ trong UTF-8
+            self.chay(TIEU_DE.encode() + b'SP-0001,Caf\xe9,Danh muc,Cai,100,200,\n', '.csv')
+        self.assertFalse(SanPham.objects.exists())
+
+    def test_xlsx_hong(self):
+        # Thiếu openpyxl hay file hỏng đều phải là CommandError
+        with self.assertRaises(CommandError):
+            self.chay(b'khong phai zip', '.xlsx')
+
+    def test_sai_phan_mo_rong(self):
+        with self.assertRaisesMessage(CommandError, 'Chỉ hỗ trợ file .csv hoặc .xlsx'):
+            self.chay(b'', '.txt')
+
+
+class NhapSanPhamViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.nguoi_dung = tao_nguoi_dung('nv')
+
+    def test_file_xlsx_hong_hien_thong_bao_khong_loi_500(self):
+        self.client.force_login(self.nguoi_dung)
+        tep = SimpleUploadedFile('san_pham.xlsx', b'khong phai zip', content_type='application/octet-stream')
+
+        response = self.client.post(reverse('product_import'), {'tep': tep}, follow=True)
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 200)
+        thong_bao = [str(m) for m in response.context['messages']]
+        self.assertEqual(len(thong_bao), 1)
+        self.assertTrue(
+            thong_bao[0].startswith('Không đọc được file') or 'openpyxl' in thong_bao[0], thong_bao
+        )
+        self.assertFalse(SanPham.objects.exists())
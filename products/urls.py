@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('', views.product_list, name='product_list'),
     path('add/', views.product_create, name='product_create'),
+    path('import/', views.product_import, name='product_import'),
+    path('goi-y/', views.product_autocomplete, name='product_autocomplete'),
     path('<int:pk>/edit/', views.product_edit, name='product_edit'),
     path('<int:pk>/delete/', views.product_delete, name='product_delete'),
     path('categories/', views.category_list, name='category_list'),
@@ -1,8 +1,11 @@
 # views.py
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from .models import SanPham, DanhMucSanPham, DonViTinh  # ← Import model
-from .forms import SanPhamForm, DanhMucForm, DonViTinhForm
+from .forms import SanPhamForm, DanhMucForm, DonViTinhForm, NhapSanPhamForm
+from django.http import JsonResponse
+from .services import ChiMucSanPham, NhapSanPhamHangLoat, doc_tep_san_pham
 
 @login_required
 def product_list(request):
@@ -41,6 +44,55 @@ def product_delete(request, pk):
     return render(request, 'products/product_confirm_delete.html', {'product': product})
 
 
+@login_required
+def product_autocomplete(request):
+    """Gợi ý sản phẩm theo tiền tố mã/tên (JSON), đọc từ chỉ mục trong bộ nhớ"""
+    try:
+        gioi_han = int(request.GET.get('gioi_han', 10))
+    except ValueError:
+        gioi_han = 10
+    return JsonResponse(
+        {'ket_qua': ChiMucSanPham.tim(request.GET.get('q', ''), gioi_han)},
+        json_dumps_params={'ensure_ascii': False}
+    )
+
+
+@login_required
+def product_import(request):
+    """Nhập danh mục sản phẩm từ file CSV/XLSX, upsert theo mã sản phẩm"""
+    if request.method == 'POST':
+        form = NhapSanPhamForm(request.POST, request.FILES)
+        if form.is_valid():
+            tep = form.cleaned_data['tep']
+            try:
+                cac_dong = doc_tep_san_pham(tep.file, tep.name)
+                ket_qua = NhapSanPhamHangLoat(
+                    tao_danh_muc_moi=form.cleaned_data['tao_danh_muc']
+                ).nhap(cac_dong)
+            except ImportError:
+                messages.error(request, 'Chưa cài đặt openpyxl nên không đọc được file Excel. Vui lòng dùng CSV.')
+                return redirect('product_import')
+            except (ValueError, UnicodeDecodeError) as e:
+                messages.error(request, f'Không đọc được file: {e}')
+                return redirect('product_import')
+
+            messages.success(
+                request,
+                f'Đã xử lý {ket_qua.so_dong} dòng trong {ket_qua.thoi_gian:.1f} giây: '
+                f'{ket_qua.tao_moi} tạo mới, {ket_qua.cap_nhat} cập nhật, {ket_qua.so_loi} lỗi.'
+            )
+            if ket_qua.so_loi:
+                return render(request, 'products/product_import.html', {
+                    'form': NhapSanPhamForm(),
+                    'loi': ket_qua.loi[:200],
+                    'so_loi': ket_qua.so_loi,
+                })
+            return redirect('product_list')
+    else:
+        form = NhapSanPhamForm()
+    return render(request, 'products/product_import.html', {'form': form})
+
+
 @login_required
 def category_list(request):
     categories = DanhMucSanPham.objects.all()
@@ -1,3 +1,21 @@
 from django.test import TestCase
 
-# Create your tests here.
+from inventory.tests import NganSachTruyVanMixin, TruongHop
+
+
+class NganSachTruyVanBaoCaoTest(NganSachTruyVanMixin, TestCase):
+    URLCONF = 'reports.urls'
+
+    def cac_truong_hop(self):
+        kho = self.du_lieu['kho'][0]
+        return [
+            TruongHop('reports_dashboard', so_truy_van=12),
+            TruongHop('reports_dashboard', query='page=3', so_truy_van=12),
+            TruongHop('reports_dashboard_json', so_truy_van=12),
+            TruongHop('inventory_report', so_truy_van=7),
+            TruongHop('inventory_report', query=f'kho={kho.id}&q=Bút bi', so_truy_van=7),
+            TruongHop('inventory_report_json', query='page=2', so_truy_van=6),
+            TruongHop('import_export_report', so_truy_van=8),
+            TruongHop('import_export_report', query=f'kho={kho.id}', so_truy_van=8),
+            TruongHop('import_export_report_json', so_truy_van=7),
+        ]
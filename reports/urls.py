@@ -3,6 +3,9 @@ from . import views
 
 urlpatterns = [
     path('', views.reports_dashboard, name='reports_dashboard'),
+    path('json/', views.reports_dashboard, {'dinh_dang': 'json'}, name='reports_dashboard_json'),
     path('ton-kho/', views.inventory_report, name='inventory_report'),
+    path('ton-kho/json/', views.inventory_report, {'dinh_dang': 'json'}, name='inventory_report_json'),
     path('nhap-xuat/', views.import_export_report, name='import_export_report'),
-]
\ No newline at end of file
+    path('nhap-xuat/json/', views.import_export_report, {'dinh_dang': 'json'}, name='import_export_report_json'),
+]
@@ -1,76 +1,248 @@
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Count, Avg, Q
+from django.core.paginator import Paginator
+from django.db.models import Sum, Count, Avg, Q, F, DecimalField, ExpressionWrapper
+from django.http import JsonResponse
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, time, timedelta
 from products.models import SanPham
-from inventory.models import NhapKho, XuatKho  # ĐÃ SỬA TÊN
+from inventory.models import Kho, NhapKho, TonKho, DailyStockFlow  # ĐÃ SỬA TÊN
 from partners.models import NhaCungCap
-@login_required
-def reports_dashboard(request):
-    # Thống kê cơ bản
-    total_products = SanPham.objects.count()
-    total_suppliers = NhaCungCap.objects.count()
-
-    # Thống kê tồn kho
-    inventory_stats = SanPham.objects.aggregate(
-        total_inventory=Sum('ton_kho'),
-        avg_price=Avg('gia_ban'),
-        low_stock=Count('id', filter= Q(ton_kho__lt=10))
-    )
+from inventory.cache import BoNhoDem
 
-    # Thống kê nhập xuất tháng
-    today = timezone.now()
-    first_day = today.replace(day=1)
+SO_DONG_MOI_TRANG = 50
 
-    monthly_import = NhapKho.objects.filter(
-        ngay_tao__gte=first_day
-    ).aggregate(total=Sum('tong_tien'))['total'] or 0
+# Giá trị tồn kho = số lượng tồn x giá nhập, tính ngay trong SQL
+GIA_TRI_TON = ExpressionWrapper(
+    F('so_luong_ton') * F('san_pham__gia_nhap'),
+    output_field=DecimalField(max_digits=20, decimal_places=2)
+)
 
-    monthly_export = XuatKho.objects.filter(
-        ngay_tao__gte=first_day
-    ).aggregate(total=Sum('tong_tien'))['total'] or 0
 
-    # Top sản phẩm tồn kho nhiều
-    top_products = SanPham.objects.order_by('-ton_kho')[:10]
+def _doc_ngay(gia_tri, mac_dinh):
+    try:
+        return date.fromisoformat(gia_tri) if gia_tri else mac_dinh
+    except ValueError:
+        return mac_dinh
 
-    # Sản phẩm sắp hết hàng
-    low_stock_products = SanPham.objects.filter(ton_kho__lt=10)
 
-    context = {
-        'total_products': total_products,
-        'total_suppliers': total_suppliers,
-        'inventory_stats': inventory_stats,
-        'monthly_import': monthly_import,
-        'monthly_export': monthly_export,
-        'top_products': top_products,
-        'low_stock_products': low_stock_products,
+def _doc_so_nguyen(gia_tri):
+    try:
+        return int(gia_tri) if gia_tri else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _phan_trang(queryset, so_trang, moi_trang=SO_DONG_MOI_TRANG):
+    """Một trang của queryset dưới dạng dict (đệm được và trả JSON được)"""
+    page = Paginator(queryset, moi_trang).get_page(so_trang)
+    return {
+        'dong': list(page.object_list),
+        'trang': page.number,
+        'so_trang': page.paginator.num_pages,
+        'tong_so_dong': page.paginator.count,
     }
 
-    return render(request, 'reports/dashboard.html', context)
 
+def _tham_so_loc(request):
+    """Query string của bộ lọc hiện tại, bỏ số trang (dùng cho liên kết phân trang)"""
+    tham_so = request.GET.copy()
+    tham_so.pop('page', None)
+    return tham_so.urlencode()
+
+
+def _theo_kho(ton_kho):
+    """Tổng hợp tồn kho theo từng kho"""
+    return list(
+        ton_kho.values('kho_id', 'kho__ma_kho', 'kho__ten_kho')
+        .annotate(
+            so_san_pham=Count('id', filter=Q(so_luong_ton__gt=0)),
+            tong_ton=Sum('so_luong_ton'),
+            gia_tri_ton=Sum(GIA_TRI_TON),
+        )
+        .order_by('kho__ten_kho')
+    )
 
-@login_required
-def inventory_report(request):
-    products = SanPham.objects.all().order_by('-ton_kho')
-    return render(request, 'reports/inventory_report.html', {'products': products})
+
+def _tra_ve(request, dinh_dang, template, so_lieu, context):
+    if dinh_dang == 'json':
+        return JsonResponse(so_lieu, json_dumps_params={'ensure_ascii': False})
+    context.update(so_lieu)
+    context['tham_so_loc'] = _tham_so_loc(request)
+    return render(request, template, context)
 
 
 @login_required
-def import_export_report(request):
-    # Báo cáo nhập xuất 30 ngày gần đây
-    end_date = timezone.now()
-    start_date = end_date - timedelta(days=30)
+def reports_dashboard(request, dinh_dang='html'):
+    # Kỳ thống kê nhập xuất: mặc định từ đầu tháng đến hôm nay
+    hom_nay = timezone.localdate()
+    den_ngay = _doc_ngay(request.GET.get('den_ngay'), hom_nay)
+    tu_ngay = _doc_ngay(request.GET.get('tu_ngay'), den_ngay.replace(day=1))
+    so_trang = request.GET.get('page', 1)
+
+    def tinh():
+        ton_kho = TonKho.objects.all()
+
+        # Thống kê tồn kho: một truy vấn gộp trên TonKho
+        inventory_stats = ton_kho.aggregate(
+            total_inventory=Sum('so_luong_ton'),
+            inventory_value=Sum(GIA_TRI_TON),
+            low_stock=Count('id', filter=Q(sap_het=True)),
+        )
+        inventory_stats['avg_price'] = SanPham.objects.aggregate(avg=Avg('gia_ban'))['avg']
+
+        # Thống kê nhập xuất trong kỳ: giá trị nhập từ phiếu nhập, số lượng từ bảng lưu chuyển
+        bat_dau = timezone.make_aware(datetime.combine(tu_ngay, time.min))
+        ket_thuc = timezone.make_aware(datetime.combine(den_ngay + timedelta(days=1), time.min))
+        monthly_import = NhapKho.objects.filter(
+            ngay_nhap__gte=bat_dau, ngay_nhap__lt=ket_thuc
+        ).aggregate(total=Sum('tong_tien'))['total'] or 0
+        luu_chuyen = DailyStockFlow.objects.filter(ngay__range=[tu_ngay, den_ngay]).aggregate(
+            nhap=Sum('so_luong_nhap'), xuat=Sum('so_luong_xuat')
+        )
+
+        # Top sản phẩm tồn kho nhiều (cộng mọi kho)
+        top_products = list(
+            ton_kho.values('san_pham_id', 'san_pham__ma_san_pham', 'san_pham__ten_san_pham')
+            .annotate(tong_ton=Sum('so_luong_ton'))
+            .order_by('-tong_ton')[:10]
+        )
+
+        # Sản phẩm sắp hết hàng theo từng kho, phân trang
+        low_stock_products = _phan_trang(
+            ton_kho.filter(sap_het=True)
+            .values(
+                'kho_id', 'kho__ten_kho', 'san_pham_id', 'san_pham__ma_san_pham',
+                'san_pham__ten_san_pham', 'so_luong_ton', 'muc_toi_thieu'
+            )
+            .order_by('so_luong_ton', 'san_pham__ten_san_pham', 'kho_id'),
+            so_trang
+        )
+
+        return {
+            'tu_ngay': tu_ngay,
+            'den_ngay': den_ngay,
+            'total_products': SanPham.objects.count(),
+            'total_suppliers': NhaCungCap.objects.count(),
+            'inventory_stats': inventory_stats,
+            'monthly_import': monthly_import,
+            'monthly_import_quantity': luu_chuyen['nhap'] or 0,
+            'monthly_export_quantity': luu_chuyen['xuat'] or 0,
+            'theo_kho': _theo_kho(ton_kho),
+            'top_products': top_products,
+            'low_stock_products': low_stock_products,
+        }
+
+    so_lieu = BoNhoDem.lay_hoac_tinh(
+        'reports_dashboard',
+        ['nhap_kho', 'ton_kho', 'luu_chuyen', 'san_pham', 'kho', 'doi_tac'],
+        tinh,
+        tham_so=(tu_ngay, den_ngay, so_trang),
+    )
+    return _tra_ve(request, dinh_dang, 'reports/dashboard.html', so_lieu, {})
 
-    imports = NhapKho.objects.filter(ngay_tao__range=[start_date, end_date])
-    exports = XuatKho.objects.filter(ngay_tao__range=[start_date, end_date])
 
+@login_required
+def inventory_report(request, dinh_dang='html'):
+    # Báo cáo tồn kho theo sản phẩm, lọc theo kho/danh mục/từ khóa
+    kho_id = _doc_so_nguyen(request.GET.get('kho'))
+    danh_muc_id = _doc_so_nguyen(request.GET.get('danh_muc'))
+    q = request.GET.get('q', '').strip()
+    so_trang = request.GET.get('page', 1)
+
+    def tinh():
+        ton_kho = TonKho.objects.all()
+        if kho_id:
+            ton_kho = ton_kho.filter(kho_id=kho_id)
+        if danh_muc_id:
+            ton_kho = ton_kho.filter(san_pham__danh_muc_id=danh_muc_id)
+        if q:
+            ton_kho = ton_kho.filter(
+                Q(san_pham__ma_san_pham__icontains=q) | Q(san_pham__ten_san_pham__icontains=q)
+            )
+
+        theo_san_pham = (
+            ton_kho.values(
+                'san_pham_id', 'san_pham__ma_san_pham', 'san_pham__ten_san_pham',
+                'san_pham__danh_muc__ten_danh_muc', 'san_pham__gia_nhap'
+            )
+            .annotate(
+                tong_ton=Sum('so_luong_ton'),
+                tong_kha_dung=Sum('so_luong_kha_dung'),
+                gia_tri_ton=Sum(GIA_TRI_TON),
+                so_kho=Count('kho_id', filter=Q(so_luong_ton__gt=0)),
+            )
+            .order_by('-tong_ton', 'san_pham__ten_san_pham')
+        )
+
+        return {
+            'kho': kho_id,
+            'danh_muc': danh_muc_id,
+            'q': q,
+            'tong': ton_kho.aggregate(tong_ton=Sum('so_luong_ton'), gia_tri_ton=Sum(GIA_TRI_TON)),
+            'theo_kho': _theo_kho(ton_kho),
+            'san_pham': _phan_trang(theo_san_pham, so_trang),
+        }
+
+    so_lieu = BoNhoDem.lay_hoac_tinh(
+        'inventory_report',
+        ['ton_kho', 'san_pham', 'kho'],
+        tinh,
+        tham_so=(kho_id, danh_muc_id, q, so_trang),
+    )
     context = {
-        'imports': imports,
-        'exports': exports,
-        'start_date': start_date,
-        'end_date': end_date,
+        'danh_sach_kho': Kho.objects.order_by('ten_kho').values('id', 'ten_kho'),
     }
+    return _tra_ve(request, dinh_dang, 'reports/inventory_report.html', so_lieu, context)
+
 
-    return render(request, 'reports/import_export_report.html', context)
\ No newline at end of file
+@login_required
+def import_export_report(request, dinh_dang='html'):
+    # Báo cáo nhập xuất theo kỳ (mặc định 30 ngày gần đây), đọc từ bảng lưu chuyển theo ngày
+    den_ngay = _doc_ngay(request.GET.get('den_ngay'), timezone.localdate())
+    tu_ngay = _doc_ngay(request.GET.get('tu_ngay'), den_ngay - timedelta(days=30))
+    kho_id = _doc_so_nguyen(request.GET.get('kho'))
+    so_trang = request.GET.get('page', 1)
+
+    def tinh():
+        luu_chuyen = DailyStockFlow.objects.filter(ngay__range=[tu_ngay, den_ngay])
+        if kho_id:
+            luu_chuyen = luu_chuyen.filter(kho_id=kho_id)
+        tong_cot = dict(
+            so_luong_nhap=Sum('so_luong_nhap'),
+            gia_tri_nhap=Sum('gia_tri_nhap'),
+            so_luong_nhan=Sum('so_luong_nhan'),
+            so_luong_xuat=Sum('so_luong_xuat'),
+        )
+
+        theo_ngay = luu_chuyen.values('ngay').annotate(**tong_cot).order_by('ngay')
+        theo_kho = (
+            luu_chuyen.values('kho_id', 'kho__ma_kho', 'kho__ten_kho')
+            .annotate(**tong_cot)
+            .order_by('kho__ten_kho')
+        )
+        theo_san_pham = (
+            luu_chuyen.values('san_pham_id', 'san_pham__ma_san_pham', 'san_pham__ten_san_pham')
+            .annotate(**tong_cot)
+            .order_by('-so_luong_nhap', 'san_pham__ten_san_pham')
+        )
+
+        return {
+            'tu_ngay': tu_ngay,
+            'den_ngay': den_ngay,
+            'kho': kho_id,
+            'tong': luu_chuyen.aggregate(**tong_cot),
+            'theo_ngay': list(theo_ngay),
+            'theo_kho': list(theo_kho),
+            'san_pham': _phan_trang(theo_san_pham, so_trang),
+        }
+
+    so_lieu = BoNhoDem.lay_hoac_tinh(
+        'import_export_report', ['luu_chuyen', 'san_pham', 'kho'], tinh,
+        tham_so=(tu_ngay, den_ngay, kho_id, so_trang)
+    )
+    context = {
+        'danh_sach_kho': Kho.objects.order_by('ten_kho').values('id', 'ten_kho'),
+    }
+    return _tra_ve(request, dinh_dang, 'reports/import_export_report.html', so_lieu, context)
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,6 +38,8 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
+    # Đứng đầu để thời gian đo bao gồm cả các middleware phía sau
+    'inventory.middleware.GiamSatHieuNangMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,9 +73,71 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # CSDL test dạng file để các test đa luồng dùng được nhiều kết nối
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# Bộ nhớ đệm cho dashboard/báo cáo (khóa theo phiên bản dữ liệu, xem inventory/cache.py).
+# Môi trường chạy nhiều tiến trình nên dùng cache dùng chung (Redis/Memcached) để
+# việc tăng phiên bản có hiệu lực cho mọi tiến trình.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'warehouse-management',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
     }
 }
 
+# Giám sát hiệu năng từng request (inventory/middleware.py): số truy vấn, thời gian SQL,
+# các câu chậm nhất. Vượt ngân sách dưới đây thì ghi log mức WARNING.
+# Khóa là tên view đã resolve ('namespace:ten' hoặc 'ten'), '*' là mặc định;
+# giá trị là số truy vấn tối đa hoặc dict {'truy_van': n, 'ms': thời gian tối đa}.
+QUERY_BUDGETS = {
+    '*': {'truy_van': 30, 'ms': 1000},
+    'dashboard': 15,
+    'inventory:nhapkho_list': 10,
+    'inventory:nhap_kho_create': 40,
+    'inventory:xuatkho_form': 40,
+    'inventory:xuatkho_list': 10,
+    'inventory:danh_sach_kiem_ke': 10,
+    'inventory:chi_tiet_ton_kho': 10,
+    'inventory:ma_tran_ton_kho': 10,
+    'inventory:ma_tran_ton_kho_json': 8,
+    'inventory:ton_kho_hang_loat_api': 5,
+    'inventory:tim_kiem_chung_tu': 5,
+    'product_autocomplete': 5,
+    'reports_dashboard': 15,
+    'inventory_report': 10,
+    'import_export_report': 10,
+}
+HIEU_NANG_SO_CAU_CHAM = 5
+
+# Mỗi request ghi một dòng JSON vào logger 'inventory.hieu_nang'
+# (khi chạy test chỉ ghi các request vượt ngân sách)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json_dong': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'hieu_nang': {'class': 'logging.StreamHandler', 'formatter': 'json_dong'},
+    },
+    'loggers': {
+        'inventory.hieu_nang': {
+            'handlers': ['hieu_nang'],
+            'level': 'WARNING' if 'test' in sys.argv else os.environ.get('HIEU_NANG_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',